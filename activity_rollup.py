@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Hourly rollups of user_activity_log
+Closed hours are folded into per-hour counters by role, action and user so
+the admin activity summary reads a few thousand bucket rows instead of
+scanning the log. Only the tail after the rollup watermark (normally the
+current hour) is read from the log itself. Hours are in the session time
+zone, like created_at. Migration 8 backfills the history; the app then only
+folds the hours closed since.
+Run manually: python activity_rollup.py catch-up | status
+"""
+
+import hashlib
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, cast, Dict, List, Optional
+
+LOCK_NAME = 'irequest_activity_rollup'
+
+# An hour is rolled up once it has been closed this long, so entries still
+# being committed at the boundary are not missed
+GRACE = "INTERVAL 1 MINUTE"
+
+_HOUR_FMT = "'%%Y-%%m-%%d %%H:00:00'"
+
+# Seconds before a failed catch-up is retried
+RETRY_SECONDS = 60.0
+
+_state_lock = threading.Lock()
+_next_check = 0.0
+
+
+def _user_key(identifier: str, display_name: str) -> str:
+    return f"{identifier or ''}|{display_name or ''}"
+
+
+def _md5(value: str) -> str:
+    return hashlib.md5(value.encode('utf-8')).hexdigest()
+
+
+def due() -> bool:
+    """True when this process has not rolled up since the last hour closed"""
+    return time.monotonic() >= _next_check
+
+
+def _schedule(seconds: float) -> None:
+    global _next_check
+    with _state_lock:
+        _next_check = time.monotonic() + max(30.0, seconds)
+
+
+def retry_soon() -> None:
+    """A catch-up failed (or was rolled back): try again in a minute rather than at the next hour"""
+    _schedule(RETRY_SECONDS)
+
+
+def watermark(cur) -> Optional[datetime]:
+    """Start of the first hour not yet rolled up (None before the first rollup)"""
+    cur.execute("SELECT rolled_until FROM activity_log_rollup_state WHERE id = 1")
+    row = cur.fetchone() or {}
+    return row.get('rolled_until')
+
+
+def catch_up(cur) -> int:
+    """
+    Fold every closed hour after the watermark into the bucket tables
+
+    Run inside a transaction so the buckets and the watermark move together.
+    Another worker already rolling up is not waited for. Returns the number
+    of hours rolled up. The next check is scheduled for the next closed hour
+    only when this returns; callers whose commit fails call retry_soon().
+    """
+    cur.execute(f"SELECT DATE_FORMAT(NOW() - {GRACE}, {_HOUR_FMT}) AS upto, "
+                f"TIMESTAMPDIFF(SECOND, NOW(), DATE_FORMAT(NOW() - {GRACE}, {_HOUR_FMT}) "
+                f"+ INTERVAL 1 HOUR + {GRACE}) AS wait", ())
+    row = cur.fetchone() or {}
+    upto = datetime.strptime(str(row['upto']), '%Y-%m-%d %H:%M:%S')
+    wait = float(row.get('wait') or 0)
+
+    since = watermark(cur)
+    if since is not None and since >= upto:
+        _schedule(wait)
+        return 0
+    cur.execute("SELECT GET_LOCK(%s, 0) AS got", (LOCK_NAME,))
+    if not (cur.fetchone() or {}).get('got'):
+        # Another worker is folding these hours; look again shortly
+        retry_soon()
+        return 0
+    try:
+        since = watermark(cur)
+        if since is None:
+            cur.execute(f"SELECT DATE_FORMAT(MIN(created_at), {_HOUR_FMT}) AS first FROM user_activity_log", ())
+            first = (cur.fetchone() or {}).get('first')
+            since = datetime.strptime(str(first), '%Y-%m-%d %H:%M:%S') if first else upto
+        if since >= upto:
+            cur.execute("UPDATE activity_log_rollup_state SET rolled_until = %s WHERE id = 1", (upto,))
+            _schedule(wait)
+            return 0
+        window = (since, upto)
+        cur.execute(
+            f"""
+            INSERT INTO activity_log_hourly_roles (bucket, user_type, count)
+            SELECT DATE_FORMAT(created_at, {_HOUR_FMT}), user_type, COUNT(*)
+            FROM user_activity_log
+            WHERE created_at >= %s AND created_at < %s
+            GROUP BY 1, 2
+            ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+            """,
+            window
+        )
+        cur.execute(
+            f"""
+            INSERT INTO activity_log_hourly_actions (bucket, action_hash, action, count)
+            SELECT DATE_FORMAT(created_at, {_HOUR_FMT}), MD5(action), MAX(action), COUNT(*)
+            FROM user_activity_log
+            WHERE created_at >= %s AND created_at < %s
+            GROUP BY 1, 2
+            ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+            """,
+            window
+        )
+        cur.execute(
+            f"""
+            INSERT INTO activity_log_hourly_users (bucket, user_hash, user_identifier, user_display_name, count)
+            SELECT DATE_FORMAT(created_at, {_HOUR_FMT}), MD5(CONCAT(user_identifier, '|', user_display_name)),
+                   MAX(user_identifier), MAX(user_display_name), COUNT(*)
+            FROM user_activity_log
+            WHERE created_at >= %s AND created_at < %s
+            GROUP BY 1, 2
+            ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+            """,
+            window
+        )
+        cur.execute("UPDATE activity_log_rollup_state SET rolled_until = %s WHERE id = 1", (upto,))
+        _schedule(wait)
+        return int((upto - since).total_seconds() // 3600)
+    finally:
+        cur.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        cur.fetchall()
+
+
+def _top(cur, table: str, key: str, columns: str, start: datetime, stop: datetime,
+         tail: Counter, labels: Dict[str, Any], limit: int) -> List[Any]:
+    """Exact top-`limit` over buckets + tail: the buckets' own top plus every key seen in the tail"""
+    totals: Counter = Counter()
+    if stop > start:
+        cur.execute(
+            f"""
+            SELECT {key} AS k, {columns}, SUM(count) AS c FROM {table}
+            WHERE bucket >= %s AND bucket < %s
+            GROUP BY {key} ORDER BY c DESC LIMIT %s
+            """,
+            (start, stop, limit)
+        )
+        rows = list(cur.fetchall() or [])
+        extra = [k for k in tail if k not in {r['k'] for r in rows}]
+        if extra:
+            placeholders = ','.join(['%s'] * len(extra))
+            cur.execute(
+                f"""
+                SELECT {key} AS k, {columns}, SUM(count) AS c FROM {table}
+                WHERE bucket >= %s AND bucket < %s AND {key} IN ({placeholders})
+                GROUP BY {key}
+                """,
+                (start, stop, *extra)
+            )
+            rows.extend(cur.fetchall() or [])
+        for r in rows:
+            totals[r['k']] += int(r['c'] or 0)
+            labels.setdefault(r['k'], r)
+    totals.update(tail)
+    return [(k, labels[k], n) for k, n in sorted(totals.items(), key=lambda kv: -kv[1])[:limit]]
+
+
+def summary(cur, start: datetime, end: datetime) -> Dict[str, Any]:
+    """Totals, by role/day/hour, top actions and top users for created_at in [start, end)"""
+    mark = watermark(cur)
+    # Buckets cover [start, stop); the log itself covers [stop, end)
+    stop = min(end, mark) if mark is not None else start
+    stop = max(stop, start)
+
+    by_role = {'student': 0, 'staff': 0, 'admin': 0}
+    by_day: Counter = Counter()
+    by_hour: Counter = Counter()
+    total = 0
+
+    def count(bucket: datetime, user_type: str, n: int) -> None:
+        nonlocal total
+        total += n
+        t = (user_type or '').lower()
+        if t in by_role:
+            by_role[t] += n
+        by_day[bucket.date()] += n
+        by_hour[bucket.hour] += n
+
+    if stop > start:
+        cur.execute(
+            "SELECT bucket, user_type, count FROM activity_log_hourly_roles WHERE bucket >= %s AND bucket < %s",
+            (start, stop)
+        )
+        for r in cur.fetchall() or []:
+            count(r['bucket'], r['user_type'], int(r['count'] or 0))
+
+    action_tail: Counter = Counter()
+    user_tail: Counter = Counter()
+    labels_action: Dict[str, Any] = {}
+    labels_user: Dict[str, Any] = {}
+    if end > stop:
+        cur.execute(
+            f"""
+            SELECT DATE_FORMAT(created_at, {_HOUR_FMT}) AS bucket, user_type, action,
+                   user_identifier, user_display_name, COUNT(*) AS c
+            FROM user_activity_log
+            WHERE created_at >= %s AND created_at < %s
+            GROUP BY 1, 2, 3, 4, 5
+            """,
+            (stop, end)
+        )
+        for r in cur.fetchall() or []:
+            n = int(r['c'] or 0)
+            count(datetime.strptime(str(r['bucket']), '%Y-%m-%d %H:%M:%S'), r['user_type'], n)
+            ak = _md5(r['action'] or '')
+            action_tail[ak] += n
+            labels_action.setdefault(ak, r)
+            uk = _md5(_user_key(r['user_identifier'], r['user_display_name']))
+            user_tail[uk] += n
+            labels_user.setdefault(uk, r)
+
+    top_actions = [
+        {'action': (row.get('action') or '')[:500], 'count': n}
+        for _, row, n in _top(cur, 'activity_log_hourly_actions', 'action_hash', 'MAX(action) AS action',
+                              start, stop, action_tail, labels_action, 15)
+    ]
+    top_users = [
+        {'user_identifier': row.get('user_identifier') or '', 'user_display_name': row.get('user_display_name') or '',
+         'count': n}
+        for _, row, n in _top(cur, 'activity_log_hourly_users', 'user_hash',
+                              'MAX(user_identifier) AS user_identifier, MAX(user_display_name) AS user_display_name',
+                              start, stop, user_tail, labels_user, 10)
+    ]
+    return {
+        'total': total,
+        'by_role': by_role,
+        'by_day': [{'date': d.isoformat(), 'count': n} for d, n in sorted(by_day.items())],
+        'by_hour': [{'hour': h, 'count': by_hour.get(h, 0)} for h in range(24)],
+        'top_actions': top_actions,
+        'top_users': top_users,
+    }
+
+
+def day_bounds(start: str, end: str):
+    """[start 00:00, day after end 00:00) for YYYY-MM-DD strings, as index-friendly created_at bounds"""
+    lo = datetime.strptime(start, '%Y-%m-%d')
+    hi = datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1)
+    return lo, hi
+
+
+def main(argv: List[str]) -> int:
+    import pymysql
+    from db_migrations import get_db_config
+
+    command = argv[0] if argv else 'catch-up'
+    connection = pymysql.connect(**get_db_config())
+    try:
+        with connection.cursor() as cur:
+            if command == 'status':
+                cur.execute("SELECT COUNT(*) AS n, MIN(bucket) AS first FROM activity_log_hourly_roles")
+                row = cast(Dict[str, Any], cur.fetchone() or {})
+                print(f"📋 activity_log_hourly_roles: {row.get('n') or 0} rows from {row.get('first')}, "
+                      f"rolled up until {watermark(cur)}")
+                return 0
+            if command != 'catch-up':
+                print("Usage: python activity_rollup.py catch-up | status")
+                return 2
+            connection.begin()
+            try:
+                hours = catch_up(cur)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            print(f"✅ Rolled up {hours} hour(s) of user_activity_log (until {watermark(cur)})")
+            return 0
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
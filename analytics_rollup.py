@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Monthly rollup for registrar analytics
+analytics_monthly_counts holds one counter per (month, source, document,
+status, course). Request writes and status transitions adjust it by the
+difference between a request's contribution before and after the statement,
+so the analytics endpoints read a few hundred rows instead of every request
+ever filed.
+Sources: 'document' (standalone document_requests), 'clearance_document'
+(document_requests created from a clearance) and 'clearance' (one row per
+item in clearance_requests.documents).
+Run manually: python analytics_rollup.py rebuild [YYYY-MM] | status
+"""
+
+import json
+import sys
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Any, cast, Dict, Iterable, Iterator, List, Optional, Tuple
+
+TABLE = 'analytics_monthly_counts'
+
+SOURCE_DOCUMENT = 'document'
+SOURCE_CLEARANCE_DOCUMENT = 'clearance_document'
+SOURCE_CLEARANCE = 'clearance'
+
+# (month, source, document, status, course_name, course_code)
+Key = Tuple[date, str, str, str, str, str]
+
+_CANONICAL_STATUS = {s.lower(): s for s in (
+    'Pending', 'Processing', 'Approved', 'Completed', 'Released', 'Unclaimed', 'Rejected',
+)}
+
+_QUERIES = {
+    'document': """
+        SELECT dr.id, dr.created_at, dr.document_type, dr.status, dr.clearance_request_id,
+               s.course_name, s.course_code
+        FROM document_requests dr
+        LEFT JOIN students s ON s.id = dr.student_id
+    """,
+    'clearance': """
+        SELECT cr.id, cr.created_at, cr.documents, cr.fulfillment_status AS status,
+               s.course_name, s.course_code
+        FROM clearance_requests cr
+        LEFT JOIN students s ON s.id = cr.student_id
+    """,
+}
+_ALIAS = {'document': 'dr', 'clearance': 'cr'}
+
+_BATCH = 2000
+
+
+def month_start(value: Any) -> date:
+    return date(value.year, value.month, 1)
+
+
+def next_month(value: date) -> date:
+    return date(value.year + 1, 1, 1) if value.month == 12 else date(value.year, value.month + 1, 1)
+
+
+def canonical_status(raw: Any) -> str:
+    s = str(raw or '').strip()
+    return _CANONICAL_STATUS.get(s.lower(), s)[:20]
+
+
+def document_items(raw: Any) -> List[str]:
+    """Document names in a clearance_requests.documents value (JSON list, JSON string or plain text)"""
+    if raw is None:
+        return []
+    if isinstance(raw, (bytes, bytearray)):
+        raw = raw.decode('utf-8', errors='replace')
+    try:
+        parsed = json.loads(raw)
+    except (TypeError, ValueError):
+        parsed = raw
+    if isinstance(parsed, str):
+        parsed = [parsed]
+    if not isinstance(parsed, list):
+        return []
+    return [str(x).strip()[:255] for x in parsed if x is not None and str(x).strip()]
+
+
+def _keys(kind: str, row: Dict[str, Any]) -> List[Key]:
+    created = row.get('created_at')
+    if not created:
+        return []
+    month = month_start(created)
+    course = ((row.get('course_name') or '').strip()[:150], (row.get('course_code') or '').strip()[:50])
+    status = canonical_status(row.get('status'))
+    if kind == 'document':
+        source = SOURCE_CLEARANCE_DOCUMENT if row.get('clearance_request_id') else SOURCE_DOCUMENT
+        document = str(row.get('document_type') or '').strip()[:255]
+        return [(month, source, document, status) + course]
+    return [(month, SOURCE_CLEARANCE, document, status) + course for document in document_items(row.get('documents'))]
+
+
+def contribution(cur, kind: str, ids: Iterable[Any]) -> Counter:
+    """Counters the given requests currently add to the rollup (rows locked inside a transaction)"""
+    ids = [i for i in ids if i is not None]
+    counts: Counter = Counter()
+    if not ids:
+        return counts
+    alias = _ALIAS[kind]
+    placeholders = ','.join(['%s'] * len(ids))
+    cur.execute(_QUERIES[kind] + f" WHERE {alias}.id IN ({placeholders}) FOR UPDATE OF {alias}", tuple(ids))
+    for row in cur.fetchall() or []:
+        counts.update(_keys(kind, row))
+    return counts
+
+
+def apply(cur, before: Counter, after: Counter) -> None:
+    """Add after - before to the rollup"""
+    delta = Counter(after)
+    delta.subtract(before)
+    rows = [key + (n,) for key, n in delta.items() if n]
+    if not rows:
+        return
+    cur.executemany(
+        f"""
+        INSERT INTO {TABLE} (month, source, document, status, course_name, course_code, count)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+        """,
+        rows
+    )
+
+
+def _as_ids(ids: Any) -> List[Any]:
+    if ids is None:
+        return []
+    if isinstance(ids, (list, tuple, set, frozenset)):
+        return list(ids)
+    return [ids]
+
+
+@contextmanager
+def tracked(cur, kind: str, ids: Any) -> Iterator[None]:
+    """
+    Keep the rollup in step with statements run inside the block
+
+    kind is 'document' or 'clearance'; ids are the request ids the block may
+    update or delete. Rollup errors are logged, never raised: a drifted
+    counter is repaired by a rebuild, a failed status change is not.
+    """
+    ids = _as_ids(ids)
+    try:
+        before: Optional[Counter] = contribution(cur, kind, ids)
+    except Exception as e:
+        print(f"⚠️ Analytics rollup snapshot failed: {e}")
+        before = None
+    yield
+    if before is None:
+        return
+    try:
+        apply(cur, before, contribution(cur, kind, ids))
+    except Exception as e:
+        print(f"⚠️ Analytics rollup update failed (run: python analytics_rollup.py rebuild): {e}")
+
+
+@contextmanager
+def tracked_document(cur, ids: Any) -> Iterator[None]:
+    """tracked() for document requests plus the clearance requests they were created from"""
+    ids = _as_ids(ids)
+    linked: List[Any] = []
+    if ids:
+        try:
+            placeholders = ','.join(['%s'] * len(ids))
+            cur.execute(
+                f"SELECT clearance_request_id FROM document_requests WHERE id IN ({placeholders}) "
+                "AND clearance_request_id IS NOT NULL",
+                tuple(ids)
+            )
+            linked = sorted({r['clearance_request_id'] for r in cur.fetchall() or []})
+        except Exception as e:
+            print(f"⚠️ Analytics rollup snapshot failed: {e}")
+    with tracked(cur, 'document', ids), tracked(cur, 'clearance', linked):
+        yield
+
+
+def added(cur, kind: str, ids: Any) -> None:
+    """Count requests that were just inserted"""
+    try:
+        apply(cur, Counter(), contribution(cur, kind, _as_ids(ids)))
+    except Exception as e:
+        print(f"⚠️ Analytics rollup update failed (run: python analytics_rollup.py rebuild): {e}")
+
+
+def collect(cur, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Counter:
+    """Counters computed from the request tables for created_at in [start, end)"""
+    counts: Counter = Counter()
+    for kind, alias in _ALIAS.items():
+        last_id = 0
+        while True:
+            where = [f"{alias}.id > %s"]
+            params: List[Any] = [last_id]
+            if start is not None:
+                where.append(f"{alias}.created_at >= %s")
+                params.append(start)
+            if end is not None:
+                where.append(f"{alias}.created_at < %s")
+                params.append(end)
+            cur.execute(
+                _QUERIES[kind] + " WHERE " + " AND ".join(where) + f" ORDER BY {alias}.id LIMIT {_BATCH}",
+                tuple(params)
+            )
+            rows = cur.fetchall() or []
+            for row in rows:
+                counts.update(_keys(kind, row))
+            if len(rows) < _BATCH:
+                break
+            last_id = rows[-1]['id']
+    return counts
+
+
+def rebuild(cur, since: Optional[date] = None) -> int:
+    """Recompute the rollup from the request tables (from month `since` onwards); returns counters written"""
+    since = month_start(since) if since else None
+    counts = collect(cur, datetime.combine(since, datetime.min.time()) if since else None)
+    if since:
+        cur.execute(f"DELETE FROM {TABLE} WHERE month >= %s", (since,))
+    else:
+        cur.execute(f"DELETE FROM {TABLE}")
+    rows = [key + (n,) for key, n in counts.items() if n > 0]
+    for i in range(0, len(rows), _BATCH):
+        # Keys differing only in case/accents are distinct here but one row under the
+        # table's _ci collation: add them up there, as apply() does
+        cur.executemany(
+            f"""
+            INSERT INTO {TABLE} (month, source, document, status, course_name, course_code, count)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+            """,
+            rows[i:i + _BATCH]
+        )
+    return len(rows)
+
+
+def load(cur, start: datetime, end: datetime, now: Optional[datetime] = None) -> Counter:
+    """
+    Counters for created_at in [start, end)
+
+    Whole months come from the rollup. A month the range only partly covers
+    (e.g. "last 6 months" starting mid-month) is counted from the request
+    tables for just that slice; a range ending in the future covers the rest
+    of its last month, since nothing has been filed there yet.
+    """
+    now = now or datetime.now()
+    counts: Counter = Counter()
+    full: List[date] = []
+    month = month_start(start)
+    while datetime.combine(month, datetime.min.time()) < end:
+        following = next_month(month)
+        lo = datetime.combine(month, datetime.min.time())
+        hi = datetime.combine(following, datetime.min.time())
+        if start <= lo and (end >= hi or end > now):
+            full.append(month)
+        else:
+            counts.update(collect(cur, max(start, lo), min(end, hi)))
+        month = following
+    if full:
+        cur.execute(
+            f"""
+            SELECT month, source, document, status, course_name, course_code, count
+            FROM {TABLE}
+            WHERE month >= %s AND month <= %s AND count > 0
+            """,
+            (full[0], full[-1])
+        )
+        for row in cur.fetchall() or []:
+            counts[(month_start(row['month']), row['source'], row['document'], row['status'],
+                    row['course_name'], row['course_code'])] += int(row['count'])
+    return counts
+
+
+def document_names(cur) -> List[str]:
+    """Every document name that appears in at least one request"""
+    cur.execute(f"SELECT DISTINCT document FROM {TABLE} WHERE document != '' AND count > 0")
+    return sorted({str(r['document']).strip() for r in cur.fetchall() or []}, key=lambda s: s.lower())
+
+
+def main(argv: List[str]) -> int:
+    import pymysql
+    from db_migrations import get_db_config
+
+    command = argv[0] if argv else 'rebuild'
+    connection = pymysql.connect(**get_db_config())
+    try:
+        with connection.cursor() as cur:
+            if command == 'status':
+                cur.execute(f"SELECT COUNT(*) AS n, MIN(month) AS first, MAX(month) AS last, SUM(count) AS total FROM {TABLE}")
+                row = cast(Dict[str, Any], cur.fetchone() or {})
+                print(f"📋 {TABLE}: {row.get('n') or 0} rows, {row.get('total') or 0} counted, "
+                      f"{row.get('first')} .. {row.get('last')}")
+                return 0
+            if command != 'rebuild':
+                print("Usage: python analytics_rollup.py rebuild [YYYY-MM] | status")
+                return 2
+            since = None
+            if len(argv) > 1:
+                since = datetime.strptime(argv[1], '%Y-%m').date()
+            connection.begin()
+            try:
+                written = rebuild(cur, since)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            print(f"✅ Rebuilt {TABLE}{' from ' + argv[1] if since else ''}: {written} rows")
+            return 0
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
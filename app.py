@@ -5,7 +5,7 @@ try:
 except ImportError:
   pymysql = None
   DictCursor = None
-from flask import Flask, request, redirect, url_for, render_template_string, jsonify, session, render_template, send_from_directory
+from flask import Flask, request, redirect, url_for, render_template_string, jsonify, session, render_template, send_from_directory, send_file, g, has_request_context
 from flask_cors import CORS
 try:
   from flask_mysqldb import MySQL
@@ -13,7 +13,26 @@ except ImportError:
   MySQL = None
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
-from typing import Any, cast, Optional, Tuple, Union
+from typing import Any, cast, Dict, Optional, Tuple, Union
+from contextlib import contextmanager
+from db_pool import ConnectionPool, PoolTimeout, ReplicaLagMonitor, Transaction
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from groq_client import BUCKET_REQUESTS, BUCKET_TOKENS, GroqClient
+import receipt_ai
+import db_migrations
+import analytics_rollup
+import activity_rollup
+import payment_references
+from schema_catalog import SchemaCatalog
+from query_stats import InstrumentedCursor, QueryDeadlineExceeded, QueryRecorder, QueryStats
+from slow_query_log import SlowQueryLog
+from stale_cache import StaleCache
+from cache_layer import Cache
+from registry_index import RegistryIndex
+from single_flight import SingleFlight
+from receipt_jobs import QueueFull, ReceiptJobQueue
+from rate_limiter import RateLimiter
+from static_assets import BuiltAssets
 
 # Load environment variables from .env file
 try:
@@ -79,6 +98,7 @@ try:
 except ImportError:
   ZoneInfo = None
 import base64
+import hashlib
 import json
 import requests
 import re
@@ -103,399 +123,21 @@ except ImportError:
   NoCredentialsError = Exception
 
 # --- Payment verification helpers ---
-# Network connectivity test for AI service
+# AI service status for the dashboard's "Test Connection" button
 def _test_ai_connectivity():
-  """Test if the AI service is reachable"""
-  try:
-    import socket
-    import ssl
-    
-    # Test DNS resolution
-    try:
-      socket.gethostbyname('api.groq.com')
-    except socket.gaierror:
-      return False, "Cannot resolve AI service domain name"
-    
-    # Test HTTPS connection
-    try:
-      context = ssl.create_default_context()
-      with socket.create_connection(('api.groq.com', 443), timeout=10) as sock:
-        with context.wrap_socket(sock, server_hostname='api.groq.com') as ssock:
-          return True, "AI service is reachable"
-    except (socket.timeout, ssl.SSLError, ConnectionRefusedError) as e:
-      return False, f"Cannot connect to AI service: {str(e)}"
-      
-  except Exception as e:
-    return False, f"Network test failed: {str(e)}"
+  """Whether AI calls are going through, read from the Groq client's circuit breaker (no network I/O)"""
+  if groq is None:
+    return False, "AI client not initialised"
+  return groq.health()
 
-# Manual extraction fallback when JSON parsing fails
-def _manual_extract_from_text(text: str):
-  """Manually extract data from malformed JSON text using regex"""
-  import re as _re
-  try:
-    # Extract amount
-    amount = None
-    amount_match = _re.search(r'"amount":\s*"?([^",}]+)"?', text)
-    if amount_match:
-      amt_str = _re.sub(r'[^\d\.]', '', amount_match.group(1))
-      try:
-        amount = float(amt_str) if amt_str else None
-      except:
-        amount = None
-    
-    # Extract reference number
-    ref = ''
-    ref_match = _re.search(r'"reference_number":\s*"?([^",}]+)"?', text)
-    if ref_match:
-      ref = _re.sub(r'\D', '', ref_match.group(1))
-    
-    # Extract raw text
-    raw_text = ''
-    raw_match = _re.search(r'"raw_text":\s*"([^"]*)', text)
-    if raw_match:
-      raw_text = raw_match.group(1)
-    
-    # Extract confidence
-    confidence = 0.0
-    conf_match = _re.search(r'"confidence_score":\s*"?([^",}]+)"?', text)
-    if conf_match:
-      try:
-        confidence = float(conf_match.group(1))
-      except:
-        confidence = 0.0
-    
-    print(f"DEBUG: Manual extraction - amount: {amount}, ref: {ref}, confidence: {confidence}")
-    
-    return {
-      'amount': amount,
-      'reference_number': ref,
-      'confidence': confidence,
-      'raw_text': raw_text,
-    }
-  except Exception as e:
-    print(f"DEBUG: Manual extraction failed: {e}")
-    return None
-
-# AI-powered extractor (accurate reference number and amount)
-def _extract_ref_amount_from_ai_text(json_text: str):
-  import json as _json
-  try:
-    text = json_text.strip()
-    if text.startswith('```json'):
-      text = text[7:]
-    if text.endswith('```'):
-      text = text[:-3]
-    text = text.strip()
-    
-    # Try to parse the JSON as-is first
-    try:
-      data = _json.loads(text)
-    except _json.JSONDecodeError as e:
-      print(f"DEBUG: JSON parse error: {e}")
-      print(f"DEBUG: Raw text: {text}")
-      
-      # Try to repair common JSON issues
-      # 1. Missing closing brace
-      if not text.endswith('"') and not text.endswith('}') and not text.endswith(']'):
-        # Look for the last complete field and add missing closing brace
-        if '"raw_text":' in text:
-          # Find the last quote and add closing brace
-          last_quote_pos = text.rfind('"')
-          if last_quote_pos > 0:
-            # Check if there's already a closing brace after the last quote
-            after_quote = text[last_quote_pos + 1:].strip()
-            if not after_quote.endswith('}'):
-              text = text[:last_quote_pos + 1] + '"}'
-        else:
-          # If no raw_text field, try to add basic structure
-          if text.count('{') > text.count('}'):
-            text += '}'
-      
-      # 2. Try parsing the repaired JSON
-      try:
-        data = _json.loads(text)
-        print(f"DEBUG: Successfully repaired JSON")
-      except _json.JSONDecodeError:
-        # 3. If still failing, try to extract data manually using regex
-        print(f"DEBUG: JSON repair failed, attempting manual extraction")
-        return _manual_extract_from_text(text)
-        
-  except Exception as e:
-    print(f"DEBUG: Exception in JSON parsing: {e}")
-    return None
-  try:
-    import re as _re
-    # amount
-    amount = None
-    if data.get('amount') is not None:
-      amt = _re.sub(r'[^\d\.]', '', str(data['amount']))
-      try:
-        amount = float(amt)
-      except Exception:
-        amount = None
-    # reference number: digits only, prefer 13-digit, else 7-16
-    raw_text = str(data.get('raw_text') or '')
-    digits_only = _re.sub(r'\D', '', str(data.get('reference_number') or ''))
-
-    def _valid_ref(s: str) -> bool:
-      return bool(s) and bool(_re.fullmatch(r'\d{7,16}', s))
-
-    def _pick_best_ref(cands):
-      """Pick most likely reference number using simple heuristics."""
-      if not cands:
-        return ''
-      # normalize + dedupe preserve order
-      seen = set()
-      uniq = []
-      for c in cands:
-        c = _re.sub(r'\D', '', str(c or ''))
-        if not _valid_ref(c):
-          continue
-        if c in seen:
-          continue
-        seen.add(c)
-        uniq.append(c)
-      if not uniq:
-        return ''
-      raw_digits = _re.sub(r'\D', '', raw_text)
-      original_present = 'ORIGINAL' in (raw_text or '').upper()
-      scored = []
-      for c in uniq:
-        score = 0
-        if len(c) == 13:
-          score += 30
-        score += len(c)  # longer is better (within 7-16)
-        if original_present and c in raw_digits:
-          score += 10
-        scored.append((score, c))
-      scored.sort(key=lambda x: x[0], reverse=True)
-      return scored[0][1] if scored else ''
-
-    ref = ''
-    # First, trust AI field if valid
-    if _valid_ref(digits_only):
-      ref = digits_only
-    else:
-      # If AI didn't identify a specific reference number, look in raw text
-      ref_patterns = [
-        r'(?:ORIGINAL)[\s\S]*?(\d{7,16})',  # After ORIGINAL text
-        r'(?:REF|REFERENCE|NO\.|NUMBER)[\s#:]*(\d{7,16})',  # After REF/REFERENCE labels
-        r'(?:RECEIPT|TXN|TRANSACTION)[\s#:]*(\d{7,16})',  # After receipt/transaction labels
-        r'\b(\d{7,16})\b',  # Any 7-16 digit number as fallback
-      ]
-      all_candidates = []
-      for pattern in ref_patterns:
-        matches = _re.findall(pattern, raw_text, _re.IGNORECASE)
-        if matches:
-          all_candidates.extend(matches)
-          # stop early on strong patterns
-          if pattern.startswith('(?:ORIGINAL)') or pattern.startswith('(?:REF'):
-            break
-      ref = _pick_best_ref(all_candidates)
-    conf = float(data.get('confidence_score') or 0.0)
-    return {
-      'amount': amount,
-      'reference_number': ref,
-      'confidence': conf,
-      'raw_text': raw_text,
-    }
-  except Exception:
-    return None
-
-def _groq_extract(image_b64: str, retry_count=0, model_name=None):
-  """Extract receipt information using Groq AI API with Llama 4 Scout vision model"""
-  try:
-    # Lazy-load .env as a fallback (helps when app is started without python-dotenv
-    # or when environment variables weren't loaded at import time).
-    global _GROQ_ENV_LOADED
-    if '_GROQ_ENV_LOADED' not in globals():
-      _GROQ_ENV_LOADED = False
-    if not _GROQ_ENV_LOADED:  # type: ignore
-      try:
-        _env_app_dir = os.path.dirname(os.path.abspath(__file__))
-        # Try python-dotenv if available
-        try:
-          from dotenv import load_dotenv  # type: ignore
-          load_dotenv(os.path.join(_env_app_dir, '.env'))
-          load_dotenv('.env')
-        except Exception:
-          # Best-effort manual parse
-          for _candidate in (os.path.join(_env_app_dir, '.env'), '.env'):
-            try:
-              if os.path.exists(_candidate):
-                with open(_candidate, 'r', encoding='utf-8') as f:
-                  for line in f:
-                    s = line.strip()
-                    if not s or s.startswith('#') or '=' not in s:
-                      continue
-                    k, v = s.split('=', 1)
-                    if k and k not in os.environ:
-                      os.environ[k] = v
-            except Exception:
-              pass
-      finally:
-        _GROQ_ENV_LOADED = True  # type: ignore
-
-    # Get API key from Flask app config or environment (so it works when .env is loaded from app dir)
-    from flask import current_app
-    api_key = None
-    try:
-      api_key = current_app.config.get('GROQ_API_KEY')
-    except Exception:
-      pass
-    if not api_key:
-      api_key = os.environ.get('GROQ_API_KEY')
-    api_key = (api_key or '').strip()
-    if not api_key:
-      return {'ok': False, 'message': 'GROQ_API_KEY not configured. Add GROQ_API_KEY to your .env file (get a key from https://console.groq.com).'}
-    
-    # Try different model names if first attempt fails (Groq expects meta-llama/... id)
-    if model_name is None:
-      model_name = "meta-llama/llama-4-scout-17b-16e-instruct"
-    
-    url = "https://api.groq.com/openai/v1/chat/completions"
-    prompt = (
-      "You are an expert at analyzing Philippine payment receipts, especially GCash and government receipts. Return ONLY valid JSON with these fields:\n"
-      "{\n"
-      "  \"amount\": \"number only, e.g. 50.00\",\n"
-      "  \"reference_number\": \"digits only, prefer 13-digit; else 7-16 digits\",\n"
-      "  \"raw_text\": \"all text you can read\",\n"
-      "  \"confidence_score\": \"0.0 to 1.0\"\n"
-      "}\n"
-      "CRITICAL: For reference_number, focus on these specific locations in Philippine receipts:\n"
-      "1. BELOW 'ORIGINAL' text - This is the MOST COMMON location for reference numbers in Philippine receipts\n"
-      "2. Look for numbers that appear directly under or near 'ORIGINAL' text\n"
-      "3. Check for numbers in red ink or highlighted areas\n"
-      "4. Look for transaction numbers, receipt numbers, or confirmation numbers\n"
-      "5. Numbers that look like: 6219902, 1234567890123, etc.\n"
-      "\n"
-      "Rules:\n"
-      "- Strip all currency symbols and commas from amount.\n"
-      "- For reference_number: DIGITS ONLY. Accept 7-16 digit sequences.\n"
-      "- PRIORITIZE numbers found below 'ORIGINAL' text\n"
-      "- Look for numbers that appear to be receipt/reference/transaction IDs\n"
-      "- If multiple numbers found, prefer the one below 'ORIGINAL' or the longest sequence\n"
-      "- If none found, return null.\n"
-      "- Be very thorough in scanning the entire receipt, especially the bottom section\n"
-      "- ONLY extract reference numbers that are clearly visible and readable\n"
-      "- DO NOT guess or make up reference numbers\n"
-      "- If the image is blurry or unclear, set confidence_score to 0.0\n"
-      "Respond with JSON only."
-    )
-    
-    # Use Llama 4 Scout - Groq's vision model for image analysis
-    payload = {
-      "model": model_name,  # Groq vision model from VISION section
-      "messages": [
-        {
-          "role": "user",
-          "content": [
-            {"type": "text", "text": prompt},
-            {
-              "type": "image_url",
-              "image_url": {
-                "url": f"data:image/jpeg;base64,{image_b64}"
-              }
-            }
-          ]
-        }
-      ],
-      "temperature": 0.1,
-      "max_tokens": 512
-    }
-    
-    headers = {
-      "Authorization": f"Bearer {api_key}",
-      "Content-Type": "application/json"
-    }
-    
-    try:
-      print(f"DEBUG: Sending request to Groq API with model: {model_name}")
-      print(f"DEBUG: Request URL: {url}")
-      resp = requests.post(url, json=payload, headers=headers, timeout=30)
-      print(f"DEBUG: Response status: {resp.status_code}")
-    except requests.exceptions.ConnectionError as e:
-      print(f"DEBUG: Connection error to Groq API: {e}")
-      if retry_count < 2:
-        print(f"DEBUG: Connection failed, retrying in 3 seconds... (attempt {retry_count + 1}/3)")
-        import time
-        time.sleep(3)
-        return _groq_extract(image_b64, retry_count + 1, model_name)
-      else:
-        error_msg = str(e).lower()
-        if 'name resolution' in error_msg or 'getaddrinfo failed' in error_msg:
-          return {'ok': False, 'message': 'AI service connection failed: Cannot resolve domain name. Please check your internet connection and DNS settings.'}
-        elif 'timeout' in error_msg:
-          return {'ok': False, 'message': 'AI service connection failed: Request timeout. Please check your internet connection speed.'}
-        else:
-          return {'ok': False, 'message': 'AI service connection failed. Please check your internet connection and try again.'}
-    except requests.exceptions.Timeout as e:
-      print(f"DEBUG: Timeout error to Groq API: {e}")
-      if retry_count < 2:
-        print(f"DEBUG: Request timeout, retrying in 3 seconds... (attempt {retry_count + 1}/3)")
-        import time
-        time.sleep(3)
-        return _groq_extract(image_b64, retry_count + 1, model_name)
-      else:
-        return {'ok': False, 'message': 'AI service request timed out. Please try again.'}
-    except requests.exceptions.RequestException as e:
-      print(f"DEBUG: Request error to Groq API: {e}")
-      return {'ok': False, 'message': f'AI service request failed: {str(e)}. Please check your internet connection.'}
-    
-    if resp.status_code != 200:
-      error_detail = resp.text
-      print(f"DEBUG: Groq API error {resp.status_code}: {error_detail}")
-      
-      if resp.status_code == 404:
-        # Model not found - try alternative model name with prefix
-        print(f"DEBUG: Model not found (404) with model '{model_name}', trying alternative...")
-        if retry_count == 0 and model_name == "meta-llama/llama-4-scout-17b-16e-instruct":
-          # Fallback: short id (older examples)
-          print(f"DEBUG: Retrying with short model id...")
-          import time
-          time.sleep(1)
-          return _groq_extract(image_b64, retry_count + 1, "llama-4-scout-17b-16e-instruct")
-        else:
-          # Both attempts failed or already tried both
-          return {'ok': False, 'message': f'AI model not found (404). Tried model: {model_name}. Error: {error_detail[:300]}. Please check Groq console for available vision models.'}
-      elif resp.status_code == 503 and retry_count < 2:
-        print(f"DEBUG: API overloaded, retrying in 2 seconds... (attempt {retry_count + 1}/3)")
-        import time
-        time.sleep(2)
-        return _groq_extract(image_b64, retry_count + 1, model_name)
-      elif resp.status_code == 503:
-        return {'ok': False, 'message': 'AI service is temporarily overloaded. Please try again in a few minutes.'}
-      elif resp.status_code == 429:
-        return {'ok': False, 'message': 'Too many requests. Please wait a moment and try again.'}
-      elif resp.status_code == 400:
-        return {'ok': False, 'message': f'Invalid request. Error: {error_detail[:200]}'}
-      elif resp.status_code == 401:
-        return {'ok': False, 'message': 'Invalid API key. Please check your Groq API key.'}
-      else:
-        return {'ok': False, 'message': f'AI service error ({resp.status_code}): {error_detail[:200]}'}
-    
-    j = resp.json()
-    try:
-      ai_text = j['choices'][0]['message']['content']
-      print(f"DEBUG: Raw AI response text: {ai_text[:500]}...")
-    except Exception as e:
-      print(f"DEBUG: Error parsing AI response: {e}")
-      return {'ok': False, 'message': f'No response content in AI response: {str(e)}'}
-    
-    parsed = _extract_ref_amount_from_ai_text(ai_text)
-    if not parsed:
-      print(f"DEBUG: Failed to parse AI JSON response: {ai_text}")
-      return {'ok': False, 'message': f'AI processing failed: Invalid JSON from Groq. Raw response: ```json {ai_text[:200]}```\n\nPlease try again in a few minutes. The AI service may be experiencing high traffic.'}
-    
-    print(f"DEBUG: Successfully parsed AI response: {parsed}")
-    return {'ok': True, **parsed}
-  except Exception as e:
-    return {'ok': False, 'message': str(e)}
+def _groq_extract(image_b64: str, model_name=None):
+  """Extract receipt information using Groq AI API with Llama 4 Scout vision model (see receipt_ai.py)"""
+  return receipt_ai.extract(groq, image_b64, model_name)
 
 # Keep old function name for backward compatibility, but use Groq
 def _gemini_extract(image_b64: str, retry_count=0):
   """Legacy function name - now uses Groq API with Llama 4 Scout vision model"""
-  return _groq_extract(image_b64, retry_count)
+  return _groq_extract(image_b64)
 
 def _validate_payment(amount, reference_number, confidence, expected_amount=50.00):
   try:
@@ -991,6 +633,63 @@ def _create_clearance_notification_email_template(signatory_name: str, student_n
 </html>
 """
 
+# Clearance office -> staff department (names match today; map renamed offices here)
+OFFICE_TO_DEPARTMENT = {
+  'Property Custodian': 'Property Custodian',
+  'Computer Laboratory': 'Computer Laboratory',
+  'Guidance Office': 'Guidance Office',
+  'Student Affairs': 'Student Affairs',
+  'Library': 'Library',
+  'Dean CS': 'Dean CS',
+  'Dean CoEd': 'Dean CoEd',
+  'Dean HM': 'Dean HM',
+  'Dean': 'Dean',
+  'Accounting': 'Accounting',
+  'Registrar': 'Registrar'
+}
+
+# Refreshed by staff approve/reject/deactivate; the TTL only bounds drift from out-of-band edits
+OFFICE_DIRECTORY_TTL = 600
+
+
+def _office_directory(mysql) -> dict:
+  """Approved staff per department ({department: [{email, full_name}, ...]} in id order), cached"""
+  def load():
+    cur, conn = mysql.cursor()
+    try:
+      cur.execute("""
+        SELECT department, email, CONCAT(first_name, ' ', last_name) AS full_name
+        FROM staff
+        WHERE status = 'Approved' AND email IS NOT NULL AND email <> ''
+        ORDER BY id ASC
+      """)
+      rows = cur.fetchall() or []
+    finally:
+      cur.close()
+      conn.close()
+    directory = {}
+    for row in rows:
+      directory.setdefault(row.get('department') or '', []).append(
+        {'email': row['email'], 'full_name': row.get('full_name')}
+      )
+    return directory
+
+  if cache is None:
+    return load()
+  # get_or_set pins the version read before the load, so one overlapping
+  # invalidate_office_directory() cannot re-cache the old staff list
+  return cache.namespace('office_directory', ttl=OFFICE_DIRECTORY_TTL).get_or_set('all', load)
+
+
+def invalidate_office_directory() -> None:
+  if cache is not None:
+    cache.namespace('office_directory', ttl=OFFICE_DIRECTORY_TTL).invalidate()
+
+
+def _office_recipients(directory: dict, office: str) -> list:
+  return directory.get(OFFICE_TO_DEPARTMENT.get(office, office)) or []
+
+
 def _send_clearance_notification_emails(mysql, request_id: int, student_name: str, documents: list, purposes: list):
   """
   Send email notifications to all signatories when a clearance request is submitted.
@@ -1006,44 +705,24 @@ def _send_clearance_notification_emails(mysql, request_id: int, student_name: st
       ORDER BY id ASC
     """, (request_id,))
     signatories = cur.fetchall() or []
+    cur.close()
+    conn.close()
     
     # Calculate deadline (7 days from now)
     deadline = datetime.now() + timedelta(days=7)
     deadline_str = deadline.strftime("%B %d, %Y")
     
-    # Map office names to department names (for staff lookup)
-    office_to_department_map = {
-      'Property Custodian': 'Property Custodian',
-      'Computer Laboratory': 'Computer Laboratory',
-      'Guidance Office': 'Guidance Office',
-      'Student Affairs': 'Student Affairs',
-      'Library': 'Library',
-      'Dean CS': 'Dean CS',
-      'Dean CoEd': 'Dean CoEd',
-      'Dean HM': 'Dean HM',
-      'Dean': 'Dean',
-      'Accounting': 'Accounting',
-      'Registrar': 'Registrar'
-    }
-    
+    directory = _office_directory(mysql)
     emails_sent = 0
     for sig in signatories:
       office = sig.get('office', '')
-      department = office_to_department_map.get(office, office)
-      
-      # Get staff email for this department
-      # Get the first approved staff member from this department
-      cur.execute("""
-        SELECT email, CONCAT(first_name, ' ', last_name) as full_name
-        FROM staff 
-        WHERE department = %s AND status = 'Approved'
-        LIMIT 1
-      """, (department,))
-      staff = cur.fetchone()
+      # Notify the first approved staff member of the office's department
+      recipients = _office_recipients(directory, office)
+      staff = recipients[0] if recipients else None
       
       if staff and staff.get('email'):
         signatory_email = staff['email']
-        signatory_name = staff.get('full_name', office)
+        signatory_name = staff.get('full_name') or office
         
         # Create and send email
         html_content = _create_clearance_notification_email_template(
@@ -1059,10 +738,7 @@ def _send_clearance_notification_emails(mysql, request_id: int, student_name: st
         emails_sent += 1
         print(f"✅ Sent clearance notification email to {signatory_email} ({office})")
       else:
-        print(f"⚠️ No staff email found for office: {office} (department: {department})")
-    
-    cur.close()
-    conn.close()
+        print(f"⚠️ No staff email found for office: {office} (department: {OFFICE_TO_DEPARTMENT.get(office, office)})")
     
     print(f"📧 Sent {emails_sent} clearance notification email(s)")
     return emails_sent
@@ -1159,6 +835,40 @@ def send_reset_otp(mysql, email, full_name, role, user_id):
 # Global mysql variable
 mysql: Any = None
 
+# Application cache (cache_layer.Cache); configured in create_app() from CACHE_URL
+cache: Any = None
+
+# Groq API client (groq_client.GroqClient); configured in create_app() from GROQ_*
+groq: Any = None
+
+# Table columns, loaded once by init_db() (see schema_catalog.py)
+schema_catalog = SchemaCatalog()
+
+_RECEIPT_OPTIONAL_COLUMNS = {
+  'clearance_requests': ('payment_receipt', 'payment_receipt_s3_url', 'payment_receipt_s3_key',
+                         'payment_method', 'payment_amount', 'reference_number'),
+  'document_requests': ('payment_receipt', 'payment_receipt_s3_url', 'payment_receipt_s3_key',
+                        'payment_method', 'payment_amount', 'reference_number', 'payment_details'),
+}
+_RECEIPT_STUDENT_COLUMNS = (
+  "s.first_name", "s.last_name", "s.middle_name", "s.student_no",
+  "s.course_name", "s.course_code", "s.year_level", "s.year_level_name", "s.email"
+)
+
+def _receipt_lookup_sql(table: str, alias: str) -> str:
+  """Receipt API SELECT for one request table, limited to the optional columns this deployment has."""
+  def build(catalog):
+    columns = [f"{alias}.id", f"{alias}.student_id", f"{alias}.created_at"]
+    columns += [f"{alias}.{c}" for c in catalog.present(table, _RECEIPT_OPTIONAL_COLUMNS[table])]
+    columns += _RECEIPT_STUDENT_COLUMNS
+    return f"""
+      SELECT {', '.join(columns)}
+      FROM {table} {alias}
+      JOIN students s ON s.id = {alias}.student_id
+      WHERE {alias}.id = %s
+    """
+  return schema_catalog.compiled(('receipt', table), build)
+
 def create_notification(student_id, staff_name, action, phase, message):
     """Create a notification for a student"""
     try:
@@ -1190,6 +900,23 @@ def log_user_activity(mysql_conn, user_type: str, user_identifier: str, user_dis
     conn.close()
   except Exception as e:
     print(f"⚠️ log_user_activity failed: {e}")
+    return
+  # Inside a route's unit of work a rollup failure must not roll the route back; the next entry catches up
+  if activity_rollup.due() and mysql_conn.current_transaction() is None:
+    _roll_up_activity_log(mysql_conn)
+
+
+def _roll_up_activity_log(mysql_conn) -> None:
+  """Fold closed hours of user_activity_log into the hourly buckets (see activity_rollup.py)."""
+  try:
+    with mysql_conn.transaction():
+      cur, conn = mysql_conn.cursor()
+      activity_rollup.catch_up(cur)
+      cur.close()
+      conn.close()
+  except Exception as e:
+    activity_rollup.retry_soon()
+    print(f"⚠️ Activity log rollup failed: {e}")
 
 
 def _admin_or_computer_lab_session_ok() -> bool:
@@ -1222,37 +949,18 @@ def _normalize_registrar_analytics_preset(request):
   return preset, ym
 
 
-def _registrar_analytics_status_parts(raw_status: str):
+def _registrar_analytics_status_filter(raw_status: str):
   """
-  Build extra WHERE fragments for registrar analytics when filtering by request status.
-  Returns (dr_plain_sql, dr_params, dr_alias_sql, dr_alias_params, cr_sql, cr_params, include_clearance).
-  dr_plain: for FROM document_requests (no table alias).
-  dr_alias: for FROM document_requests dr ...
+  Statuses kept by the registrar analytics status filter.
+  Returns (document_statuses, clearance_statuses): None keeps every status, an empty set drops that source.
+  Fulfilled = Completed/Released/Unclaimed document requests and Approved/Completed/Released clearances;
+  Unclaimed only exists on document requests.
   """
   s = (raw_status or "").strip().lower()
-  if not s or s in ("all", "*"):
-    return ("", (), "", (), "", (), True)
-
   if s == "fulfilled":
-    ph = "%s,%s,%s"
-    drp = " AND status IN (" + ph + ")"
-    dvals = ("Completed", "Released", "Unclaimed")
-    dra = " AND dr.status IN (" + ph + ")"
-    crp = " AND cr.fulfillment_status IN (%s,%s,%s)"
-    crv = ("Approved", "Completed", "Released")
-    return (drp, dvals, dra, dvals, crp, crv, True)
-
+    return {"Completed", "Released", "Unclaimed"}, {"Approved", "Completed", "Released"}
   if s == "unclaimed":
-    return (
-      " AND status = %s",
-      ("Unclaimed",),
-      " AND dr.status = %s",
-      ("Unclaimed",),
-      "",
-      (),
-      False,
-    )
-
+    return {"Unclaimed"}, set()
   canon = {
     "pending": "Pending",
     "processing": "Processing",
@@ -1261,54 +969,16 @@ def _registrar_analytics_status_parts(raw_status: str):
     "rejected": "Rejected",
   }.get(s)
   if not canon:
-    return ("", (), "", (), "", (), True)
-
-  cr_fs = {
-    "Pending": "Pending",
-    "Processing": "Processing",
-    "Completed": "Completed",
-    "Released": "Released",
-    "Rejected": "Rejected",
-  }.get(canon)
-  if not cr_fs:
-    return ("", (), "", (), "", (), True)
-
-  drp = " AND status = %s"
-  dp = (canon,)
-  cra = " AND cr.fulfillment_status = %s"
-  cv = (cr_fs,)
-  return (drp, dp, " AND dr.status = %s", dp, cra, cv, True)
-
-
-def _registrar_analytics_document_clause(doc_raw: str):
-  """Optional filter by document type name (exact match). Used with document_requests.document_type and clearance JSON arrays."""
+    return None, None
+  return {canon}, {canon}
+
+
+def _registrar_analytics_document_filter(doc_raw: str) -> Optional[str]:
+  """Optional filter by document type name (exact match, case-insensitive like the old SQL filter)."""
   d = (doc_raw or "").strip()
   if not d or d.lower() in ("all", "*"):
-    return {
-      "dr_plain": "",
-      "dr_plain_params": (),
-      "dr_alias_extra_sql": "",
-      "dr_alias_extra_params": (),
-      "cr_extra_sql": "",
-      "cr_extra_sql_alias": "",
-      "cr_extra_params": (),
-      "norm": None,
-    }
-  norm = d
-  return {
-    "dr_plain": " AND document_type = %s",
-    "dr_plain_params": (norm,),
-    "dr_alias_extra_sql": " AND dr.document_type = %s",
-    "dr_alias_extra_params": (norm,),
-    "cr_extra_sql": (
-      " AND JSON_SEARCH(CAST(documents AS JSON), 'one', %s, NULL, '$[*]') IS NOT NULL"
-    ),
-    "cr_extra_sql_alias": (
-      " AND JSON_SEARCH(CAST(cr.documents AS JSON), 'one', %s, NULL, '$[*]') IS NOT NULL"
-    ),
-    "cr_extra_params": (norm,),
-    "norm": norm,
-  }
+    return None
+  return d
 
 
 def _registrar_analytics_date_bounds(cur, preset: str, ym: str):
@@ -1407,7 +1077,7 @@ def _registrar_analytics_date_bounds(cur, preset: str, ym: str):
 
 
 def create_app() -> Flask:
-  global mysql
+  global mysql, cache, groq
   # Serve files from project root so existing asset paths work
   app = Flask(__name__, static_folder='app/static', static_url_path='/static', template_folder='app/templates')
   # Simple secret key for session usage (replace in production)
@@ -1466,6 +1136,66 @@ def create_app() -> Flask:
       app.config['MYSQL_DB'] = os.getenv('MYSQL_DB', 'irequest')
   
   app.config['MYSQL_CURSORCLASS'] = 'DictCursor'
+  # Per-request query accounting: statements allowed before a request is flagged,
+  # repeats of one statement that count as N+1, and X-DB-* headers outside debug mode
+  app.config['DB_QUERY_BUDGET'] = int(os.getenv('DB_QUERY_BUDGET', '15'))
+  app.config['DB_QUERY_REPEAT_THRESHOLD'] = int(os.getenv('DB_QUERY_REPEAT_THRESHOLD', '5'))
+  app.config['DB_QUERY_HEADERS'] = os.getenv('DB_QUERY_HEADERS', 'false').lower() in ('1', 'true', 'yes')
+  # Slow-query log: statements at/over SLOW_QUERY_MS (0 disables) go to a rotating JSONL file with EXPLAIN plans
+  app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS', '500'))
+  app.config['SLOW_QUERY_LOG'] = os.getenv('SLOW_QUERY_LOG', os.path.join(app.root_path, 'logs', 'slow_queries.jsonl'))
+  app.config['SLOW_QUERY_EXPLAIN'] = os.getenv('SLOW_QUERY_EXPLAIN', 'true').lower() in ('1', 'true', 'yes')
+  # Per-request budget of statement time in ms (0 disables); SELECTs get MAX_EXECUTION_TIME for whatever is left.
+  # DB_ROUTE_TIMEOUTS_MS overrides single routes, e.g. "/api/staff/me=1500,/api/registrar/analytics=30000"
+  app.config['DB_STATEMENT_TIMEOUT_MS'] = float(os.getenv('DB_STATEMENT_TIMEOUT_MS', '10000'))
+  app.config['DB_ROUTE_TIMEOUTS_MS'] = os.getenv('DB_ROUTE_TIMEOUTS_MS', '')
+  # Last good payload of office/student list endpoints is served (marked stale) for up to
+  # STALE_CACHE_MAX_AGE seconds while the DB is down or slower than STALE_CACHE_AFTER_MS
+  app.config['STALE_CACHE_MAX_AGE'] = float(os.getenv('STALE_CACHE_MAX_AGE', '600'))
+  app.config['STALE_CACHE_AFTER_MS'] = float(os.getenv('STALE_CACHE_AFTER_MS', '3000'))
+  app.config['STALE_CACHE_MAX_ENTRIES'] = int(os.getenv('STALE_CACHE_MAX_ENTRIES', '500'))
+  # Application cache: empty/"local" = in-process LRU (single worker only);
+  # redis://host:6379/0 = shared by all workers (Redis or any server speaking its protocol)
+  app.config['CACHE_URL'] = os.getenv('CACHE_URL', '').strip()
+  app.config['CACHE_DEFAULT_TTL'] = float(os.getenv('CACHE_DEFAULT_TTL', '60'))
+  app.config['CACHE_MAX_ENTRIES'] = int(os.getenv('CACHE_MAX_ENTRIES', '2000'))
+  app.config['CACHE_PREFIX'] = os.getenv('CACHE_PREFIX', 'irequest')
+  # Seconds a registrar document-request tab may be served from cache (writes invalidate it; 0 disables)
+  app.config['REGISTRAR_LIST_CACHE_TTL'] = float(os.getenv('REGISTRAR_LIST_CACHE_TTL', '60'))
+  # Seconds a logged-in user's student/staff row is reused across requests (0 disables)
+  app.config['PRINCIPAL_CACHE_TTL'] = float(os.getenv('PRINCIPAL_CACHE_TTL', '60'))
+  # Seconds between checks that the in-memory student_registry index is still current
+  app.config['STUDENT_REGISTRY_REFRESH_SECONDS'] = float(os.getenv('STUDENT_REGISTRY_REFRESH_SECONDS', '60'))
+  # Seconds an AI receipt extraction is reused for the same (compressed) image (0 disables)
+  app.config['RECEIPT_EXTRACT_CACHE_TTL'] = float(os.getenv('RECEIPT_EXTRACT_CACHE_TTL', '3600'))
+  # Background receipt AI jobs: worker threads per process, queued+running jobs accepted
+  # before new ones are refused, and the longest long-poll (0 = clients poll; keep 0 with sync workers)
+  app.config['RECEIPT_JOB_WORKERS'] = int(os.getenv('RECEIPT_JOB_WORKERS', '2'))
+  app.config['RECEIPT_JOB_MAX_PENDING'] = int(os.getenv('RECEIPT_JOB_MAX_PENDING', '200'))
+  app.config['RECEIPT_JOB_MAX_WAIT'] = float(os.getenv('RECEIPT_JOB_MAX_WAIT', '0'))
+  # Serve dashboards from the fingerprinted, precompressed build (python static_assets.py build) when present
+  app.config['SERVE_BUILT_PAGES'] = os.getenv('SERVE_BUILT_PAGES', 'true').lower() in ('1', 'true', 'yes')
+  # Apply pending schema migrations at startup (set AUTO_MIGRATE=false to require `python db_migrations.py`)
+  app.config['AUTO_MIGRATE'] = os.getenv('AUTO_MIGRATE', 'true').lower() in ('1', 'true', 'yes')
+
+  # Connection pool sizing (per gunicorn worker)
+  app.config['MYSQL_POOL_MIN_SIZE'] = int(os.getenv('MYSQL_POOL_MIN_SIZE', '1'))
+  app.config['MYSQL_POOL_MAX_SIZE'] = int(os.getenv('MYSQL_POOL_MAX_SIZE', '10'))
+  app.config['MYSQL_POOL_TIMEOUT'] = float(os.getenv('MYSQL_POOL_TIMEOUT', '10'))
+  app.config['MYSQL_POOL_RECYCLE'] = float(os.getenv('MYSQL_POOL_RECYCLE', '1800'))
+  app.config['MYSQL_POOL_PRE_PING'] = float(os.getenv('MYSQL_POOL_PRE_PING', '30'))
+  app.config['MYSQL_CONNECT_TIMEOUT'] = int(os.getenv('MYSQL_CONNECT_TIMEOUT', '5'))
+  # Circuit breaker: after this many consecutive connection failures, fail with 503 for the cool-down
+  app.config['DB_BREAKER_FAILURES'] = int(os.getenv('DB_BREAKER_FAILURES', '5'))
+  app.config['DB_BREAKER_RESET_SECONDS'] = float(os.getenv('DB_BREAKER_RESET_SECONDS', '15'))
+  # Optional read replica for read-only dashboard/analytics GETs (empty host disables)
+  app.config['MYSQL_REPLICA_HOST'] = os.getenv('MYSQL_REPLICA_HOST', '').strip()
+  app.config['MYSQL_REPLICA_USER'] = os.getenv('MYSQL_REPLICA_USER', app.config['MYSQL_USER'])
+  app.config['MYSQL_REPLICA_PASSWORD'] = os.getenv('MYSQL_REPLICA_PASSWORD', app.config['MYSQL_PASSWORD'])
+  app.config['MYSQL_REPLICA_MAX_LAG'] = float(os.getenv('MYSQL_REPLICA_MAX_LAG', '5'))
+  app.config['MYSQL_REPLICA_LAG_CHECK'] = float(os.getenv('MYSQL_REPLICA_LAG_CHECK', '5'))
+  # After a write, that session reads from the primary for this many seconds
+  app.config['MYSQL_READ_AFTER_WRITE_SECONDS'] = float(os.getenv('MYSQL_READ_AFTER_WRITE_SECONDS', '10'))
 
   # Use direct PyMySQL connection for AWS RDS
   try:
@@ -1474,661 +1204,616 @@ def create_app() -> Flask:
     print("✅ Using PyMySQL for direct database connection")
     
     class DirectMySQL:
-      def __init__(self, host, user, password, database):
+      def __init__(self, host, user, password, database, pool_options=None, replica=None, breaker=None,
+                   connect_timeout=5):
         self.host = host
         self.user = user
         self.password = password
         self.database = database
-        
-      def get_connection(self):
-        """Create a fresh connection for each request"""
-        import time
-        from socket import gethostbyname, gaierror
-        last_error = None
-        for attempt in range(1, 4):
-          try:
-            print(f"🔍 Attempting to connect to: {self.host}:3306 (try {attempt}/3)")
-            print(f"🔍 Database: {self.database}")
-            print(f"🔍 User: {self.user}")
-            # Resolve DNS explicitly to surface DNS issues early
-            try:
-              _ = gethostbyname(self.host)
-            except gaierror as dns_err:
-              last_error = dns_err
-              print(f"⚠️ DNS resolution error: {dns_err}. Retrying...")
-              time.sleep(1.5 * attempt)
-              continue
-            connection = pymysql.connect(
-              host=self.host,
-              user=self.user,
-              password=self.password,
-              database=self.database,
-              charset='utf8mb4',
-              cursorclass=PyMySQLDictCursor,
-              autocommit=True,
-              connect_timeout=10,
-              read_timeout=60,
-              write_timeout=60,
-              # Philippines wall-clock for TIMESTAMP columns; pickup_date uses DATETIME (see migrations) to avoid UTC shift
-              init_command="SET time_zone='+08:00'",
+        self.connect_timeout = connect_timeout
+        # Shared by every thread in the worker: an outage fails requests fast instead of stacking them up
+        self.breaker = breaker or CircuitBreaker('database')
+        self.pool = ConnectionPool(self._connect, **(pool_options or {}))
+        # Holds the open unit of work for code running outside a request
+        self._local = threading.local()
+        self.replica_pool = None
+        self.replica_lag = None
+        if replica and replica.get('host'):
+          self.replica_pool = ConnectionPool(
+            lambda: self._connect(replica['host'], replica.get('user'), replica.get('password')),
+            **(pool_options or {})
+          )
+          self.replica_lag = ReplicaLagMonitor(
+            self.replica_pool,
+            max_lag=replica.get('max_lag', 5.0),
+            interval=replica.get('lag_check', 5.0),
+          )
+
+      def _connect(self, host=None, user=None, password=None):
+        """Open a new raw connection for the pool (single attempt; the circuit breaker handles outages)"""
+        host = host or self.host
+        user = user or self.user
+        password = self.password if password is None else password
+        print(f"🔍 Attempting to connect to: {host}:3306")
+        print(f"🔍 Database: {self.database}")
+        print(f"🔍 User: {user}")
+        try:
+          connection = pymysql.connect(
+            host=host,
+            user=user,
+            password=password,
+            database=self.database,
+            charset='utf8mb4',
+            cursorclass=PyMySQLDictCursor,
+            autocommit=True,
+            connect_timeout=self.connect_timeout,
+            read_timeout=60,
+            write_timeout=60,
+            # Philippines wall-clock for TIMESTAMP columns; pickup_date uses DATETIME (see migrations) to avoid UTC shift
+            init_command="SET time_zone='+08:00'",
+          )
+        except pymysql.err.OperationalError as e:
+          print(f"❌ PyMySQL OperationalError: {e}")
+          if len(e.args) > 0 and e.args[0] == 1045 and not (password or "").strip():
+            print(
+              "💡 MYSQL_PASSWORD is empty in .env but the server rejected the login. "
+              "Set MYSQL_PASSWORD in .env to match your MySQL user (e.g. root password)."
             )
-            print("✅ Database connection successful")
-            return connection
-          except pymysql.err.OperationalError as e:
-            last_error = e
-            # Error 2003 is often DNS/connection. Retry with backoff.
-            if len(e.args) > 0 and e.args[0] == 2003:
-              print(f"⚠️ OperationalError 2003 on attempt {attempt}: {e}. Retrying...")
-              time.sleep(1.5 * attempt)
-              continue
-            print(f"❌ PyMySQL OperationalError: {e}")
-            if len(e.args) > 0 and e.args[0] == 1045 and not (self.password or "").strip():
-              print(
-                "💡 MYSQL_PASSWORD is empty in .env but the server rejected the login. "
-                "Set MYSQL_PASSWORD in .env to match your MySQL user (e.g. root password)."
-              )
-            raise
-          except Exception as e:
-            last_error = e
-            print(f"❌ General connection error on attempt {attempt}: {e}")
-            time.sleep(1.0 * attempt)
-            continue
-        # After retries, raise the last seen error
-        if last_error:
-          raise last_error
-        raise RuntimeError("Unknown database connection failure")
+          raise
+        except Exception as e:
+          print(f"❌ General connection error: {e}")
+          raise
+        print("✅ Database connection successful")
+        return connection
+
+      def _replica_connection(self):
+        """Replica connection for a read-only route, or None to use the primary"""
+        import time
+        # Both are set together in __init__ (pool plus its lag monitor) or both are None
+        if self.replica_pool is None or self.replica_lag is None:
+          return None
+        if session.get('_db_primary_until', 0) > time.time():
+          # This session wrote recently; the replica may not have the change yet
+          return None
+        if not self.replica_lag.healthy():
+          return None
+        try:
+          return self.replica_pool.acquire(timeout=1.0)
+        except Exception as e:
+          print(f"⚠️ Replica unavailable, reading from primary: {e}")
+          return None
+
+      def _unit_store(self):
+        return g if has_request_context() else self._local
+
+      def current_transaction(self):
+        """Open unit of work for this request (or thread), if any"""
+        tx = getattr(self._unit_store(), '_db_transaction', None)
+        if tx is None:
+          return None
+        if not tx.active or getattr(tx.connection, 'closed', False):
+          # Committed, rolled back, or the route closed the connection under it
+          self._end_transaction(tx)
+          return None
+        return tx
+
+      def begin(self, connection=None):
+        """
+        Start (or join) the request's unit of work. Until commit()/rollback(),
+        every cursor() call - including create_notification and
+        log_user_activity - runs on the same primary connection and commits once.
+        Pass the route's own connection to pull statements it already ran on it
+        into the same unit; otherwise one is checked out and released at the end.
+        """
+        tx = self.current_transaction()
+        if tx is not None:
+          tx.depth += 1
+          return tx
+        owned = connection is None
+        if owned:
+          connection = self._acquire_primary()
+        tx = Transaction(connection, owned=owned)
+        setattr(self._unit_store(), '_db_transaction', tx)
+        return tx
+
+      def _end_transaction(self, tx):
+        store = self._unit_store()
+        if getattr(store, '_db_transaction', None) is tx:
+          setattr(store, '_db_transaction', None)
+        if tx.owned and not getattr(tx.connection, 'closed', True):
+          tx.connection.close()
+
+      @contextmanager
+      def transaction(self, connection=None):
+        """with mysql.transaction(): ... commits on success, rolls back on error"""
+        tx = self.begin(connection)
+        try:
+          yield tx.share()
+        except Exception:
+          self.rollback()
+          raise
+        self.commit()
+
+      def _acquire_primary(self):
+        try:
+          self.breaker.before_call()
+        except CircuitOpenError:
+          if has_request_context():
+            g._db_circuit_open = True
+          raise
+        try:
+          connection = self.pool.acquire()
+        except PoolTimeout:
+          # Saturated, not down: says nothing about the server's health
+          self.breaker.release()
+          raise
+        except Exception as e:
+          self.breaker.record_failure(e)
+          raise
+        if connection.verified:
+          # Connected or pinged just now; an idle connection handed out unchecked proves nothing,
+          # its statements report to the breaker instead (see cursor())
+          self.breaker.record_success()
+        else:
+          self.breaker.release()
+        return connection
+
+      def get_connection(self):
+        """Check out a pooled connection; close() hands it back to the pool"""
+        tx = self.current_transaction()
+        if tx is not None:
+          # Inside a unit of work: share its connection (close()/commit() are no-ops)
+          return tx.share()
+        connection = None
+        if has_request_context() and g.get('_db_prefer_replica'):
+          connection = self._replica_connection()
+        if connection is None:
+          connection = self._acquire_primary()
+        if has_request_context():
+          # Remember it so teardown can reclaim connections a route forgot to close
+          g.setdefault('_db_connections', []).append(connection)
+        return connection
       
       def cursor(self):
-        """Create a new connection and cursor for each operation"""
+        """Check out a connection from the pool and open a cursor on it"""
         connection = self.get_connection()
-        return connection.cursor(), connection
+        recorder = g.get('_query_recorder') if has_request_context() else None
+        if recorder is None:
+          # Background work: still timed for the slow-query log, not aggregated per route
+          recorder = QueryRecorder('<background>')
+        recorder.connections += 1
+        # Statements on the primary tell its breaker whether the server is still there
+        replica = self.replica_pool is not None and getattr(connection, 'pool', None) is self.replica_pool
+        breaker = None if replica else self.breaker
+        return InstrumentedCursor(connection.cursor(), recorder, slow_query_log, breaker), connection
       
       def commit(self):
-        """No-op since we use autocommit"""
-        pass
+        """Commit the current unit of work (no-op outside one, since statements autocommit)"""
+        tx = self.current_transaction()
+        if tx is not None and tx.commit():
+          self._end_transaction(tx)
+
+      def rollback(self):
+        """Roll back the current unit of work, if one is open"""
+        tx = self.current_transaction()
+        if tx is not None:
+          tx.rollback()
+          self._end_transaction(tx)
       
       def close(self):
-        """No-op since we create fresh connections"""
-        pass
+        """Close idle pooled connections"""
+        self.pool.dispose()
+        if self.replica_pool is not None:
+          self.replica_pool.dispose()
+
+      def replica_stats(self):
+        if self.replica_pool is None or self.replica_lag is None:
+          return {'enabled': False}
+        return {'enabled': True, 'pool': self.replica_pool.stats(), **self.replica_lag.stats()}
     
     mysql = DirectMySQL(
       host=app.config['MYSQL_HOST'],
       user=app.config['MYSQL_USER'],
       password=app.config['MYSQL_PASSWORD'],
-      database=app.config['MYSQL_DB']
+      database=app.config['MYSQL_DB'],
+      pool_options={
+        'min_size': app.config['MYSQL_POOL_MIN_SIZE'],
+        'max_size': app.config['MYSQL_POOL_MAX_SIZE'],
+        'timeout': app.config['MYSQL_POOL_TIMEOUT'],
+        'recycle': app.config['MYSQL_POOL_RECYCLE'],
+        'pre_ping': app.config['MYSQL_POOL_PRE_PING'],
+      },
+      breaker=CircuitBreaker(
+        'database',
+        failure_threshold=app.config['DB_BREAKER_FAILURES'],
+        reset_timeout=app.config['DB_BREAKER_RESET_SECONDS'],
+      ),
+      connect_timeout=app.config['MYSQL_CONNECT_TIMEOUT'],
+      replica={
+        'host': app.config['MYSQL_REPLICA_HOST'],
+        'user': app.config['MYSQL_REPLICA_USER'],
+        'password': app.config['MYSQL_REPLICA_PASSWORD'],
+        'max_lag': app.config['MYSQL_REPLICA_MAX_LAG'],
+        'lag_check': app.config['MYSQL_REPLICA_LAG_CHECK'],
+      }
     )
+
+    @app.teardown_request
+    def _release_request_connections(exc=None):
+      if mysql.current_transaction() is not None:
+        # Error or early return before commit(): never leave half the writes applied
+        print("⚠️ Rolling back unit of work left open at end of request")
+        mysql.rollback()
+      for connection in g.pop('_db_connections', []):
+        connection.close()
+
     print("✅ Direct MySQL connection configured")
     
   except ImportError:
     print("❌ PyMySQL not available - installing...")
     import subprocess
-    import sys
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "pymysql"])
-    print("✅ PyMySQL installed, please restart the server")
-    # Fallback to mock for now
-    class MockMySQL:
-      class MockConnection:
-        def cursor(self):
-          raise RuntimeError("PyMySQL not installed - please restart server")
-        def commit(self):
-          raise RuntimeError("PyMySQL not installed - please restart server")
-      connection = MockConnection()
-    mysql = MockMySQL()
-  import json
-
-  # Helper function for database operations
-  def execute_query(query, params=None):
-    """Execute a database query with proper connection management"""
-    try:
-      cur, conn = mysql.cursor()
-      if params:
-        cur.execute(query, params)
-      else:
-        cur.execute(query)
-      result = cur.fetchall()
-      cur.close()
-      conn.close()
-      return result
-    except Exception as e:
-      print(f"❌ Database query error: {e}")
-      raise
-
-  def execute_query_one(query, params=None):
-    """Execute a database query and return one result"""
-    try:
-      cur, conn = mysql.cursor()
-      if params:
-        cur.execute(query, params)
-      else:
-        cur.execute(query)
-      result = cur.fetchone()
-      cur.close()
-      conn.close()
-      return result
-    except Exception as e:
-      print(f"❌ Database query error: {e}")
-      raise
-
-  def init_db() -> None:
-    try:
-      print("🔍 Initializing database...")
-      # Test the connection first
-      cur, conn = mysql.cursor()
-      cur.execute("SELECT 1")
-      cur.close()
-      conn.close()
-      print("✅ Database connection successful")
-    except Exception as e:
-      print(f"❌ Database initialization failed: {e}")
-      return
-      
-    # Ensure database exists using PyMySQL (server-level connection). If this fails, continue using existing DB.
-    if pymysql is not None:
-      try:
-        server_cnx = pymysql.connect(host=app.config['MYSQL_HOST'], user=app.config['MYSQL_USER'], password=app.config['MYSQL_PASSWORD'], autocommit=True)
-        with server_cnx.cursor() as server_cur:
-          server_cur.execute("CREATE DATABASE IF NOT EXISTS irequest CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
-        server_cnx.close()
-        print("✅ Database 'irequest' created/verified successfully")
-      except Exception as e:
-        print(f"⚠️ Could not create database 'irequest': {e}")
-        pass
-
-    # Now create tables using direct MySQL connection
-    try:
-      cur, conn = mysql.cursor()
-      print("✅ Database connection established successfully")
-    except Exception as e:
-      print(f"❌ Database connection failed: {e}")
-      raise
-    cur.execute(
-      """
-      CREATE TABLE IF NOT EXISTS students (
-        id INT AUTO_INCREMENT PRIMARY KEY,
-        student_no VARCHAR(16) NOT NULL UNIQUE,
-        first_name VARCHAR(100) NOT NULL,
-        middle_name VARCHAR(100) NULL,
-        last_name VARCHAR(100) NOT NULL,
-        suffix VARCHAR(20) NULL,
-        course_code VARCHAR(10) NOT NULL,
-        course_name VARCHAR(150) NOT NULL,
-        year_level INT NOT NULL,
-        year_level_name VARCHAR(50) NOT NULL,
-        email VARCHAR(255) NOT NULL UNIQUE,
-        password_hash VARCHAR(255) NOT NULL,
-        mobile VARCHAR(20) NOT NULL,
-        gender ENUM('Male','Female') NOT NULL,
-        address TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-      ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-      """
-    )
-
-    cur.execute(
-      """
-      CREATE TABLE IF NOT EXISTS staff (
-        id INT AUTO_INCREMENT PRIMARY KEY,
-        department VARCHAR(100) NOT NULL,
-        first_name VARCHAR(100) NOT NULL,
-        middle_name VARCHAR(100) NULL,
-        last_name VARCHAR(100) NOT NULL,
-        suffix VARCHAR(20) NULL,
-        email VARCHAR(255) NOT NULL UNIQUE,
-        password_hash VARCHAR(255) NOT NULL,
-        contact_no VARCHAR(20) NOT NULL,
-        gender ENUM('Male','Female') NOT NULL,
-        address TEXT NOT NULL,
-        status ENUM('Pending','Approved','Rejected') NOT NULL DEFAULT 'Pending',
-        approved_by VARCHAR(255) NULL,
-        rejection_reason TEXT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-      ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-      """
-    )
-
-    cur.execute(
-      """
-      CREATE TABLE IF NOT EXISTS student_registry (
-        id INT AUTO_INCREMENT PRIMARY KEY,
-        student_no VARCHAR(16) NOT NULL UNIQUE,
-        first_name VARCHAR(100) NOT NULL,
-        last_name VARCHAR(100) NOT NULL,
-        middle_name VARCHAR(50) NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-      ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-      """
-    )
-
-    # Seed student_registry with enrolled students (INSERT IGNORE to skip duplicates)
-    REGISTRY_STUDENTS = [
-      ('2022-0527', 'Jerico', 'Abrazado', 'S.D.'), ('2022-0465', 'Edjennelle', 'Adriano', 'I.'),
-      ('2022-0362', 'Mark Angel', 'Agravante', 'S.'), ('2022-0181', 'Charles Edison', 'Andres', 'P.'),
-      ('2022-0403', 'Arnel', 'Angeles', 'R.'), ('2022-0152', 'Kevin Dean', 'Arceo', 'S.'),
-      ('2022-0273', 'Jay', 'Aycardo', 'A.'), ('2022-0187', 'Ginessa Mae', 'Borja', 'M.'),
-      ('2022-0165', 'Janalyn', 'Carpio', 'C.'), ('2022-0148', 'Beejay', 'Castillo', None),
-      ('2022-0478', 'Nick Joven', 'Cruz', 'M.'), ('2022-0183', 'Diether', 'De Leon', 'C.'),
-      ('2022-0174', 'Andrew', 'Dela Cruz', 'J.'), ('2022-0540', 'Ram Quelvic', 'Dela Peña', 'N.'),
-      ('2022-0209', 'John Ray', 'Donor', 'D.'), ('2022-0177', 'Johnzel', 'Esteban', None),
-      ('2019-0353', 'Jenny Rose', 'Estella', None), ('2022-0155', 'J.P F', 'Fabian', None),
-      ('2022-0175', 'Jonald', 'Legaspi', 'F.'), ('2022-0145', 'Reylee', 'Guanzon', 'C.'),
-      ('2022-0489', 'Jericho', 'Llanaza', 'A.'), ('2022-0241', 'Ken John Emil', 'Navos', 'L.'),
-      ('2022-0369', 'Mary Joy', 'Oniot', 'R.'), ('2021-0446', 'Jerryson', 'Palmaria', 'C.'),
-      ('2022-0199', 'Jiovanni', 'Pareja', 'M.'), ('2022-0160', 'Clarence', 'Pedoc', None),
-      ('2022-0375', 'Jhon Lenon', 'Perez', 'B.'), ('2022-0389', 'John Lloyd', 'Perez', 'P.'),
-      ('2022-0173', 'Froilan', 'Principe', 'O.'), ('2022-0424', 'John Carlo', 'Ragas', 'O.'),
-      ('2022-0521', 'Jhonalyn Ann', 'Ramos', 'D.'), ('2022-0399', 'Nathaniel Ashley', 'Rodelas', 'P.'),
-      ('2022-0189', 'Maui', 'Roxas', 'V.'), ('2022-0200', 'Marvin', 'Salvador', 'O.'),
-      ('2022-0180', 'Princess Micaella', 'Samson', 'B.'), ('2020-0134', 'Christian', 'San Pedro', 'D.'),
-      ('2022-0522', 'John Marvin', 'San Pedro', 'V.'), ('2022-0193', 'Joash Ephrain', 'Santos', 'B.'),
-      ('2022-0455', 'Edwin', 'Solayao', 'O.'), ('2022-0171', 'John Lorence', 'Tagoctoc', 'V.'),
-      ('2022-0159', 'Nhelvin', 'Talam', 'P.'), ('2021-0241', 'Jomar', 'Templanza', 'R.'),
-      ('2022-0163', 'Earl Joshua', 'Uy', 'L.'), ('2022-0185', 'Jan Kamille', 'Yap', None),
-      ('2022-0178', 'Daryl James', 'Almonte', 'T.'), ('2022-0154', 'Glenn Julius', 'Almonte', None),
-      ('2022-0150', 'Tristan', 'Alvaran', 'B.'), ('2022-0164', 'John Mathew', 'Arcega', 'C.'),
-      ('2022-0386', 'Rex Allen', 'Balonio', 'J.'), ('2022-0196', 'Marc Andrew', 'Barroga', None),
-      ('2022-0161', 'Mary Jane', 'Barrun', 'B.'), ('2021-0443', 'Marcel', 'Bartolome', 'D.'),
-      ('2021-0442', 'Renato Jr', 'Bautista', 'SD'), ('2022-0167', 'Rachel', 'Cadacio', 'Q.'),
-      ('2022-0186', 'Rotcher A. Jr', 'Cadorna', None), ('2022-0286', 'Trisha Mae', 'Castillo', None),
-      ('2022-0151', 'Christian', 'Constantino', 'S.'), ('2022-0168', 'Arlyn', 'Cruz', 'M.'),
-      ('2022-0169', 'John Roed', 'De Guzman', 'E.'), ('2022-0520', 'Joseph', 'Dela Victoria', 'C.'),
-      ('2022-0198', 'Abigail', 'Diao', 'C.'), ('2021-0380', 'Joseph', 'Espiritu', 'E.'),
-      ('2022-0149', 'Marl Allen', 'Fausto', 'D.'), ('2022-0158', 'Cruz Nico', 'Gole', 'C.'),
-      ('2022-0218', 'Orly', 'Gonzales', 'B.'), ('2022-0472', 'Marian', 'Ipo', 'P.'),
-      ('2022-0215', 'Aaron Joseph', 'Jimenez', 'A.'), ('2022-0219', 'Cyrus', 'Labitoria', 'O.'),
-      ('2022-0220', 'Nizaniel Kate', 'Lamadora', 'A.'), ('2022-0206', 'Daniel', 'Mangahas', 'P.'),
-      ('2022-0007', 'Troy Jan', 'Marcial', 'T.'), ('2022-0179', 'Angela Danielle', 'Montefalco', None),
-      ('2022-0157', 'Jomel', 'Mosquera', None), ('2022-0221', 'Jomar', 'Pajares', 'A.'),
-      ('2022-0201', 'Mary Joyce', 'Pineda', 'C.'), ('2022-0205', 'Jennifer', 'Pleno', None),
-      ('2022-0471', 'Mark Jhun', 'Ramirez', 'A.'), ('2019-0234', 'Reese Daniel', 'San Diego', 'M.'),
-      ('2021-0218', 'Jessica', 'San Pedro', 'P.'), ('2022-0526', 'Mark Joseph', 'San Pedro', None),
-      ('2022-0176', 'Matthew John', 'Santos', 'R.'), ('2022-0516', 'Jeniebeth', 'Sopeña', 'S.'),
-      # Newly added students
-      ('2025-0345', 'John Lloyd', 'San Pedro', 'V.'),
-      ('2023-0251', 'Rochelle', 'Salvador', 'Soriben'),
-      ('2023-0309', 'Mark Ronald', 'Cruz', 'P.'),
-      ('2022-0226', 'Kaye Edrryl', 'San Pedro', 'S.'),
-      ('2022-0242', 'Danica', 'Sanico', 'S.'),
-      ('2023-0388', 'Shien Youmi', 'Arcega', 'G.'),
-    ]
-    for sn, fn, ln, mn in REGISTRY_STUDENTS:
-      try:
-        cur.execute(
-          "INSERT IGNORE INTO student_registry (student_no, first_name, last_name, middle_name) VALUES (%s, %s, %s, %s)",
-          (sn, fn, ln, mn)
-        )
-      except Exception:
-        pass
-
-    # Comprehensive migration for students table - add all missing columns
-    # This handles cases where table was created with an old schema
-    def add_column_if_not_exists(table_name, column_name, column_definition):
-      """Helper to add column if it doesn't exist"""
-      try:
-        cur.execute(f"SHOW COLUMNS FROM {table_name} LIKE '{column_name}'")
-        if not cur.fetchone():
-          cur.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_definition}")
-          print(f"✅ Added {column_name} column to {table_name} table")
-          return True
-      except Exception as e:
-        print(f"⚠️ Could not add {column_name} column: {e}")
-        # Try direct add without check
-        try:
-          cur.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_definition}")
-          return True
-        except Exception:
-          pass
-      return False
-    
-    # Add all required columns for students table
-    add_column_if_not_exists('students', 'student_no', 'student_no VARCHAR(16) NULL AFTER id')
-    add_column_if_not_exists('students', 'middle_name', 'middle_name VARCHAR(100) NULL AFTER first_name')
-    add_column_if_not_exists('students', 'suffix', 'suffix VARCHAR(20) NULL AFTER last_name')
-    add_column_if_not_exists('students', 'course_code', 'course_code VARCHAR(10) NULL')
-    add_column_if_not_exists('students', 'course_name', 'course_name VARCHAR(150) NULL')
-    add_column_if_not_exists('students', 'year_level', 'year_level INT NULL')
-    add_column_if_not_exists('students', 'year_level_name', 'year_level_name VARCHAR(50) NULL')
-    add_column_if_not_exists('students', 'mobile', 'mobile VARCHAR(20) NULL')
-    add_column_if_not_exists('students', 'gender', "gender ENUM('Male','Female') NULL")
-    add_column_if_not_exists('students', 'address', 'address TEXT NULL')
-    
-    # Add all required columns for staff table
-    add_column_if_not_exists('staff', 'middle_name', 'middle_name VARCHAR(100) NULL AFTER first_name')
-    add_column_if_not_exists('staff', 'suffix', 'suffix VARCHAR(20) NULL AFTER last_name')
-    add_column_if_not_exists('staff', 'contact_no', 'contact_no VARCHAR(20) NULL')
-    add_column_if_not_exists('staff', 'gender', "gender ENUM('Male','Female') NULL")
-    add_column_if_not_exists('staff', 'address', 'address TEXT NULL')
-    add_column_if_not_exists('staff', 'status', "status ENUM('Pending','Approved','Rejected') NOT NULL DEFAULT 'Pending'")
-    add_column_if_not_exists('staff', 'approved_by', 'approved_by VARCHAR(255) NULL')
-    add_column_if_not_exists('staff', 'rejection_reason', 'rejection_reason TEXT NULL')
-    
-    # Try to set constraints on student_no if it exists but isn't constrained
-    try:
-      cur.execute("ALTER TABLE students MODIFY COLUMN student_no VARCHAR(16) NOT NULL UNIQUE")
-    except Exception:
-      pass  # Constraint might already be set or column doesn't exist
-    
-    # Clearance workflow tables
-    cur, conn = mysql.cursor()
-    cur.execute(
-      """
-      CREATE TABLE IF NOT EXISTS clearance_requests (
-        id INT AUTO_INCREMENT PRIMARY KEY,
-        student_id INT NOT NULL,
-        status ENUM('Pending','Approved','Rejected') NOT NULL DEFAULT 'Pending',
-        document_type VARCHAR(100) NULL,
-        documents TEXT NULL,
-        purposes TEXT NULL,
-        reason TEXT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-        CONSTRAINT fk_clearance_student FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE
-      ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-      """
-    )
-    # Backfill columns in case table already existed without the new fields
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD COLUMN fulfillment_status ENUM('Pending','Processing','Released','Rejected') NOT NULL DEFAULT 'Pending'")
-    except Exception:
-      pass
-    # Ensure fulfillment_status enum includes 'Completed' and 'Approved' (used by registrar flow)
-    try:
-      cur.execute("ALTER TABLE clearance_requests MODIFY COLUMN fulfillment_status ENUM('Pending','Processing','Approved','Completed','Released','Rejected') NOT NULL DEFAULT 'Pending'")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD COLUMN registrar_status ENUM('Pending','Processing','Complete') NOT NULL DEFAULT 'Pending'")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD COLUMN document_type VARCHAR(100) NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD COLUMN documents TEXT NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD COLUMN purposes TEXT NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD COLUMN reason TEXT NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD COLUMN payment_method VARCHAR(20) NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD COLUMN payment_amount DECIMAL(10,2) NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD COLUMN payment_verified BOOLEAN DEFAULT FALSE")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD COLUMN payment_receipt LONGTEXT NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD COLUMN payment_details TEXT NULL")
-    except Exception:
-      pass
-    # Add an explicit reference_number column for quick lookup if missing
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD COLUMN reference_number VARCHAR(32) NULL")
-    except Exception:
-      pass
-    # Add unique constraint to reference_number column to prevent duplicates
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD UNIQUE INDEX idx_unique_reference_number (reference_number)")
-    except Exception:
-      pass
-    # Add S3 columns for receipt storage
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD COLUMN payment_receipt_s3_url VARCHAR(500) NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD COLUMN payment_receipt_s3_key VARCHAR(255) NULL")
-    except Exception:
-      pass
-    # Add index for duplicate checking performance
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD INDEX idx_duplicate_check (student_id, document_type, status, created_at)")
-    except Exception:
-      pass
-    cur.execute(
-      """
-      CREATE TABLE IF NOT EXISTS clearance_signatories (
-        id INT AUTO_INCREMENT PRIMARY KEY,
-        request_id INT NOT NULL,
-        office VARCHAR(100) NOT NULL,
-        status ENUM('Pending','Approved','Rejected') NOT NULL DEFAULT 'Pending',
-        signed_by VARCHAR(255) NULL,
-        signed_at TIMESTAMP NULL,
-        rejection_reason TEXT NULL,
-        remarks TEXT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-        CONSTRAINT fk_signatory_request FOREIGN KEY (request_id) REFERENCES clearance_requests(id) ON DELETE CASCADE,
-        INDEX idx_req_office (request_id, office)
-      ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-      """
-    )
-    # Add signed_by and signed_at columns if they don't exist (for existing tables)
-    try:
-      cur.execute("ALTER TABLE clearance_signatories ADD COLUMN signed_by VARCHAR(255) NULL")
-      print("✅ Added signed_by column to clearance_signatories")
-    except Exception as e:
-      if "Duplicate column name" not in str(e):
-        print(f"⚠️ Could not add signed_by column: {e}")
-      pass
-    try:
-      cur.execute("ALTER TABLE clearance_signatories ADD COLUMN signed_at TIMESTAMP NULL")
-      print("✅ Added signed_at column to clearance_signatories")
-    except Exception as e:
-      if "Duplicate column name" not in str(e):
-        print(f"⚠️ Could not add signed_at column: {e}")
-      pass
-    try:
-      cur.execute("ALTER TABLE clearance_signatories ADD COLUMN remarks TEXT NULL")
-      print("✅ Added remarks column to clearance_signatories")
-    except Exception as e:
-      if "Duplicate column name" not in str(e):
-        print(f"⚠️ Could not add remarks column: {e}")
-      pass
-
-    cur.execute(
-      """
-      CREATE TABLE IF NOT EXISTS document_requests (
-        id INT AUTO_INCREMENT PRIMARY KEY,
-        student_id INT NOT NULL,
-        document_type VARCHAR(255) NOT NULL,
-        purpose TEXT NULL,
-        status ENUM('Pending','Processing','Completed','Released','Unclaimed','Rejected') NOT NULL DEFAULT 'Pending',
-        rejection_reason TEXT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-        completed_at TIMESTAMP NULL,
-        auto_transferred_at TIMESTAMP NULL,
-        clearance_request_id INT NULL,
-        payment_method VARCHAR(50) NULL,
-        payment_amount DECIMAL(10,2) NULL,
-        payment_details TEXT NULL,
-        payment_verified BOOLEAN DEFAULT FALSE,
-        CONSTRAINT fk_doc_student FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE,
-        INDEX idx_student_status (student_id, status),
-        INDEX idx_status_created (status, created_at),
-        INDEX idx_auto_transferred_at (auto_transferred_at),
-        INDEX idx_clearance_request_id (clearance_request_id)
-      ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-      """
-    )
-
-    # Backfill for existing deployments where columns or indexes may be missing
-    try:
-      cur.execute("ALTER TABLE document_requests ADD COLUMN auto_transferred_at TIMESTAMP NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE document_requests ADD COLUMN clearance_request_id INT NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE document_requests ADD COLUMN payment_method VARCHAR(50) NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE document_requests ADD COLUMN payment_amount DECIMAL(10,2) NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE document_requests ADD COLUMN payment_details TEXT NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE document_requests ADD COLUMN payment_verified BOOLEAN DEFAULT FALSE")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE clearance_requests ADD COLUMN pickup_date TIMESTAMP NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE document_requests ADD COLUMN completed_at TIMESTAMP NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE document_requests ADD COLUMN pickup_date TIMESTAMP NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE document_requests ADD COLUMN reference_number VARCHAR(32) NULL")
-    except Exception:
-      pass
-    # Allow same reference number for multiple document types per student; unique per (ref, student, document_type)
-    try:
-      cur.execute("ALTER TABLE document_requests DROP INDEX idx_unique_reference_number")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE document_requests ADD UNIQUE INDEX idx_unique_ref_student_doctype (reference_number, student_id, document_type(100))")
-    except Exception:
-      pass
-    # Add receipt columns for document requests (similar to clearance_requests)
-    try:
-      cur.execute("ALTER TABLE document_requests ADD COLUMN payment_receipt LONGTEXT NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE document_requests ADD COLUMN payment_receipt_s3_url VARCHAR(500) NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE document_requests ADD COLUMN payment_receipt_s3_key VARCHAR(255) NULL")
-    except Exception:
-      pass
-    # Try to extend ENUM to include Released/Unclaimed for older deployments
-    try:
-      cur.execute("ALTER TABLE document_requests MODIFY status ENUM('Pending','Processing','Completed','Released','Unclaimed','Rejected') NOT NULL DEFAULT 'Pending'")
-    except Exception:
-      pass
+    import sys
+    subprocess.check_call([sys.executable, "-m", "pip", "install", "pymysql"])
+    print("✅ PyMySQL installed, please restart the server")
+    # Fallback to mock for now
+    class MockMySQL:
+      class MockConnection:
+        def cursor(self):
+          raise RuntimeError("PyMySQL not installed - please restart server")
+        def commit(self):
+          raise RuntimeError("PyMySQL not installed - please restart server")
+      connection = MockConnection()
+    mysql = MockMySQL()
+  import json
 
-    # Scheduled pickup: DATETIME stores exact registrar/student local time (TIMESTAMP caused ~8h skew vs UI)
-    try:
-      cur.execute("ALTER TABLE document_requests MODIFY COLUMN pickup_date DATETIME NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE clearance_requests MODIFY COLUMN pickup_date DATETIME NULL")
-    except Exception:
-      pass
+  cache = Cache.from_url(
+    app.config['CACHE_URL'],
+    prefix=app.config['CACHE_PREFIX'],
+    default_ttl=app.config['CACHE_DEFAULT_TTL'],
+    max_entries=app.config['CACHE_MAX_ENTRIES'],
+  )
+  print(f"✅ Cache backend: {cache.backend.stats()['backend']}")
+
+  # ---------------- Conditional GETs for polled endpoints ----------------
+  # Dashboards re-fetch these on a timer. A strong ETag (hash of the JSON body, or a
+  # value the route derives from its data version) lets the browser revalidate with
+  # If-None-Match and get an empty 304 while nothing changed. Registered before every
+  # other after_request hook so it runs last and tags the final body (stale copies too).
+  conditional_routes = frozenset({
+    '/api/staff/me',
+    '/api/signatories/pending',
+    '/api/registrar/document-requests',
+    '/api/student/requests',
+    '/api/clearance/request/<int:req_id>',
+    '/api/registrar/check-auto-transfers',
+  })
+
+  def _body_etag(response):
+    return hashlib.sha256(response.get_data()).hexdigest()[:32]
+
+  def _not_modified(etag):
+    """304 when the client already holds `etag`, so the route can skip building the payload"""
+    if not etag or etag not in request.if_none_match:
+      return None
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+  @app.after_request
+  def _conditional_get(response):
+    if request.method not in ('GET', 'HEAD') or request.url_rule is None or request.url_rule.rule not in conditional_routes:
+      return response
+    if response.status_code != 200 or not response.is_json or response.direct_passthrough:
+      return response
+    if 'ETag' not in response.headers:
+      response.set_etag(_body_etag(response))
+    # Per-user data: browsers may keep it but must revalidate every time
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+  # ---------------- Stale-if-error list responses ----------------
+  # Dashboards polled by office staff keep answering from their last good payload
+  # (flagged "stale") when the DB is unreachable or slow, and refresh in the background.
+  # Registered before the query-accounting hooks so its after_request runs after theirs
+  # and sees the final 503/504.
+  stale_routes = frozenset({
+    '/api/signatories/pending',
+    '/api/signatories/approved',
+    '/api/registrar/document-requests',
+    '/api/student/requests',
+  })
+  stale_cache = StaleCache(
+    max_entries=app.config['STALE_CACHE_MAX_ENTRIES'],
+    max_stale=app.config['STALE_CACHE_MAX_AGE'],
+  )
+
+  def _stale_key():
+    if request.method != 'GET' or request.url_rule is None or request.url_rule.rule not in stale_routes:
+      return None
+    # Payloads depend on who is asking (office / student), so the session identity is part of the key
+    principal = tuple(session.get(k) for k in ('student_email', 'staff_email', 'dean_email', 'admin_name', 'staff_department'))
+    return (request.url_rule.rule, principal, tuple(sorted(request.args.items(multi=True))))
 
-    # Ensure helpful indexes exist (wrapped to avoid errors on existing ones)
-    try:
-      cur.execute("CREATE INDEX idx_auto_transferred_at ON document_requests (auto_transferred_at)")
-    except Exception:
-      pass
-    try:
-      cur.execute("CREATE INDEX idx_clearance_request_id ON document_requests (clearance_request_id)")
-    except Exception:
-      pass
+  def _stale_response(key):
+    item = stale_cache.get(key)
+    if item is None:
+      return None
+    payload, age = item
+    stale_cache.mark_served()
+    g._stale_served = True
+    response = jsonify({**payload, "stale": True, "stale_age_seconds": round(age, 1)})
+    response.headers['X-Cache'] = 'STALE'
+    response.headers['Warning'] = '110 - "Response is Stale"'
+    return response
+
+  def _store_stale(key, response):
+    if response.status_code != 200 or not response.is_json:
+      return
+    payload = response.get_json(silent=True)
+    if isinstance(payload, dict) and payload.get('ok') is True and not payload.get('stale'):
+      stale_cache.put(key, payload)
 
-    # Create auto_transfer_logs table to track automatic transfers
-    cur.execute(
-      """
-      CREATE TABLE IF NOT EXISTS auto_transfer_logs (
-        id INT AUTO_INCREMENT PRIMARY KEY,
-        clearance_request_id INT NOT NULL,
-        document_request_id INT NOT NULL,
-        student_id INT NOT NULL,
-        transferred_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        reason VARCHAR(255) DEFAULT 'All office clearances approved',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        INDEX idx_clearance_request (clearance_request_id),
-        INDEX idx_document_request (document_request_id),
-        INDEX idx_student_id (student_id),
-        INDEX idx_transferred_at (transferred_at)
-      ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-      """
-    )
+  def _refresh_stale_async(key):
+    """Re-run the view without the tight budget in a background thread (one per key)"""
+    if not stale_cache.begin_refresh(key):
+      return
+    environ = dict(request.environ)
+    endpoint = request.endpoint
+    view_args = dict(request.view_args or {})
 
-    # Files uploaded by registrar for released document requests
-    cur.execute(
-      """
-      CREATE TABLE IF NOT EXISTS document_files (
-        id INT AUTO_INCREMENT PRIMARY KEY,
-        document_request_id INT NOT NULL,
-        original_name VARCHAR(255) NOT NULL,
-        file_path VARCHAR(500) NOT NULL,
-        mime_type VARCHAR(100) NULL,
-        file_size INT NULL,
-        uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        INDEX idx_doc_file_request (document_request_id),
-        CONSTRAINT fk_doc_files_request FOREIGN KEY (document_request_id) REFERENCES document_requests(id) ON DELETE CASCADE
-      ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-      """
-    )
+    def run():
+      try:
+        with app.request_context(environ):
+          response = app.make_response(app.view_functions[endpoint](**view_args))
+          _store_stale(key, response)
+      except Exception as e:
+        print(f"⚠️ Background refresh of {key[0]} failed: {e}")
+      finally:
+        stale_cache.end_refresh(key)
 
-    # Files uploaded by registrar for clearance requests
-    cur.execute(
-      """
-      CREATE TABLE IF NOT EXISTS clearance_files (
-        id INT AUTO_INCREMENT PRIMARY KEY,
-        clearance_request_id INT NOT NULL,
-        original_name VARCHAR(255) NOT NULL,
-        file_path VARCHAR(500) NOT NULL,
-        mime_type VARCHAR(100) NULL,
-        file_size INT NULL,
-        uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        INDEX idx_clearance_file_request (clearance_request_id),
-        CONSTRAINT fk_clearance_files_request FOREIGN KEY (clearance_request_id) REFERENCES clearance_requests(id) ON DELETE CASCADE
-      ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-      """
-    )
+    threading.Thread(target=run, daemon=True).start()
 
-    # User activity log for admin dashboard monitoring
-    cur.execute(
-      """
-      CREATE TABLE IF NOT EXISTS user_activity_log (
-        id INT AUTO_INCREMENT PRIMARY KEY,
-        user_type VARCHAR(20) NOT NULL,
-        user_identifier VARCHAR(255) NOT NULL,
-        user_display_name VARCHAR(255) NOT NULL,
-        action VARCHAR(500) NOT NULL,
-        details TEXT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        INDEX idx_created_at (created_at),
-        INDEX idx_user_type (user_type)
-      ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-      """
+  @app.before_request
+  def _serve_stale_while_db_down():
+    key = _stale_key()
+    if key is None:
+      return None
+    g._stale_key = key
+    breaker = getattr(mysql, 'breaker', None)
+    if breaker is not None and breaker.state == 'open':
+      # Don't even try the DB; the breaker will tell us when it is back
+      return _stale_response(key)
+    return None
+
+  @app.after_request
+  def _stale_if_error(response):
+    key = g.get('_stale_key')
+    if key is None or g.get('_stale_served'):
+      return response
+    if response.status_code >= 500:
+      stale = _stale_response(key)
+      if stale is None:
+        return response
+      breaker = getattr(mysql, 'breaker', None)
+      if breaker is None or breaker.state != 'open':
+        _refresh_stale_async(key)
+      return stale
+    _store_stale(key, response)
+    return response
+
+  # ---------------- Per-request query accounting ----------------
+  def _explain_cursor():
+    connection = mysql.get_connection()
+    return connection.cursor(), connection
+
+  slow_query_log = None
+  if app.config['SLOW_QUERY_MS'] > 0:
+    slow_query_log = SlowQueryLog(
+      app.config['SLOW_QUERY_LOG'],
+      threshold_ms=app.config['SLOW_QUERY_MS'],
+      explain_connection=_explain_cursor if app.config['SLOW_QUERY_EXPLAIN'] else None,
     )
 
+  query_stats = QueryStats(
+    default_budget=app.config['DB_QUERY_BUDGET'],
+    repeat_threshold=app.config['DB_QUERY_REPEAT_THRESHOLD'],
+  )
+
+  # DB time budgets (ms) for routes that differ from DB_STATEMENT_TIMEOUT_MS
+  route_db_timeouts: Dict[str, float] = {
+    '/health': 2000.0,
+    '/api/staff/me': 2000.0,
+    '/api/student/me': 2000.0,
+    '/api/dean/me': 2000.0,
+    '/api/admin/activity-log': 15000.0,
+    '/api/admin/activity-log/summary': 20000.0,
+    '/api/registrar/analytics/document-types': 20000.0,
+    '/api/registrar/analytics': 30000.0,
+  }
+  for item in app.config['DB_ROUTE_TIMEOUTS_MS'].split(','):
+    rule, _, ms = item.strip().rpartition('=')
+    if rule and ms:
+      try:
+        route_db_timeouts[rule] = float(ms)
+      except ValueError:
+        print(f"⚠️ Ignoring invalid DB_ROUTE_TIMEOUTS_MS entry: {item}")
+
+  def _route_key():
+    rule = request.url_rule.rule if request.url_rule else '<unmatched>'
+    return f"{request.method} {rule}"
+
+  def _db_timeout_ms():
+    budget = app.config['DB_STATEMENT_TIMEOUT_MS']
+    if request.url_rule is not None:
+      budget = route_db_timeouts.get(request.url_rule.rule, budget)
+    stale_key = g.get('_stale_key')
+    if stale_key is not None and app.config['STALE_CACHE_AFTER_MS'] > 0 and stale_cache.has(stale_key):
+      # A stale copy can stand in, so give up on a slow DB sooner
+      budget = min(budget, app.config['STALE_CACHE_AFTER_MS']) if budget and budget > 0 else app.config['STALE_CACHE_AFTER_MS']
+    return budget if budget and budget > 0 else None
+
+  def _db_timeout_response(route, budget_ms):
+    response = jsonify({
+      "ok": False,
+      "error": "db_timeout",
+      "message": "The server took too long to load this data. Please try again.",
+      "route": route,
+      "budget_ms": budget_ms,
+    })
+    response.status_code = 504
+    return response
+
+  @app.errorhandler(QueryDeadlineExceeded)
+  def _handle_db_timeout(err):
+    return _db_timeout_response(err.route, err.budget_ms)
+
+  def _db_unavailable_response(retry_after):
+    response = jsonify({
+      "ok": False,
+      "error": "db_unavailable",
+      "message": "The database is temporarily unavailable. Please try again shortly.",
+      "retry_after": round(retry_after, 1),
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response
+
+  @app.errorhandler(CircuitOpenError)
+  def _handle_db_circuit_open(err):
+    return _db_unavailable_response(err.retry_after)
+
+  @app.after_request
+  def _report_db_circuit_open(response):
+    # Routes usually catch the CircuitOpenError themselves and answer 500; answer 503 instead
+    if g.pop('_db_circuit_open', False) and response.status_code != 503:
+      retry_after = mysql.breaker.stats().get('retry_after') or 1
+      response = _db_unavailable_response(retry_after)
+    return response
+
+  @app.before_request
+  def _start_query_accounting():
+    g._query_recorder = query_stats.start(_route_key(), _db_timeout_ms())
+
+  @app.after_request
+  def _finish_query_accounting(response):
+    recorder = g.pop('_query_recorder', None)
+    if recorder is None:
+      return response
+    summary = query_stats.finish(_route_key(), recorder)
+    if summary['timed_out']:
+      print(f"⚠️ DB time budget exceeded: {summary['route']} ({recorder.budget_ms:.0f} ms)")
+      if response.status_code >= 500 and response.status_code != 504:
+        # Most routes turn exceptions into a generic 500; report the timeout consistently.
+        # A 2xx/4xx answer stands: a best-effort statement timing out must not undo a committed write.
+        response = _db_timeout_response(summary['route'], recorder.budget_ms)
+    if summary['over_budget']:
+      print(f"⚠️ Query budget exceeded: {summary['route']} ran {summary['statements']} statements (budget {summary['budget']})")
+    for item in summary['repeated']:
+      print(f"⚠️ Possible N+1 in {summary['route']}: {item['count']}x {item['sql'][:120]}")
+    if app.debug or app.config['DB_QUERY_HEADERS']:
+      response.headers['X-DB-Queries'] = str(summary['statements'])
+      response.headers['X-DB-Time-Ms'] = str(summary['db_time_ms'])
+      response.headers['X-DB-Rows'] = str(summary['rows'])
+      response.headers['X-DB-Connections'] = str(summary['connections'])
+      if summary['over_budget']:
+        response.headers['X-DB-Over-Budget'] = str(summary['budget'])
+    return response
+
+  # ---------------- Read-replica routing ----------------
+  # Read-only GETs that tolerate a few seconds of replication lag. Everything
+  # else (and these routes whenever the replica is lagging or down) uses the primary.
+  replica_read_routes = frozenset({
+    '/api/registrar/analytics',
+    '/api/registrar/analytics/document-types',
+    '/api/admin/activity-log',
+    '/api/admin/activity-log/summary',
+    '/api/signatories/pending',
+    '/api/signatories/approved',
+    '/api/student/requests',
+    '/api/registrar/document-requests',
+  })
+
+  @app.before_request
+  def _select_read_connection():
+    if request.method == 'GET' and request.url_rule is not None and request.url_rule.rule in replica_read_routes:
+      g._db_prefer_replica = True
+
+  @app.after_request
+  def _stick_to_primary_after_write(response):
+    # Read-your-writes: a session that just changed data keeps reading the primary
+    if mysql is not None and getattr(mysql, 'replica_pool', None) is not None \
+        and request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+      import time
+      session['_db_primary_until'] = time.time() + app.config['MYSQL_READ_AFTER_WRITE_SECONDS']
+    return response
+
+  # Helper function for database operations
+  def execute_query(query, params=None):
+    """Execute a database query with proper connection management"""
+    try:
+      cur, conn = mysql.cursor()
+      if params:
+        cur.execute(query, params)
+      else:
+        cur.execute(query)
+      result = cur.fetchall()
+      cur.close()
+      conn.close()
+      return result
+    except Exception as e:
+      print(f"❌ Database query error: {e}")
+      raise
+
+  def execute_query_one(query, params=None):
+    """Execute a database query and return one result"""
+    try:
+      cur, conn = mysql.cursor()
+      if params:
+        cur.execute(query, params)
+      else:
+        cur.execute(query)
+      result = cur.fetchone()
+      cur.close()
+      conn.close()
+      return result
+    except Exception as e:
+      print(f"❌ Database query error: {e}")
+      raise
+
+  def init_db() -> None:
+    """Check the schema version once; apply pending migrations under a lock when enabled"""
+    try:
+      print("🔍 Initializing database...")
+      cur, conn = mysql.cursor()
+      version = db_migrations.schema_version(cur)
+      cur.close()
+      conn.close()
+      print("✅ Database connection successful")
+      mysql.pool.warm()
+    except Exception as e:
+      print(f"❌ Database initialization failed: {e}")
+      return
+
+    latest = db_migrations.latest_version()
+    if version >= latest:
+      print(f"✅ Database schema up to date (version {version})")
+    elif not app.config['AUTO_MIGRATE']:
+      print(f"⚠️ Database schema is at version {version} but latest is {latest}. Run: python db_migrations.py")
+    else:
+      conn = mysql.get_connection()
+      try:
+        applied = db_migrations.migrate(conn)
+      finally:
+        conn.close()
+      if applied:
+        print(f"✅ Applied schema migrations: {', '.join(str(v) for v in applied)}")
+
+    # Column catalog used instead of per-request SHOW COLUMNS; refreshed after migrations
+    cur, conn = mysql.cursor()
+    schema_catalog.refresh(cur)
     cur.close()
     conn.close()
-    print("✅ Database tables and columns verified/created successfully")
 
   # Initialize database inside application context (retry once on connection error)
   with app.app_context():
@@ -2147,6 +1832,50 @@ def create_app() -> Flask:
   
   # ---------------- Groq AI config ----------------
   app.config['GROQ_API_KEY'] = os.environ.get('GROQ_API_KEY')
+  # Seconds to connect to Groq / to wait for its answer, tries per call and the total seconds
+  # a call may take including backoff between tries
+  app.config['GROQ_CONNECT_TIMEOUT'] = float(os.getenv('GROQ_CONNECT_TIMEOUT', '5'))
+  app.config['GROQ_READ_TIMEOUT'] = float(os.getenv('GROQ_READ_TIMEOUT', '30'))
+  app.config['GROQ_MAX_ATTEMPTS'] = int(os.getenv('GROQ_MAX_ATTEMPTS', '3'))
+  app.config['GROQ_DEADLINE_SECONDS'] = float(os.getenv('GROQ_DEADLINE_SECONDS', '45'))
+  # Keep-alive connections kept open to Groq per process
+  app.config['GROQ_POOL_SIZE'] = int(os.getenv('GROQ_POOL_SIZE', '10'))
+  # Circuit breaker: after this many consecutive failed calls receipts go straight to manual entry
+  # for the cool-down
+  app.config['GROQ_BREAKER_FAILURES'] = int(os.getenv('GROQ_BREAKER_FAILURES', '5'))
+  app.config['GROQ_BREAKER_RESET_SECONDS'] = float(os.getenv('GROQ_BREAKER_RESET_SECONDS', '30'))
+  # Groq account limits shared by every worker (0 disables that bucket). GROQ_RATE_LIMIT_STORE:
+  # empty/"local" = workers on this host (shared memory), "database" = all hosts (rate_limit_buckets).
+  # A receipt waits up to GROQ_RATE_LIMIT_WAIT seconds for a slot, then goes to manual entry.
+  app.config['GROQ_RPM'] = float(os.getenv('GROQ_RPM', '30'))
+  app.config['GROQ_TPM'] = float(os.getenv('GROQ_TPM', '30000'))
+  app.config['GROQ_RATE_LIMIT_STORE'] = os.getenv('GROQ_RATE_LIMIT_STORE', '').strip()
+  app.config['GROQ_RATE_LIMIT_WAIT'] = float(os.getenv('GROQ_RATE_LIMIT_WAIT', '5'))
+  # Tokens charged per receipt until Groq's reported usage refines the estimate
+  app.config['GROQ_TOKENS_PER_CALL'] = float(os.getenv('GROQ_TOKENS_PER_CALL', '2000'))
+  groq_limiter = RateLimiter.from_store(
+    app.config['GROQ_RATE_LIMIT_STORE'],
+    {BUCKET_REQUESTS: app.config['GROQ_RPM'], BUCKET_TOKENS: app.config['GROQ_TPM']},
+    cursor=mysql.cursor,
+    prefix=app.config['CACHE_PREFIX'],
+    max_wait=app.config['GROQ_RATE_LIMIT_WAIT'],
+  )
+  groq = GroqClient(
+    app.config['GROQ_API_KEY'],
+    connect_timeout=app.config['GROQ_CONNECT_TIMEOUT'],
+    read_timeout=app.config['GROQ_READ_TIMEOUT'],
+    max_attempts=app.config['GROQ_MAX_ATTEMPTS'],
+    deadline=app.config['GROQ_DEADLINE_SECONDS'],
+    pool_size=app.config['GROQ_POOL_SIZE'],
+    breaker=CircuitBreaker(
+      'groq',
+      failure_threshold=app.config['GROQ_BREAKER_FAILURES'],
+      reset_timeout=app.config['GROQ_BREAKER_RESET_SECONDS'],
+    ),
+    limiter=groq_limiter,
+    rate_limit_wait=app.config['GROQ_RATE_LIMIT_WAIT'],
+    tokens_per_call=app.config['GROQ_TOKENS_PER_CALL'],
+  )
 
   def _get_or_create_user_from_session(cur):
     me_student = _get_current_student(cur)
@@ -2237,104 +1966,113 @@ def create_app() -> Flask:
 
   # SocketIO removed - chat feature disabled
 
-  # ---------------- Chat APIs ----------------
-  def _get_current_student(cur):
-    student_email = session.get('student_email')
-    if not student_email:
-      return None
-    cur.execute("SELECT id, first_name, last_name, student_no, course_code, course_name FROM students WHERE email=%s", (student_email,))
-    return cur.fetchone()
+  # ---------------- Session principal ----------------
+  # The logged-in student/staff row, cached per email for PRINCIPAL_CACHE_TTL seconds and
+  # memoized on flask.g for the request. Call _invalidate_principal() after changing a
+  # principal's password, name or status so the next request re-reads it.
+  _PRINCIPAL_SQL = {
+    'student': (
+      "SELECT id, first_name, middle_name, last_name, suffix, student_no, course_code, course_name, "
+      "year_level, year_level_name, email FROM students WHERE email=%s"
+    ),
+    # Only approved staff are principals; deactivated/rejected accounts resolve to None
+    'staff': (
+      "SELECT id, department, first_name, middle_name, last_name, suffix, email, contact_no, "
+      "gender, address, created_at FROM staff WHERE email=%s AND status='Approved'"
+    ),
+  }
+  principal_caches = {
+    kind: cache.namespace(f"principal.{kind}", ttl=app.config['PRINCIPAL_CACHE_TTL'])
+    for kind in _PRINCIPAL_SQL
+  }
 
-  def _get_current_staff(cur):
-    email = session.get('dean_email') or session.get('staff_email')
-    if not email:
+  def _load_principal(kind, email, cur=None):
+    key = (email or '').strip().lower()
+    if not key:
       return None
-    cur.execute("SELECT id, first_name, last_name, department, email FROM staff WHERE email=%s AND status='Approved'", (email,))
-    return cur.fetchone()
-    
-    # Note: Additional migrations for other tables (clearance_requests, etc.) 
-    # are handled below in the table creation section
-    try:
-      cur.execute("ALTER TABLE students ADD COLUMN status ENUM('Pending','Approved','Rejected') NOT NULL DEFAULT 'Pending'")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE students ADD COLUMN signature TEXT NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE students ADD COLUMN rejection_reason TEXT NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE students ADD COLUMN approved_by VARCHAR(255) NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE students ADD COLUMN has_clearance_request TINYINT(1) NOT NULL DEFAULT 0")
-    except Exception:
-      pass
-    # OTP columns for student email verification (first login)
-    try:
-      cur.execute("ALTER TABLE students ADD COLUMN otp_code VARCHAR(6) NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE students ADD COLUMN otp_expires_at DATETIME NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE students ADD COLUMN otp_verified TINYINT(1) NOT NULL DEFAULT 0")
-    except Exception:
-      pass
-
-    # Password reset OTP for students
-    try:
-      cur.execute("ALTER TABLE students ADD COLUMN reset_code VARCHAR(6) NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE students ADD COLUMN reset_expires_at DATETIME NULL")
-    except Exception:
-      pass
-
-    # Password reset OTP for staff
-    try:
-      cur.execute("ALTER TABLE staff ADD COLUMN reset_code VARCHAR(6) NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE staff ADD COLUMN reset_expires_at DATETIME NULL")
-    except Exception:
-      pass
+    memo = g.setdefault('_principals', {})
+    if (kind, key) in memo:
+      return memo[(kind, key)]
+    ns = principal_caches[kind]
+    use_cache = app.config['PRINCIPAL_CACHE_TTL'] > 0
+    # Version read before the query: a load overlapping _invalidate_principal() is stored
+    # under the superseded version and never served
+    version = ns.version() if use_cache else None
+    row = ns.get(key, version=version) if use_cache else None
+    if row is None:
+      own_cursor = cur is None
+      if own_cursor:
+        cur, conn = mysql.cursor()
+      try:
+        cur.execute(_PRINCIPAL_SQL[kind], (email,))
+        row = cur.fetchone()
+      finally:
+        if own_cursor:
+          cur.close()
+          conn.close()
+      if row and use_cache:
+        ns.set(key, row, version=version)
+    memo[(kind, key)] = row
+    return row
+
+  def _invalidate_principal(kind, email=None):
+    """Forget a changed principal (every cached principal of that kind: deleting one key could not stop
+    a load already in flight from storing the old row again; bumping the version does)"""
+    principal_caches[kind].invalidate()
+    memo = g.get('_principals') if has_request_context() else None
+    if memo:
+      if email:
+        memo.pop((kind, email.strip().lower()), None)
+      else:
+        for memo_key in [k for k in memo if k[0] == kind]:
+          memo.pop(memo_key, None)
 
-    # Legacy compatibility: ensure old 'course' column (if exists) is nullable
-    try:
-      cur.execute("ALTER TABLE students MODIFY COLUMN course VARCHAR(255) NULL")
-    except Exception:
-      pass
+  def _get_current_student(cur=None):
+    return _load_principal('student', session.get('student_email'), cur)
 
-    # Add Deactivated status for resigned staff
-    try:
-      cur.execute("ALTER TABLE staff MODIFY COLUMN status ENUM('Pending','Approved','Rejected','Deactivated') NOT NULL DEFAULT 'Pending'")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE staff ADD COLUMN deactivated_by VARCHAR(255) NULL")
-    except Exception:
-      pass
-    try:
-      cur.execute("ALTER TABLE staff ADD COLUMN deactivated_at DATETIME NULL")
-    except Exception:
-      pass
+  def _get_current_staff(cur=None):
+    return _load_principal('staff', session.get('dean_email') or session.get('staff_email'), cur)
 
-    # Note: Table creation code moved to init_db() function above
+  # ---------------- Chat APIs ----------------
 
   @app.route('/')
   def index():
     # Redirect to login page by default
     return redirect('/login.html')
 
+  # ---------------- Built dashboard pages ----------------
+  # static_assets.py moves the dashboards' inline CSS/JS into content-hashed files and
+  # precompresses everything. Hashed files never change, so browsers keep them for a
+  # year; pages revalidate (ETag) so a new build shows up on the next navigation.
+  built_assets = BuiltAssets(os.path.join(app.root_path, 'app', 'static', 'dist'),
+                             os.path.join(app.root_path, 'app', 'templates'))
+
+  def _send_built(rel, mimetype, cache_control, etag):
+    accepted = [e for e in ('br', 'gzip') if request.accept_encodings[e]]
+    path, encoding = built_assets.variant(rel, accepted)
+    response = send_file(path, mimetype=mimetype, conditional=True,
+                         etag=f"{etag}-{encoding}" if encoding else etag)
+    if encoding:
+      response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+  def _dashboard_page(template):
+    """The built page for a dashboard template, or the template itself when there is no current build"""
+    entry = built_assets.page(template) if app.config['SERVE_BUILT_PAGES'] else None
+    if entry is None:
+      return render_template(template)
+    return _send_built(entry['file'], 'text/html; charset=utf-8', 'no-cache', entry['etag'])
+
+  @app.route('/static/dist/<path:filename>')
+  def built_asset(filename):
+    entry = built_assets.asset(filename)
+    if entry is None or filename.startswith('pages/'):
+      return jsonify({"ok": False, "message": "Not found"}), 404
+    mimetype = 'text/css; charset=utf-8' if filename.endswith('.css') else 'application/javascript; charset=utf-8'
+    return _send_built(filename, mimetype, 'public, max-age=31536000, immutable', entry['hash'])
+
   # Routes to serve HTML templates
   @app.route('/login.html')
   def login_page():
@@ -2347,27 +2085,83 @@ def create_app() -> Flask:
     base_path = (request.environ.get('SCRIPT_NAME') or '').rstrip('/') if request else ''
     return render_template('Student_Signup.html', base_path=base_path)
 
-  @app.route('/api/student/search')
-  def api_student_search():
-    """Search students by partial student_no (for autocomplete while typing)."""
-    q = request.args.get('q', '').strip().replace('%', '')
-    if len(q) < 2:
-      return jsonify({"ok": True, "students": []})
+  # ---------------- Student registry index ----------------
+  # Signup autocomplete/lookup are served from memory. The index is built in the
+  # background at startup and reloaded when the (row count, max id, last edit)
+  # signature of student_registry changes; that check runs at most every
+  # STUDENT_REGISTRY_REFRESH_SECONDS. Until the first load finishes, student
+  # numbers are looked up with the indexed student_no queries instead.
+  # Signup itself still validates the student number against MySQL.
+  registry_index = RegistryIndex(refresh_interval=app.config['STUDENT_REGISTRY_REFRESH_SECONDS'])
+
+  def _refresh_registry_index():
+    ok = False
     try:
       cur, conn = mysql.cursor()
+      try:
+        cur.execute("SELECT COUNT(*) AS n, MAX(id) AS max_id, MAX(updated_at) AS changed FROM student_registry")
+        row = cur.fetchone() or {}
+        version = (int(row.get('n') or 0), row.get('max_id'), str(row.get('changed')))
+        if version != registry_index.version:
+          cur.execute("SELECT student_no, first_name, last_name, middle_name FROM student_registry")
+          registry_index.replace(cur.fetchall() or [], version)
+          print(f"✅ Student registry index loaded ({version[0]} students)")
+      finally:
+        cur.close()
+        conn.close()
+      ok = True
+    except Exception as e:
+      print(f"⚠️ Student registry index refresh failed: {e}")
+    finally:
+      registry_index.end_refresh(ok)
+
+  def _start_registry_refresh() -> None:
+    if registry_index.due() and registry_index.claim_refresh():
+      threading.Thread(target=_refresh_registry_index, name='registry-index-refresh', daemon=True).start()
+
+  def _student_registry() -> Optional[RegistryIndex]:
+    """The index, or None until its first load has finished (callers fall back to MySQL)"""
+    _start_registry_refresh()
+    return registry_index if registry_index.ready else None
+
+  def _registry_rows(where: str, arg: str, limit: int) -> list:
+    cur, conn = mysql.cursor()
+    try:
       cur.execute(
-        """SELECT student_no, first_name, last_name, middle_name
-           FROM student_registry WHERE student_no LIKE %s
-           ORDER BY student_no LIMIT 15""",
-        (q + '%',)
+        f"SELECT student_no, first_name, last_name, middle_name FROM student_registry WHERE {where} "
+        "ORDER BY student_no LIMIT %s",
+        (arg, limit)
       )
-      rows = cur.fetchall()
+      rows = cur.fetchall() or []
+    finally:
       cur.close()
       conn.close()
-      students = [
-        {"student_no": r['student_no'], "first_name": r['first_name'] or '', "last_name": r['last_name'] or '', "middle_name": r['middle_name'] or ''}
-        for r in rows
-      ]
+    return [
+      {"student_no": r['student_no'], "first_name": r['first_name'] or '', "last_name": r['last_name'] or '',
+       "middle_name": r['middle_name'] or ''}
+      for r in rows
+    ]
+
+  # Warm the index now rather than in the first signup request after a restart
+  _start_registry_refresh()
+
+  @app.route('/api/student/search')
+  def api_student_search():
+    """Search the enrollment registry for signup autocomplete.
+    q starting with a digit matches student numbers by prefix; anything else matches names
+    (every word, any order, accents ignored)."""
+    q = request.args.get('q', '').strip().replace('%', '')
+    if len(q) < 2:
+      return jsonify({"ok": True, "students": []})
+    try:
+      index = _student_registry()
+      if index is not None:
+        students = index.prefix(q, 15) if q[0].isdigit() else index.search_names(q, 15)
+      elif q[0].isdigit():
+        students = _registry_rows("student_no LIKE %s", q + '%', 15)
+      else:
+        # Name search needs the index; it is only unavailable for the first moments after a restart
+        students = []
       return jsonify({"ok": True, "students": students})
     except Exception as err:
       return jsonify({"ok": False, "students": [], "message": str(err)}), 500
@@ -2379,14 +2173,11 @@ def create_app() -> Flask:
     if not student_no:
       return jsonify({"ok": False, "found": False, "message": "Student number required"}), 400
     try:
-      cur, conn = mysql.cursor()
-      cur.execute(
-        "SELECT student_no, first_name, last_name, middle_name FROM student_registry WHERE student_no = %s",
-        (student_no,)
-      )
-      row = cur.fetchone()
-      cur.close()
-      conn.close()
+      index = _student_registry()
+      if index is not None:
+        row = index.lookup(student_no)
+      else:
+        row = next(iter(_registry_rows("student_no = %s", student_no, 1)), None)
       if row:
         return jsonify({
           "ok": True,
@@ -2408,51 +2199,51 @@ def create_app() -> Flask:
   
   @app.route('/student_dashboard.html')
   def student_dashboard_page():
-    return render_template('student_dashboard.html')
+    return _dashboard_page('student_dashboard.html')
   
   @app.route('/Registrar_Dashboard.html')
   def registrar_dashboard_page():
-    return render_template('Registrar_Dashboard.html')
+    return _dashboard_page('Registrar_Dashboard.html')
   
   @app.route('/Dean_Dashboard.html')
   def dean_dashboard_page():
-    return render_template('Dean_Dashboard.html')
+    return _dashboard_page('Dean_Dashboard.html')
 
   @app.route('/Dean_CoEd_Dashboard.html')
   def dean_coed_dashboard_page():
-    return render_template('Dean_CoEd_Dashboard.html')
+    return _dashboard_page('Dean_CoEd_Dashboard.html')
   
   @app.route('/Dean_CS_Dashboard.html')
   def dean_cs_dashboard_page():
-    return render_template('Dean_CS_Dashboard.html')
+    return _dashboard_page('Dean_CS_Dashboard.html')
   
   @app.route('/Dean_HM_Dashboard.html')
   def dean_hm_dashboard_page():
-    return render_template('Dean_HM_Dashboard.html')
+    return _dashboard_page('Dean_HM_Dashboard.html')
   
   @app.route('/ComputerLaboratory_Dashboard.html')
   def computer_lab_dashboard_page():
-    return render_template('ComputerLaboratory_Dashboard.html')
+    return _dashboard_page('ComputerLaboratory_Dashboard.html')
   
   @app.route('/GuidanceOffice_Dashboard.html')
   def guidance_office_dashboard_page():
-    return render_template('GuidanceOffice_Dashboard.html')
+    return _dashboard_page('GuidanceOffice_Dashboard.html')
   
   @app.route('/StudentAffairs_dashboard.html')
   def student_affairs_dashboard_page():
-    return render_template('StudentAffairs_dashboard.html')
+    return _dashboard_page('StudentAffairs_dashboard.html')
   
   @app.route('/Library_Dashboard.html')
   def library_dashboard_page():
-    return render_template('Library_Dashboard.html')
+    return _dashboard_page('Library_Dashboard.html')
   
   @app.route('/Accounting_Dashboard.html')
   def accounting_dashboard_page():
-    return render_template('Accounting_Dashboard.html')
+    return _dashboard_page('Accounting_Dashboard.html')
   
   @app.route('/PropertyCustodian_Dashboard.html')
   def property_custodian_dashboard_page():
-    return render_template('PropertyCustodian_Dashboard.html')
+    return _dashboard_page('PropertyCustodian_Dashboard.html')
   
   @app.route('/forgot_password.html')
   def forgot_password_page():
@@ -2601,6 +2392,7 @@ def create_app() -> Flask:
       cur.execute("UPDATE staff SET password_hash = %s, reset_code = NULL, reset_expires_at = NULL WHERE id = %s", (password_hash, user_id))
     cur.close()
     conn.close()
+    _invalidate_principal('student' if role == 'student' else 'staff', session.get('reset_verified_email'))
     session.pop('reset_verified_email', None)
     session.pop('reset_verified_role', None)
     session.pop('reset_verified_user_id', None)
@@ -2761,8 +2553,8 @@ def create_app() -> Flask:
     try:
       cur, conn = mysql.cursor()
       # Detect legacy 'course' column; if present, include it in INSERT
-      cur.execute("SHOW COLUMNS FROM students LIKE 'course'")
-      has_legacy_course_col = cur.fetchone() is not None
+      schema_catalog.ensure_loaded(cur)
+      has_legacy_course_col = schema_catalog.has_column('students', 'course')
 
       base_columns = [
         'student_no', 'first_name', 'middle_name', 'last_name', 'suffix',
@@ -2881,6 +2673,7 @@ def create_app() -> Flask:
       return jsonify({"ok": False, "message": f"Database error: {err}"}), 500
 
     if is_admin_signup:
+      invalidate_office_directory()
       return jsonify({"ok": True, "message": "Account created and auto-approved. You can log in now."})
     return jsonify({"ok": True, "message": "Staff registered successfully! Please wait for Computer Laboratory approval before logging in."})
 
@@ -2892,9 +2685,22 @@ def create_app() -> Flask:
         cur.execute("SELECT 1")
         cur.close()
         conn.close()
-        return jsonify({"ok": True, "message": "Database connection is working"}), 200
+        return jsonify({
+          "ok": True,
+          "message": "Database connection is working",
+          "pool": mysql.pool.stats(),
+          "replica": mysql.replica_stats(),
+          "circuit": mysql.breaker.stats(),
+        }), 200
+    except (PoolTimeout, CircuitOpenError) as err:
+        return jsonify({
+          "ok": False,
+          "message": str(err),
+          "pool": mysql.pool.stats(),
+          "circuit": mysql.breaker.stats(),
+        }), 503
     except Exception as err:
-        return jsonify({"ok": False, "message": f"Database connection failed: {str(err)}"}), 500
+        return jsonify({"ok": False, "message": f"Database connection failed: {str(err)}", "circuit": mysql.breaker.stats()}), 500
 
   # Add Property Custodian to existing clearance requests
   @app.route('/api/fix-property-custodian', methods=['POST'])
@@ -3427,6 +3233,8 @@ def create_app() -> Flask:
       # No need to commit with autocommit=True
       cur.close()
       conn.close()
+      _invalidate_principal('staff', (staff_row or {}).get('email'))
+      invalidate_office_directory()
       staff_name = f"{staff_row.get('first_name','')} {staff_row.get('last_name','')}".strip() if staff_row else f"ID {staff_id}"
       log_user_activity(mysql, 'admin', session.get('staff_email') or approver, approver, 'Approved staff', details=staff_name)
       if request.is_json:
@@ -3450,12 +3258,14 @@ def create_app() -> Flask:
       return _message_and_back('Missing staff id or reason.')
     try:
       cur, conn = mysql.cursor()
-      cur.execute("SELECT first_name, last_name FROM staff WHERE id=%s", (staff_id,))
+      cur.execute("SELECT first_name, last_name, email FROM staff WHERE id=%s", (staff_id,))
       staff_row = cur.fetchone()
       cur.execute("UPDATE staff SET status='Rejected', approved_by=%s, rejection_reason=%s WHERE id=%s", (approver, reason, staff_id))
       # No need to commit with autocommit=True
       cur.close()
       conn.close()
+      _invalidate_principal('staff', (staff_row or {}).get('email'))
+      invalidate_office_directory()
       staff_name = f"{staff_row.get('first_name','')} {staff_row.get('last_name','')}".strip() if staff_row else f"ID {staff_id}"
       log_user_activity(mysql, 'admin', session.get('staff_email') or approver, approver, 'Rejected staff', details=f"{staff_name}: {reason[:200]}")
       if request.is_json:
@@ -3479,7 +3289,7 @@ def create_app() -> Flask:
     try:
       from datetime import datetime
       cur, conn = mysql.cursor()
-      cur.execute("SELECT first_name, last_name, status FROM staff WHERE id=%s", (staff_id,))
+      cur.execute("SELECT first_name, last_name, email, status FROM staff WHERE id=%s", (staff_id,))
       staff_row = cur.fetchone()
       if not staff_row:
         cur.close()
@@ -3497,6 +3307,9 @@ def create_app() -> Flask:
                   (deactivator, datetime.now(), staff_id))
       cur.close()
       conn.close()
+      # Deactivated staff must stop resolving as a principal right away
+      _invalidate_principal('staff', staff_row.get('email'))
+      invalidate_office_directory()
       staff_name = f"{staff_row.get('first_name','')} {staff_row.get('last_name','')}".strip() or f"ID {staff_id}"
       log_user_activity(mysql, 'admin', session.get('staff_email') or deactivator, deactivator, 'Deactivated staff', details=staff_name)
       if request.is_json:
@@ -3555,6 +3368,37 @@ def create_app() -> Flask:
     except Exception as err:
       return jsonify({"ok": False, "message": f"Error: {err}"}), 500
 
+  @app.route('/api/admin/query-stats')
+  def api_admin_query_stats():
+    """Aggregated per-route DB statement counts/time since worker start (or last reset)."""
+    if not _admin_or_computer_lab_session_ok():
+      return jsonify({"ok": False, "message": "Unauthorized"}), 403
+    routes = query_stats.snapshot()
+    return jsonify({
+      "ok": True,
+      "default_budget": query_stats.default_budget,
+      "repeat_threshold": query_stats.repeat_threshold,
+      "db_timeout_ms": app.config['DB_STATEMENT_TIMEOUT_MS'],
+      "route_db_timeouts_ms": route_db_timeouts,
+      "slow_query_log": slow_query_log.stats() if slow_query_log else None,
+      "stale_cache": stale_cache.stats(),
+      "cache": cache.stats(),
+      "student_registry": registry_index.stats(),
+      "receipt_extractions": receipt_flights.stats(),
+      "receipt_jobs": receipt_jobs.stats(),
+      "groq": groq.stats(),
+      "routes": routes
+    })
+
+  @app.route('/api/admin/query-stats/reset', methods=['POST'])
+  def api_admin_query_stats_reset():
+    """Clear the per-route DB stats of this worker; returns the totals that were cleared."""
+    if not _admin_or_computer_lab_session_ok():
+      return jsonify({"ok": False, "message": "Unauthorized"}), 403
+    routes = query_stats.snapshot()
+    query_stats.reset()
+    return jsonify({"ok": True, "routes": routes})
+
   @app.route('/api/admin/me')
   def api_admin_me():
     return jsonify({"ok": True, "admin_name": session.get('admin_name', 'Admin')})
@@ -3569,23 +3413,23 @@ def create_app() -> Flask:
     user_type_filter = (request.args.get('user_type') or '').strip().lower()
     search_q = (request.args.get('q') or '').strip()
     # Session uses time_zone='+08:00' (see mysql init_command); TIMESTAMP is already PH wall time here.
-    ph_date = "DATE(created_at)"
+    # Day bounds compare created_at directly so idx_created_at can be used.
     where_parts = ["1=1"]
     params = []
     if start:
       try:
-        datetime.strptime(start, '%Y-%m-%d')
+        start_dt = datetime.strptime(start, '%Y-%m-%d')
       except ValueError:
         return jsonify({"ok": False, "message": "Invalid start date (use YYYY-MM-DD)"}), 400
-      where_parts.append(f"{ph_date} >= %s")
-      params.append(start)
+      where_parts.append("created_at >= %s")
+      params.append(start_dt)
     if end:
       try:
-        datetime.strptime(end, '%Y-%m-%d')
+        end_dt = datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1)
       except ValueError:
         return jsonify({"ok": False, "message": "Invalid end date (use YYYY-MM-DD)"}), 400
-      where_parts.append(f"{ph_date} <= %s")
-      params.append(end)
+      where_parts.append("created_at < %s")
+      params.append(end_dt)
     if user_type_filter == 'student':
       where_parts.append("user_type = %s")
       params.append('student')
@@ -3630,70 +3474,21 @@ def create_app() -> Flask:
     if not start:
       start = (datetime.utcnow() - timedelta(days=29)).strftime('%Y-%m-%d')
     try:
-      datetime.strptime(start, '%Y-%m-%d')
-      datetime.strptime(end, '%Y-%m-%d')
+      start_dt, end_dt = activity_rollup.day_bounds(start, end)
     except ValueError:
       return jsonify({"ok": False, "message": "Invalid date range (use YYYY-MM-DD)"}), 400
-    ph_date = "DATE(created_at)"
-    ph_hour = "HOUR(created_at)"
-    range_where = f"{ph_date} >= %s AND {ph_date} <= %s"
-    range_params = (start, end)
+    if activity_rollup.due():
+      _roll_up_activity_log(mysql)
     try:
       cur, conn = mysql.cursor()
-      cur.execute(f"SELECT COUNT(*) AS c FROM user_activity_log WHERE {range_where}", range_params)
-      total_row = cur.fetchone() or {}
-      total = int(total_row.get('c') or 0)
-
-      cur.execute(f"""
-        SELECT user_type, COUNT(*) AS c FROM user_activity_log WHERE {range_where}
-        GROUP BY user_type
-      """, range_params)
-      by_role = {'student': 0, 'staff': 0, 'admin': 0}
-      for row in cur.fetchall() or []:
-        t = (row.get('user_type') or '').lower()
-        if t in by_role:
-          by_role[t] = int(row.get('c') or 0)
-
-      cur.execute(f"""
-        SELECT {ph_date} AS d, COUNT(*) AS c FROM user_activity_log WHERE {range_where}
-        GROUP BY d ORDER BY d
-      """, range_params)
-      by_day = [{'date': str(r['d']), 'count': int(r['c'] or 0)} for r in (cur.fetchall() or []) if r.get('d') is not None]
-
-      cur.execute(f"""
-        SELECT {ph_hour} AS h, COUNT(*) AS c FROM user_activity_log WHERE {range_where}
-        GROUP BY h ORDER BY h
-      """, range_params)
-      hour_map = {int(r['h']): int(r['c'] or 0) for r in (cur.fetchall() or []) if r.get('h') is not None}
-      by_hour = [{'hour': h, 'count': hour_map.get(h, 0)} for h in range(24)]
-
-      cur.execute(f"""
-        SELECT action, COUNT(*) AS c FROM user_activity_log WHERE {range_where}
-        GROUP BY action ORDER BY c DESC LIMIT 15
-      """, range_params)
-      top_actions = [{'action': (r.get('action') or '')[:500], 'count': int(r.get('c') or 0)} for r in (cur.fetchall() or [])]
-
-      cur.execute(f"""
-        SELECT user_identifier, user_display_name, COUNT(*) AS c FROM user_activity_log WHERE {range_where}
-        GROUP BY user_identifier, user_display_name ORDER BY c DESC LIMIT 10
-      """, range_params)
-      top_users = [{
-        'user_identifier': r.get('user_identifier') or '',
-        'user_display_name': r.get('user_display_name') or '',
-        'count': int(r.get('c') or 0)
-      } for r in (cur.fetchall() or [])]
-
+      # Closed hours come from the hourly buckets; only the tail after the rollup watermark hits the log
+      summary = activity_rollup.summary(cur, start_dt, end_dt)
       cur.close()
       conn.close()
       return jsonify({
         "ok": True,
         "range": {"start": start, "end": end},
-        "total": total,
-        "by_role": by_role,
-        "by_day": by_day,
-        "by_hour": by_hour,
-        "top_actions": top_actions,
-        "top_users": top_users
+        **summary
       })
     except Exception as err:
       return jsonify({"ok": False, "message": str(err)}), 500
@@ -3749,8 +3544,10 @@ def create_app() -> Flask:
         placeholders = ','.join(['%s'] * len(cr_ids))
         cur.execute(f"DELETE FROM clearance_signatories WHERE request_id IN ({placeholders})", tuple(cr_ids))
         cur.execute(f"DELETE FROM clearance_files WHERE clearance_request_id IN ({placeholders})", tuple(cr_ids))
-      cur.execute("DELETE FROM document_requests WHERE student_id = %s", (student_id,))
-      cur.execute("DELETE FROM clearance_requests WHERE student_id = %s", (student_id,))
+      with analytics_rollup.tracked(cur, 'document', doc_ids), analytics_rollup.tracked(cur, 'clearance', cr_ids):
+        cur.execute("DELETE FROM document_requests WHERE student_id = %s", (student_id,))
+        cur.execute("DELETE FROM clearance_requests WHERE student_id = %s", (student_id,))
+      payment_references.release_student(cur, student_id)
       cur.execute("DELETE FROM students WHERE id = %s", (student_id,))
       try:
         cur.execute("DELETE FROM users WHERE external_type = 'student' AND external_id = %s", (student_id,))
@@ -3759,6 +3556,7 @@ def create_app() -> Flask:
       conn.commit()
       cur.close()
       conn.close()
+      _invalidate_principal('student', row.get('email'))
       log_user_activity(mysql, 'admin', session.get('staff_email') or session.get('admin_name') or 'Admin',
                         session.get('admin_name') or 'Admin', 'Removed student from database', details=f"{student_name} (id={student_id})")
       return jsonify({"ok": True, "message": "Student removed from database."})
@@ -3823,53 +3621,13 @@ def create_app() -> Flask:
       result = None
       request_type = None
       
+      schema_catalog.ensure_loaded(cur)
+
       # First, try clearance_requests table
       try:
         print(f"🔍 Receipt API: Checking clearance_requests table...")
-        cur.execute("SHOW COLUMNS FROM clearance_requests")
-        columns_result = cur.fetchall()
-        # Handle both dict and tuple results from SHOW COLUMNS
-        columns = []
-        if columns_result:
-          for row in columns_result:
-            if isinstance(row, dict):
-              # Try both 'Field' and 'field' keys (case may vary)
-              col_name = row.get('Field') or row.get('field') or row.get('Field') or (list(row.values())[0] if row else None)
-            else:
-              # If it's a tuple, use the first element
-              col_name = row[0] if len(row) > 0 else None
-            if col_name:
-              columns.append(col_name)
-        
-        if columns:
-          base_columns = ["cr.id", "cr.student_id", "cr.created_at"]
-          if "payment_receipt" in columns:
-            base_columns.append("cr.payment_receipt")
-          if "payment_receipt_s3_url" in columns:
-            base_columns.append("cr.payment_receipt_s3_url")
-          if "payment_receipt_s3_key" in columns:
-            base_columns.append("cr.payment_receipt_s3_key")
-          if "payment_method" in columns:
-            base_columns.append("cr.payment_method")
-          if "payment_amount" in columns:
-            base_columns.append("cr.payment_amount")
-          if "reference_number" in columns:
-            base_columns.append("cr.reference_number")
-          
-          student_columns = [
-            "s.first_name", "s.last_name", "s.middle_name", "s.student_no", 
-            "s.course_name", "s.course_code", "s.year_level", "s.year_level_name", "s.email"
-          ]
-          
-          all_columns = base_columns + student_columns
-          query = f"""
-            SELECT {', '.join(all_columns)}
-            FROM clearance_requests cr
-            JOIN students s ON s.id = cr.student_id
-            WHERE cr.id = %s
-          """
-          
-          cur.execute(query, (request_id,))
+        if schema_catalog.columns('clearance_requests'):
+          cur.execute(_receipt_lookup_sql('clearance_requests', 'cr'), (request_id,))
           result = cur.fetchone()
           if result:
             request_type = "clearance"
@@ -3881,56 +3639,12 @@ def create_app() -> Flask:
       if not result:
         try:
           print(f"🔍 Receipt API: Checking document_requests table...")
-          cur.execute("SHOW COLUMNS FROM document_requests")
-          columns_result = cur.fetchall()
-          # Handle both dict and tuple results from SHOW COLUMNS
-          columns = []
-          if columns_result:
-            for row in columns_result:
-              if isinstance(row, dict):
-                # Try both 'Field' and 'field' keys (case may vary with PyMySQL DictCursor)
-                col_name = row.get('Field') or row.get('field') or (list(row.values())[0] if row else None)
-              else:
-                # If it's a tuple, use the first element
-                col_name = row[0] if len(row) > 0 else None
-              if col_name:
-                columns.append(col_name)
-          
-            if columns:
-              base_columns = ["dr.id", "dr.student_id", "dr.created_at"]
-              if "payment_receipt" in columns:
-                base_columns.append("dr.payment_receipt")
-              if "payment_receipt_s3_url" in columns:
-                base_columns.append("dr.payment_receipt_s3_url")
-              if "payment_receipt_s3_key" in columns:
-                base_columns.append("dr.payment_receipt_s3_key")
-              if "payment_method" in columns:
-                base_columns.append("dr.payment_method")
-              if "payment_amount" in columns:
-                base_columns.append("dr.payment_amount")
-              if "reference_number" in columns:
-                base_columns.append("dr.reference_number")
-              if "payment_details" in columns:
-                base_columns.append("dr.payment_details")
-              
-              student_columns = [
-                "s.first_name", "s.last_name", "s.middle_name", "s.student_no", 
-                "s.course_name", "s.course_code", "s.year_level", "s.year_level_name", "s.email"
-              ]
-              
-              all_columns = base_columns + student_columns
-              query = f"""
-                SELECT {', '.join(all_columns)}
-                FROM document_requests dr
-                JOIN students s ON s.id = dr.student_id
-                WHERE dr.id = %s
-              """
-              
-              cur.execute(query, (request_id,))
-              result = cur.fetchone()
-              if result:
-                request_type = "document"
-                print(f"🔍 Receipt API: Found in document_requests table")
+          if schema_catalog.columns('document_requests'):
+            cur.execute(_receipt_lookup_sql('document_requests', 'dr'), (request_id,))
+            result = cur.fetchone()
+            if result:
+              request_type = "document"
+              print(f"🔍 Receipt API: Found in document_requests table")
         except Exception as e:
           print(f"🔍 Receipt API: Error checking document_requests: {e}")
       
@@ -4081,8 +3795,7 @@ def create_app() -> Flask:
       cur, conn = mysql.cursor()
       
       # Check if student exists
-      cur.execute("SELECT id, first_name, last_name, email FROM students WHERE email=%s", (student_email,))
-      student = cur.fetchone()
+      student = _get_current_student(cur)
       debug_info["student_found"] = student is not None
       if student:
         debug_info["student_id"] = student['id']
@@ -4320,8 +4033,7 @@ def create_app() -> Flask:
       cur, conn = mysql.cursor()
       
       # Find student
-      cur.execute("SELECT id FROM students WHERE email = %s", (student_email,))
-      stu = cur.fetchone()
+      stu = _get_current_student(cur)
       if not stu:
         cur.close()
         conn.close()
@@ -4514,8 +4226,7 @@ def create_app() -> Flask:
       if not student_email:
         return jsonify({"ok": False, "message": "No student session found"}), 401
       cur, conn = mysql.cursor()
-      cur.execute("SELECT id FROM students WHERE email = %s", (student_email,))
-      stu = cur.fetchone()
+      stu = _get_current_student(cur)
       if not stu:
         cur.close()
         conn.close()
@@ -4535,8 +4246,7 @@ def create_app() -> Flask:
       if not student_email:
         return jsonify({"ok": False, "message": "No student session found"}), 401
       cur, conn = mysql.cursor()
-      cur.execute("SELECT id FROM students WHERE email = %s", (student_email,))
-      stu = cur.fetchone()
+      stu = _get_current_student(cur)
       if not stu:
         cur.close()
         conn.close()
@@ -4558,8 +4268,7 @@ def create_app() -> Flask:
         return jsonify({"ok": False, "message": "No student session found"}), 401
       
       cur, conn = mysql.cursor()
-      cur.execute("SELECT id FROM students WHERE email = %s", (student_email,))
-      stu = cur.fetchone()
+      stu = _get_current_student(cur)
       if not stu:
         cur.close()
         conn.close()
@@ -4656,8 +4365,7 @@ def create_app() -> Flask:
       cur, conn = mysql.cursor()
       
       # First, verify student exists in database
-      cur.execute("SELECT id, first_name, last_name FROM students WHERE email=%s", (student_email,))
-      stu = cur.fetchone()
+      stu = _get_current_student(cur)
       print(f"🔍 DEBUG /api/student/requests: student found: {stu is not None}")
       if stu:
         print(f"🔍 DEBUG /api/student/requests: student_id: {stu['id']}, name: {stu.get('first_name')} {stu.get('last_name')}")
@@ -4735,9 +4443,9 @@ def create_app() -> Flask:
         print(f"🔍 DEBUG /api/student/requests: First clearance request ID: {clearance_rows[0].get('id')}, status: {clearance_rows[0].get('status')}")
 
       # --- Fetch document requests (post-auto-transfer/registrar processing) ---
-      # Check if completed_at column exists before including it in query
-      cur.execute("SHOW COLUMNS FROM document_requests LIKE 'completed_at'")
-      has_completed_at = cur.fetchone() is not None
+      # Older deployments may lack completed_at (schema catalog is loaded once at startup)
+      schema_catalog.ensure_loaded(cur)
+      has_completed_at = schema_catalog.has_column('document_requests', 'completed_at')
       
       if student_id:
         if has_completed_at:
@@ -5140,15 +4848,15 @@ def create_app() -> Flask:
         })
       
       # Update clearance_requests.fulfillment_status to match document_requests.status
-      cur.execute("""
-        UPDATE clearance_requests cr
-        JOIN document_requests dr ON dr.clearance_request_id = cr.id
-        SET cr.fulfillment_status = dr.status, cr.updated_at = NOW()
-        WHERE dr.status IN ('Completed', 'Released', 'Unclaimed')
-        AND cr.fulfillment_status != dr.status
-      """)
-      
-      rows_affected = cur.rowcount
+      with analytics_rollup.tracked(cur, 'clearance', sorted({r['clearance_id'] for r in inconsistencies})):
+        cur.execute("""
+          UPDATE clearance_requests cr
+          JOIN document_requests dr ON dr.clearance_request_id = cr.id
+          SET cr.fulfillment_status = dr.status, cr.updated_at = NOW()
+          WHERE dr.status IN ('Completed', 'Released', 'Unclaimed')
+          AND cr.fulfillment_status != dr.status
+        """)
+        rows_affected = cur.rowcount
       # No need to commit with autocommit=True
       cur.close()
       conn.close()
@@ -5202,21 +4910,11 @@ def create_app() -> Flask:
   @app.route('/api/dean/me')
   def api_dean_me():
     try:
-      cur, conn = mysql.cursor()
       dean_email = session.get('dean_email')
       if not dean_email:
         return jsonify({"ok": False, "message": "No dean session found"}), 401
       
-      cur.execute("""
-        SELECT id, department, first_name, middle_name, last_name, suffix, 
-               email, contact_no, gender, address, created_at
-        FROM staff 
-        WHERE email = %s AND status = 'Approved'
-      """, (dean_email,))
-      
-      dean_info = cur.fetchone()
-      cur.close()
-      conn.close()
+      dean_info = _load_principal('staff', dean_email)
       
       if dean_info:
         full_name = f"{dean_info['first_name']}"
@@ -5287,6 +4985,7 @@ def create_app() -> Flask:
       # No need to commit with autocommit=True
       cur.close()
       conn.close()
+      _invalidate_principal('staff', dean_email)
       
       return jsonify({"ok": True, "message": "Password updated successfully"})
       
@@ -5327,6 +5026,7 @@ def create_app() -> Flask:
       # No need to commit with autocommit=True
       cur.close()
       conn.close()
+      _invalidate_principal('staff', staff_email)
       
       return jsonify({"ok": True, "message": "Password updated successfully"})
     except Exception as err:
@@ -5365,6 +5065,7 @@ def create_app() -> Flask:
       cur.execute("UPDATE students SET password_hash = %s WHERE email = %s", (new_password_hash, student_email))
       cur.close()
       conn.close()
+      _invalidate_principal('student', student_email)
 
       return jsonify({"ok": True, "message": "Password updated successfully"})
     except Exception as err:
@@ -5530,8 +5231,7 @@ def create_app() -> Flask:
         return jsonify({"ok": False, "message": "No student session found"}), 401
       
       cur, conn = mysql.cursor()
-      cur.execute("SELECT id FROM students WHERE email = %s", (student_email,))
-      stu = cur.fetchone()
+      stu = _get_current_student(cur)
       if not stu:
         cur.close()
         conn.close()
@@ -5582,8 +5282,7 @@ def create_app() -> Flask:
         return jsonify({"ok": False, "message": "No student session found (HTTP 401)"}), 401
       cur, conn = mysql.cursor()
       # Get student id, course, and name for email notifications
-      cur.execute("SELECT id, course_code, first_name, middle_name, last_name FROM students WHERE email = %s", (student_email,))
-      stu = cur.fetchone()
+      stu = _get_current_student(cur)
       if not stu:
         cur.close()
         conn.close()
@@ -5625,10 +5324,8 @@ def create_app() -> Flask:
         # Check for duplicate reference number if provided
         if reference_number:
           # NOTE: We no longer enforce a strict 7-16 digit pattern so real-world reference formats are accepted.
-          # Still prevent exact duplicates in clearance_requests.
-          cur.execute("SELECT id FROM clearance_requests WHERE reference_number = %s", (reference_number,))
-          existing_request = cur.fetchone()
-          if existing_request:
+          # Early answer only; the claim below (same transaction as the insert) is authoritative
+          if payment_references.owner(cur, reference_number):
             return jsonify({"ok": False, "message": f"Reference number '{reference_number}' has already been used. Please use a different reference number."}), 400
         
         # Handle valid ID upload
@@ -5709,6 +5406,8 @@ def create_app() -> Flask:
       #     "message": f"You already have a {status_text} request for the same documents and purposes (Request #{existing_info['id']}, submitted {created_date}). Please wait for it to be processed or contact the registrar if you need to make changes."
       #   }), 400
 
+      # Request row, signatory sequence, student flag and activity entry commit together
+      mysql.begin(conn)
       # Always create a NEW pending request (do not reuse existing)
       print(f"🔍 DEBUG: Storing in database - receipt_data: {'Yes' if receipt_data else 'No'}, receipt_s3_url: {receipt_s3_url}, receipt_s3_key: {receipt_s3_key}")
       print(f"🔍 DEBUG: Inserting clearance request for student_id: {student_id}, document_type: {document_type}")
@@ -5720,6 +5419,12 @@ def create_app() -> Flask:
         (student_id, document_type, json.dumps(documents), json.dumps(purposes), reason, payment_method, payment_amount, receipt_data, receipt_s3_url, receipt_s3_key, reference_number)
       )
       request_id = cur.lastrowid
+      if payment_references.claim(cur, reference_number, payment_references.SOURCE_CLEARANCE, request_id, student_id):
+        mysql.rollback()
+        cur.close()
+        conn.close()
+        return jsonify({"ok": False, "message": f"Reference number '{reference_number}' has already been used. Please use a different reference number."}), 400
+      analytics_rollup.added(cur, 'clearance', request_id)
       print(f"🔍 DEBUG: Clearance request created with ID: {request_id}")
       
       # Verify the request was saved
@@ -5751,8 +5456,18 @@ def create_app() -> Flask:
           )
       # Mark student flag
       cur.execute("UPDATE students SET has_clearance_request = 1, status = 'Pending' WHERE id = %s", (student_id,))
-      
-      # No need to commit with autocommit=True
+      # Activity text: show what was actually requested (documents/purposes) instead of generic "Submitted clearance request"
+      doc_list = documents if isinstance(documents, list) else (json.loads(documents) if isinstance(documents, str) else [])
+      purpose_list = purposes if isinstance(purposes, list) else (json.loads(purposes) if isinstance(purposes, str) else [])
+      parts = []
+      if doc_list:
+        parts.append(", ".join(str(d) for d in doc_list))
+      if purpose_list:
+        parts.append(" (" + ", ".join(str(p) for p in purpose_list) + ")")
+      action_text = "Submitted request for " + ("".join(parts) if parts else (document_type or "clearance"))
+      log_user_activity(mysql, 'student', student_email, student_name, action_text, details=f"Request ID: {request_id}")
+
+      mysql.commit()
       cur.close()
       conn.close()
       
@@ -5767,23 +5482,13 @@ def create_app() -> Flask:
         # Don't fail the request if email fails
         import traceback
         traceback.print_exc()
-
-      # Activity text: show what was actually requested (documents/purposes) instead of generic "Submitted clearance request"
-      doc_list = documents if isinstance(documents, list) else (json.loads(documents) if isinstance(documents, str) else [])
-      purpose_list = purposes if isinstance(purposes, list) else (json.loads(purposes) if isinstance(purposes, str) else [])
-      parts = []
-      if doc_list:
-        parts.append(", ".join(str(d) for d in doc_list))
-      if purpose_list:
-        parts.append(" (" + ", ".join(str(p) for p in purpose_list) + ")")
-      action_text = "Submitted request for " + ("".join(parts) if parts else (document_type or "clearance"))
-      log_user_activity(mysql, 'student', student_email, student_name, action_text, details=f"Request ID: {request_id}")
       
       return jsonify({
         "ok": True, 
         "request_id": request_id
       })
     except Exception as err:
+      mysql.rollback()
       return jsonify({"ok": False, "message": f"Error: {err}"}), 500
 
   # Fetch a specific clearance request with selected documents/purposes and signatories
@@ -6304,19 +6009,7 @@ def create_app() -> Flask:
       if not staff_email:
         # Return 200 with ok:false to avoid browser console red 401 noise on static dashboard loads
         return jsonify({"ok": False, "message": "No staff session found"})
-      cur, conn = mysql.cursor()
-      cur.execute(
-        """
-        SELECT id, department, first_name, middle_name, last_name, suffix,
-               email, contact_no, gender, address, created_at
-        FROM staff
-        WHERE email = %s AND status = 'Approved'
-        """,
-        (staff_email,)
-      )
-      info = cur.fetchone()
-      cur.close()
-      conn.close()
+      info = _get_current_staff()
       if not info:
         return jsonify({"ok": False, "message": "Staff not found"})
       full_name = f"{info['first_name']}" + (f" {info['middle_name']}" if info['middle_name'] else '') + f" {info['last_name']}" + (f" {info['suffix']}" if info['suffix'] and info['suffix'] != 'None' else '')
@@ -6344,14 +6037,16 @@ def create_app() -> Flask:
     # If any signatory rejected, request is Rejected
     cur.execute("SELECT COUNT(*) AS c FROM clearance_signatories WHERE request_id = %s AND status = 'Rejected'", (request_id,))
     if (cur.fetchone() or {}).get('c', 0) > 0:
-      cur.execute("UPDATE clearance_requests SET status = 'Rejected', fulfillment_status = 'Rejected', registrar_status = 'Pending' WHERE id = %s", (request_id,))
+      with analytics_rollup.tracked(cur, 'clearance', request_id):
+        cur.execute("UPDATE clearance_requests SET status = 'Rejected', fulfillment_status = 'Rejected', registrar_status = 'Pending' WHERE id = %s", (request_id,))
       return
     
     # Check if all signatories are approved
     cur.execute("SELECT COUNT(*) AS c FROM clearance_signatories WHERE request_id = %s AND status != 'Approved'", (request_id,))
     if (cur.fetchone() or {}).get('c', 0) == 0:
       # All signatories approved - update request status to Approved
-      cur.execute("UPDATE clearance_requests SET status = 'Approved', fulfillment_status = 'Approved', registrar_status = 'Pending' WHERE id = %s", (request_id,))
+      with analytics_rollup.tracked(cur, 'clearance', request_id):
+        cur.execute("UPDATE clearance_requests SET status = 'Approved', fulfillment_status = 'Approved', registrar_status = 'Pending' WHERE id = %s", (request_id,))
       # Auto-transfer to pending documents
       _auto_transfer_to_pending_documents(cur, request_id)
 
@@ -6396,6 +6091,7 @@ def create_app() -> Flask:
         (student_id, document_type, purpose, status, clearance_request_id, pickup_date, created_at, updated_at)
         VALUES (%s, %s, %s, 'Pending', %s, %s, NOW(), NOW())
       """, (student_id, documents, purpose, request_id, clearance_data.get('pickup_date')))
+      document_request_id = cur.lastrowid
       
       # Log the auto-transfer event
       cur.execute("""
@@ -6403,6 +6099,7 @@ def create_app() -> Flask:
         (clearance_request_id, document_request_id, student_id, transferred_at, reason)
         VALUES (%s, LAST_INSERT_ID(), %s, NOW(), 'All office clearances approved')
       """, (request_id, student_id))
+      analytics_rollup.added(cur, 'document', document_request_id)
       
     except Exception as e:
       print(f"Error in auto-transfer: {e}")
@@ -6675,7 +6372,8 @@ def create_app() -> Flask:
             cur.close()
             conn.close()
             return jsonify({"ok": False, "message": "Cannot process — not all clearances are approved.", "clearance_status": "incomplete"}), 400
-        cur.execute("UPDATE document_requests SET status='Processing', updated_at=NOW() WHERE id=%s", (request_id,))
+        with analytics_rollup.tracked(cur, 'document', request_id):
+          cur.execute("UPDATE document_requests SET status='Processing', updated_at=NOW() WHERE id=%s", (request_id,))
         if doc_row.get('student_id'):
           create_notification(doc_row['student_id'], 'Registrar', 'processing', 'Processing', 'Your request is now in the Processing Phase.')
         cur.close()
@@ -6685,7 +6383,8 @@ def create_app() -> Flask:
       if request_type == 'clearance':
         cur.execute("SELECT id FROM clearance_requests WHERE id=%s", (request_id,))
         if cur.fetchone():
-          cur.execute("UPDATE clearance_requests SET status='Processing', fulfillment_status='Processing', registrar_status='Processing' WHERE id=%s", (request_id,))
+          with analytics_rollup.tracked(cur, 'clearance', request_id):
+            cur.execute("UPDATE clearance_requests SET status='Processing', fulfillment_status='Processing', registrar_status='Processing' WHERE id=%s", (request_id,))
           cur.close()
           conn.close()
           return jsonify({"ok": True})
@@ -6721,7 +6420,8 @@ def create_app() -> Flask:
             cur.close()
             conn.close()
             return jsonify({"ok": False, "message": "Cannot process — not all clearances are approved.", "clearance_status": "incomplete"}), 400
-        cur.execute("UPDATE document_requests SET status='Processing', updated_at=NOW() WHERE id=%s", (request_id,))
+        with analytics_rollup.tracked(cur, 'document', request_id):
+          cur.execute("UPDATE document_requests SET status='Processing', updated_at=NOW() WHERE id=%s", (request_id,))
         if doc_row.get('student_id'):
           create_notification(doc_row['student_id'], 'Registrar', 'processing', 'Processing', 'Your request is now in the Processing Phase.')
         cur.close()
@@ -6729,7 +6429,8 @@ def create_app() -> Flask:
         return jsonify({"ok": True, "clearance_status": "approved" if doc_row.get('clearance_request_id') else "no_clearance"})
       cur.execute("SELECT id FROM clearance_requests WHERE id=%s", (request_id,))
       if cur.fetchone():
-        cur.execute("UPDATE clearance_requests SET status='Processing', fulfillment_status='Processing', registrar_status='Processing' WHERE id=%s", (request_id,))
+        with analytics_rollup.tracked(cur, 'clearance', request_id):
+          cur.execute("UPDATE clearance_requests SET status='Processing', fulfillment_status='Processing', registrar_status='Processing' WHERE id=%s", (request_id,))
         cur.close()
         conn.close()
         return jsonify({"ok": True})
@@ -6749,7 +6450,8 @@ def create_app() -> Flask:
       cur, conn = mysql.cursor()
       # Update both status and fulfillment_status to 'Released' for proper flow
       # Also update registrar_status to 'Complete' for student dashboard sync
-      cur.execute("UPDATE clearance_requests SET status='Released', fulfillment_status='Released', registrar_status='Complete' WHERE id=%s", (request_id,))
+      with analytics_rollup.tracked(cur, 'clearance', request_id):
+        cur.execute("UPDATE clearance_requests SET status='Released', fulfillment_status='Released', registrar_status='Complete' WHERE id=%s", (request_id,))
       # No need to commit with autocommit=True
       cur.close()
       conn.close()
@@ -6767,7 +6469,8 @@ def create_app() -> Flask:
       cur, conn = mysql.cursor()
       # Update both status and fulfillment_status to 'Unclaimed' for proper flow
       # Also update registrar_status to 'Complete' for student dashboard sync
-      cur.execute("UPDATE clearance_requests SET status='Unclaimed', fulfillment_status='Unclaimed', registrar_status='Complete' WHERE id=%s", (request_id,))
+      with analytics_rollup.tracked(cur, 'clearance', request_id):
+        cur.execute("UPDATE clearance_requests SET status='Unclaimed', fulfillment_status='Unclaimed', registrar_status='Complete' WHERE id=%s", (request_id,))
       # Notify student so they see it under Unclaimed on their dashboard
       cur.execute("SELECT student_id FROM clearance_requests WHERE id=%s", (request_id,))
       row = cur.fetchone()
@@ -6873,7 +6576,8 @@ def create_app() -> Flask:
         return jsonify({"ok": False, "message": "Registrar signatory not found"}), 404
       signatory_id = row['id']
       cur.execute("UPDATE clearance_signatories SET status='Rejected', rejection_reason=%s, remarks=%s, updated_at=NOW() WHERE id=%s", (reason, remarks, signatory_id))
-      cur.execute("UPDATE clearance_requests SET status='Rejected', fulfillment_status='Rejected', registrar_status='Pending' WHERE id=%s", (request_id,))
+      with analytics_rollup.tracked(cur, 'clearance', request_id):
+        cur.execute("UPDATE clearance_requests SET status='Rejected', fulfillment_status='Rejected', registrar_status='Pending' WHERE id=%s", (request_id,))
       # No need to commit with autocommit=True
       cur.close()
       conn.close()
@@ -6920,7 +6624,8 @@ def create_app() -> Flask:
       cur.execute("UPDATE clearance_signatories SET status='Pending', signed_by=NULL, rejection_reason=NULL, remarks=NULL, updated_at=NOW() WHERE id=%s", (signatory_id,))
       
       # Update the main request status back to pending
-      cur.execute("UPDATE clearance_requests SET status='Pending', fulfillment_status='Pending', registrar_status='Pending' WHERE id=%s", (request_id,))
+      with analytics_rollup.tracked(cur, 'clearance', request_id):
+        cur.execute("UPDATE clearance_requests SET status='Pending', fulfillment_status='Pending', registrar_status='Pending' WHERE id=%s", (request_id,))
       
       # No need to commit with autocommit=True
       cur.close()
@@ -6956,7 +6661,8 @@ def create_app() -> Flask:
         return jsonify({"ok": False, "message": "Document request is not in completed/released status"}), 400
       
       # Update the document request status back to pending
-      cur.execute("UPDATE document_requests SET status='pending', updated_at=NOW() WHERE id=%s", (request_id,))
+      with analytics_rollup.tracked(cur, 'document', request_id):
+        cur.execute("UPDATE document_requests SET status='pending', updated_at=NOW() WHERE id=%s", (request_id,))
       
       # No need to commit with autocommit=True
       cur.close()
@@ -7060,6 +6766,7 @@ def create_app() -> Flask:
       ))
       
       document_request_id = cur.lastrowid
+      analytics_rollup.added(cur, 'document', document_request_id)
       
       # Update the clearance request status to indicate it's been converted
       cur.execute("""
@@ -7241,12 +6948,10 @@ def create_app() -> Flask:
       if staff_email and not session.get('admin_name'):
         try:
           print("🔍 Approval Debug: Looking up staff name...")
-          cur_temp = mysql.cursor()
-          cur_temp.execute("SELECT CONCAT(first_name, ' ', last_name) as full_name FROM staff WHERE email = %s", (staff_email,))
-          staff_info = cur_temp.fetchone()
-          cur_temp.close()
-          if staff_info and staff_info.get('full_name'):
-            approver = staff_info['full_name'].strip()
+          staff_info = _load_principal('staff', staff_email)
+          full_name = f"{(staff_info or {}).get('first_name') or ''} {(staff_info or {}).get('last_name') or ''}".strip()
+          if full_name:
+            approver = full_name
             print(f"🔍 Approval Debug: Found staff name: {approver}")
         except Exception as e:
           print(f"🔍 Approval Debug: Error looking up staff name: {e}")
@@ -7261,6 +6966,8 @@ def create_app() -> Flask:
           conn.close()
           return jsonify({"ok": False, "message": "Signatory not found"}), 404
         request_id = row['request_id']
+        # Signatory, signature and request/student status updates commit together
+        mysql.begin(conn)
         # Update signatory status
         cur.execute("UPDATE clearance_signatories SET status='Approved', signed_by=%s, signed_at=NOW(), rejection_reason=NULL, remarks=NULL WHERE id=%s", (approver, signatory_id))
         
@@ -7277,18 +6984,19 @@ def create_app() -> Flask:
         
         if non_approved_count == 0:
           # All signatories approved - update request status
-          cur.execute("UPDATE clearance_requests SET status = 'Approved', fulfillment_status = 'Pending', registrar_status = 'Pending' WHERE id = %s", (request_id,))
+          with analytics_rollup.tracked(cur, 'clearance', request_id):
+            cur.execute("UPDATE clearance_requests SET status = 'Approved', fulfillment_status = 'Pending', registrar_status = 'Pending' WHERE id = %s", (request_id,))
           # Update student status
           if student_id:
             cur.execute("UPDATE students SET status = 'Approved' WHERE id = %s", (student_id,))
           # Note: Auto-transfer disabled - Registrar will manually move to pending documents
         
-        
-        # No need to commit with autocommit=True
+        mysql.commit()
         cur.close()
         conn.close()
         return jsonify({"ok": True})
       except Exception as err:
+        mysql.rollback()
         return jsonify({"ok": False, "message": f"Error: {err}"}), 500
     except Exception as err:
       return jsonify({"ok": False, "message": f"Error: {err}"}), 500
@@ -7307,12 +7015,10 @@ def create_app() -> Flask:
     
     if staff_email and not session.get('admin_name'):
       try:
-        cur_temp = mysql.cursor()
-        cur_temp.execute("SELECT CONCAT(first_name, ' ', last_name) as full_name FROM staff WHERE email = %s", (staff_email,))
-        staff_info = cur_temp.fetchone()
-        cur_temp.close()
-        if staff_info and staff_info.get('full_name'):
-          approver = staff_info['full_name'].strip()
+        staff_info = _load_principal('staff', staff_email)
+        full_name = f"{(staff_info or {}).get('first_name') or ''} {(staff_info or {}).get('last_name') or ''}".strip()
+        if full_name:
+          approver = full_name
       except Exception:
         pass  # Keep default approver if database lookup fails
     try:
@@ -7324,9 +7030,11 @@ def create_app() -> Flask:
         conn.close()
         return jsonify({"ok": False, "message": "Signatory not found"}), 404
       request_id = row['request_id']
+      mysql.begin(conn)
       remarks = (data.get('remarks') or '').strip() or None
       cur.execute("UPDATE clearance_signatories SET status='Rejected', signed_by=%s, signed_at=NOW(), rejection_reason=%s, remarks=%s WHERE id=%s", (approver, reason, remarks, signatory_id))
-      cur.execute("UPDATE clearance_requests SET status='Rejected', fulfillment_status='Rejected', registrar_status='Pending' WHERE id=%s", (request_id,))
+      with analytics_rollup.tracked(cur, 'clearance', request_id):
+        cur.execute("UPDATE clearance_requests SET status='Rejected', fulfillment_status='Rejected', registrar_status='Pending' WHERE id=%s", (request_id,))
       # Sync student status
       cur.execute("SELECT student_id FROM clearance_requests WHERE id=%s", (request_id,))
       r = cur.fetchone() or {}
@@ -7342,11 +7050,12 @@ def create_app() -> Flask:
           f"{approver} rejected your clearance due to: {reason}"
         )
       
-      # No need to commit with autocommit=True
+      mysql.commit()
       cur.close()
       conn.close()
       return jsonify({"ok": True})
     except Exception as err:
+      mysql.rollback()
       return jsonify({"ok": False, "message": f"Error: {err}"}), 500
 
   # Users list for login suggestions
@@ -7368,9 +7077,53 @@ def create_app() -> Flask:
   # Document Requests API Endpoints (separate from clearance requests)
   # ============================================================
   
+  # ---------------- Registrar list cache ----------------
+  # Per-tab results of /api/registrar/document-requests, keyed on a data version that
+  # every successful registrar/clearance/document write bumps. The TTL only bounds
+  # time-based changes (the "unclaimed" tab is defined by age).
+  registrar_lists = cache.namespace('registrar_lists', ttl=app.config['REGISTRAR_LIST_CACHE_TTL'])
+  registrar_write_routes = frozenset({
+    '/api/clearance/request',
+    '/api/document/request',
+    '/api/signatories/approve',
+    '/api/signatories/reject',
+    '/api/admin/students/<int:student_id>',
+    '/api/fix-status-inconsistencies',
+    '/api/fix-property-custodian',
+    '/api/admin/add-sample-payment',
+  })
+
+  def _bump_registrar_version():
+    registrar_lists.invalidate()
+
+  @app.after_request
+  def _invalidate_registrar_lists(response):
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 and request.url_rule is not None:
+      rule = request.url_rule.rule
+      if rule.startswith('/api/registrar/') or rule in registrar_write_routes:
+        _bump_registrar_version()
+    return response
+
   @app.route('/api/registrar/document-requests')
   def api_registrar_document_requests():
     status = request.args.get('status', 'pending')
+    use_cache = app.config['REGISTRAR_LIST_CACHE_TTL'] > 0
+    version = registrar_lists.version() if use_cache else None
+    if use_cache:
+      # The tab's ETag is cached with its data under the same version: an unchanged
+      # poll is answered without loading or serializing the list
+      etag = registrar_lists.get(f"{status}:etag", version=version)
+      not_modified = _not_modified(etag)
+      if not_modified is not None:
+        not_modified.headers['X-Cache'] = 'HIT'
+        return not_modified
+      cached = registrar_lists.get(status, version=version)
+      if cached is not None:
+        response = jsonify({"ok": True, "data": cached})
+        response.headers['X-Cache'] = 'HIT'
+        if etag:
+          response.set_etag(etag)
+        return response
     try:
       cur, conn = mysql.cursor()
       
@@ -7668,7 +7421,13 @@ def create_app() -> Flask:
           "auto_transferred_at": row.get('auto_transferred_at')
         })
       
-      return jsonify({"ok": True, "data": data})
+      response = jsonify({"ok": True, "data": data})
+      if use_cache:
+        etag = _body_etag(response)
+        response.set_etag(etag)
+        registrar_lists.set(status, data, version=version)
+        registrar_lists.set(f"{status}:etag", etag, version=version)
+      return response
     except Exception as err:
       return jsonify({"ok": False, "message": f"Error: {err}"}), 500
 
@@ -7676,45 +7435,8 @@ def create_app() -> Flask:
   def api_registrar_analytics_document_types():
     """All document names that appear in requests: direct document_requests + items in clearance_requests.documents JSON."""
     try:
-      import json
       cur, conn = mysql.cursor()
-      names = set()
-      cur.execute(
-        """
-        SELECT DISTINCT TRIM(document_type) AS t FROM document_requests
-        WHERE document_type IS NOT NULL AND TRIM(document_type) != ''
-        """
-      )
-      for r in (cur.fetchall() or []):
-        if r.get('t'):
-          names.add(str(r['t']).strip())
-
-      cur.execute(
-        """
-        SELECT documents FROM clearance_requests
-        WHERE documents IS NOT NULL AND TRIM(documents) != ''
-        """
-      )
-      for row in (cur.fetchall() or []):
-        raw = row.get('documents')
-        if raw is None:
-          continue
-        if isinstance(raw, (bytes, bytearray)):
-          raw = raw.decode('utf-8', errors='replace')
-        try:
-          parsed = json.loads(raw)
-          if isinstance(parsed, list):
-            for x in parsed:
-              if x is not None and str(x).strip():
-                names.add(str(x).strip())
-          elif isinstance(parsed, str) and parsed.strip():
-            names.add(parsed.strip())
-        except (json.JSONDecodeError, TypeError, ValueError):
-          s = str(raw).strip()
-          if s:
-            names.add(s)
-
-      sorted_names = sorted(names, key=lambda s: s.lower())
+      sorted_names = analytics_rollup.document_names(cur)
       cur.close()
       conn.close()
       return jsonify({'ok': True, 'document_types': sorted_names})
@@ -7733,6 +7455,7 @@ def create_app() -> Flask:
       document (or document_type): optional — exact document name; limits to that document type
         (document_requests.document_type and clearance requests whose JSON documents array contains it).
       Legacy: range=6|12, year=this|last (mapped to presets).
+    Counts come from the analytics_monthly_counts rollup (see analytics_rollup.py).
     """
     try:
       cur, conn = mysql.cursor()
@@ -7744,123 +7467,70 @@ def create_app() -> Flask:
         conn.close()
         return jsonify({"ok": False, "message": str(ve)}), 400
 
-      interval_sql = "created_at >= %s AND created_at < %s"
-      interval_params = (start_dt, end_dt)
-      interval_sql_cr = "cr.created_at >= %s AND cr.created_at < %s"
-      interval_sql_dr = "dr.created_at >= %s AND dr.created_at < %s"
-
       status_raw = (request.args.get('status') or '').strip()
-      dsp, dpp, dsa, dap, csp, cpp, inc_cr = _registrar_analytics_status_parts(status_raw)
-      cr_where_suffix = (csp if inc_cr else " AND 1=0")
-      cr_params = interval_params + (cpp if (inc_cr and csp) else ())
+      doc_statuses, cr_statuses = _registrar_analytics_status_filter(status_raw)
       doc_raw = (request.args.get('document') or request.args.get('document_type') or '').strip()
-      ddoc = _registrar_analytics_document_clause(doc_raw)
-      cr_params = cr_params + ddoc['cr_extra_params']
+      doc_norm = _registrar_analytics_document_filter(doc_raw)
+      doc_norm_key = doc_norm.casefold() if doc_norm else None
+
+      counts = analytics_rollup.load(cur, start_dt, end_dt)
+      cur.close()
+      conn.close()
 
-      # Get document requests from document_requests table
-      cur.execute("""
-        SELECT 
-          DATE_FORMAT(created_at, '%%Y-%%m') as month,
-          DATE_FORMAT(created_at, '%%b %%Y') as month_label,
-          document_type,
-          COUNT(*) as count
-        FROM document_requests
-        WHERE """ + interval_sql + dsp + ddoc['dr_plain'] + """
-          AND document_type IS NOT NULL
-          AND document_type != ''
-        GROUP BY DATE_FORMAT(created_at, '%%Y-%%m'), DATE_FORMAT(created_at, '%%b %%Y'), document_type
-        ORDER BY month ASC, count DESC
-      """, interval_params + dpp + ddoc['dr_plain_params'])
-      
-      document_requests_data = cur.fetchall()
-      
-      # Get data from clearance_requests table
-      cur.execute("""
-        SELECT 
-          DATE_FORMAT(created_at, '%%Y-%%m') as month,
-          DATE_FORMAT(created_at, '%%b %%Y') as month_label,
-          documents
-        FROM clearance_requests
-        WHERE """ + interval_sql + cr_where_suffix + ddoc['cr_extra_sql'] + """
-          AND documents IS NOT NULL
-          AND documents != ''
-      """, cr_params)
-      
-      clearance_requests_data = cur.fetchall()
-      
-      # Process document_requests data
       monthly_totals = {}
       data_by_month = {}
-      
-      for row in document_requests_data:
-        month = row['month']
-        month_label = row['month_label']
-        doc_type = row['document_type']
-        count = row['count']
-        
+      course_doc_counts = {}
+      course_info = {}
+      by_status = {'Pending': 0, 'Processing': 0, 'Completed': 0, 'Released': 0, 'Unclaimed': 0, 'Rejected': 0}
+
+      for (month_d, source, doc_type, status, course_name, course_code), count in sorted(counts.items()):
+        if count <= 0:
+          continue
+        is_clearance = source == analytics_rollup.SOURCE_CLEARANCE
+        allowed = cr_statuses if is_clearance else doc_statuses
+        if allowed is not None and status not in allowed:
+          continue
+        if doc_norm_key and doc_type.casefold() != doc_norm_key:
+          continue
+
+        # Requests by status: every document_requests row, linked to a clearance or not
+        if not is_clearance and status in by_status:
+          by_status[status] += count
+        if not doc_type:
+          continue
+
+        month = month_d.strftime('%Y-%m')
         if month not in monthly_totals:
           monthly_totals[month] = 0
           data_by_month[month] = {
-            'label': month_label,
+            'label': month_d.strftime('%b %Y'),
             'documents': {}
           }
-        
         monthly_totals[month] += count
-        if doc_type not in data_by_month[month]['documents']:
-          data_by_month[month]['documents'][doc_type] = 0
-        data_by_month[month]['documents'][doc_type] += count
-      
-      # Process clearance_requests data - extract individual documents from JSON column only
-      import json
-      for row in clearance_requests_data:
-        month = row['month']
-        month_label = row['month_label']
-        documents_json = row['documents']
-        
-        if month not in monthly_totals:
-          monthly_totals[month] = 0
-          data_by_month[month] = {
-            'label': month_label,
-            'documents': {}
+        data_by_month[month]['documents'][doc_type] = data_by_month[month]['documents'].get(doc_type, 0) + count
+
+        # By course: clearance items + document requests not created from a clearance
+        if source == analytics_rollup.SOURCE_CLEARANCE_DOCUMENT:
+          continue
+        course = course_name or course_code or 'Unknown'
+        if course not in course_info:
+          course_info[course] = {
+            'course_name': course_name or None,
+            'course_code': course_code or None
           }
-        
-        # Only use documents JSON column, ignore document_type field
-        document_list = []
-        if documents_json:
-          try:
-            parsed_docs = json.loads(documents_json)
-            if isinstance(parsed_docs, list):
-              document_list = parsed_docs
-            elif isinstance(parsed_docs, str):
-              document_list = [parsed_docs]
-          except:
-            # If not JSON, treat as single document string
-            if documents_json:
-              document_list = [documents_json]
-        
-        # Count each document type from documents JSON only
-        doc_norm = ddoc.get('norm')
-        for doc_type in document_list:
-          if doc_type and doc_type.strip():
-            dt = doc_type.strip()
-            if doc_norm and dt != doc_norm:
-              continue
-            monthly_totals[month] += 1
-            if dt not in data_by_month[month]['documents']:
-              data_by_month[month]['documents'][dt] = 0
-            data_by_month[month]['documents'][dt] += 1
-      
-      # Calculate percentages and format data
+        if course not in course_doc_counts:
+          course_doc_counts[course] = {}
+        course_doc_counts[course][doc_type] = course_doc_counts[course].get(doc_type, 0) + count
+
       months = []
       document_types_set = set()
-      
       for month, data in sorted(data_by_month.items()):
         months.append(data['label'])
         for doc_type in data['documents'].keys():
           document_types_set.add(doc_type)
-      
+
       document_types = sorted(list(document_types_set))
-      
+
       # Build datasets for each document type
       datasets = []
       # Extended color palette for all document types
@@ -7890,9 +7560,7 @@ def create_app() -> Flask:
       for idx, doc_type in enumerate(document_types):
         data = []
         for month in sorted(data_by_month.keys()):
-          month_data = data_by_month[month]
-          count = month_data['documents'].get(doc_type, 0)
-          data.append(count)
+          data.append(data_by_month[month]['documents'].get(doc_type, 0))
         
         datasets.append({
           'label': doc_type,
@@ -7904,70 +7572,6 @@ def create_app() -> Flask:
       
       monthly_totals_arr = [monthly_totals[m] for m in sorted(data_by_month.keys())]
       
-      # By course with document breakdown (same date range as above)
-      cur.execute("""
-        SELECT COALESCE(NULLIF(TRIM(s.course_name), ''), NULLIF(TRIM(s.course_code), ''), 'Unknown') AS course,
-               NULLIF(TRIM(s.course_name), '') AS course_name,
-               NULLIF(TRIM(s.course_code), '') AS course_code,
-               cr.documents
-        FROM clearance_requests cr
-        JOIN students s ON s.id = cr.student_id
-        WHERE """ + interval_sql_cr + cr_where_suffix + ddoc['cr_extra_sql_alias'] + """
-          AND cr.documents IS NOT NULL AND cr.documents != ''
-      """, cr_params)
-      course_doc_counts = {}
-      course_info = {}
-      for row in (cur.fetchall() or []):
-        course = row['course'] or 'Unknown'
-        if course not in course_info:
-          course_info[course] = {
-            'course_name': row.get('course_name'),
-            'course_code': row.get('course_code')
-          }
-        docs_json = row['documents']
-        doc_list = []
-        if docs_json:
-          try:
-            parsed = json.loads(docs_json)
-            doc_list = parsed if isinstance(parsed, list) else [parsed] if isinstance(parsed, str) else []
-          except Exception:
-            if isinstance(docs_json, str):
-              doc_list = [docs_json]
-        for doc_type in doc_list:
-          if doc_type and str(doc_type).strip():
-            doc_type = str(doc_type).strip()
-            if ddoc.get('norm') and doc_type != ddoc['norm']:
-              continue
-            if course not in course_doc_counts:
-              course_doc_counts[course] = {}
-            course_doc_counts[course][doc_type] = course_doc_counts[course].get(doc_type, 0) + 1
-      cur.execute("""
-        SELECT COALESCE(NULLIF(TRIM(s.course_name), ''), NULLIF(TRIM(s.course_code), ''), 'Unknown') AS course,
-               MAX(NULLIF(TRIM(s.course_name), '')) AS course_name,
-               MAX(NULLIF(TRIM(s.course_code), '')) AS course_code,
-               dr.document_type AS doc_type,
-               COUNT(*) AS cnt
-        FROM document_requests dr
-        JOIN students s ON s.id = dr.student_id
-        WHERE """ + interval_sql_dr + dsa + ddoc['dr_alias_extra_sql'] + """
-          AND dr.clearance_request_id IS NULL
-          AND dr.document_type IS NOT NULL AND dr.document_type != ''
-        GROUP BY 1, 4
-      """, interval_params + dap + ddoc['dr_alias_extra_params'])
-      for row in (cur.fetchall() or []):
-        course = row['course'] or 'Unknown'
-        if course not in course_info:
-          course_info[course] = {
-            'course_name': row.get('course_name'),
-            'course_code': row.get('course_code')
-          }
-        doc_type = (row['doc_type'] or '').strip()
-        if not doc_type:
-          continue
-        if course not in course_doc_counts:
-          course_doc_counts[course] = {}
-        course_doc_counts[course][doc_type] = course_doc_counts[course].get(doc_type, 0) + row['cnt']
-      
       all_doc_types_course = set()
       for doc_dict in course_doc_counts.values():
         all_doc_types_course.update(doc_dict.keys())
@@ -7988,19 +7592,6 @@ def create_app() -> Flask:
         })
       by_course.sort(key=lambda x: x['total'], reverse=True)
 
-      # Requests by status (document_requests in same period; respects status + document filter)
-      cur.execute("""
-        SELECT status, COUNT(*) AS cnt
-        FROM document_requests
-        WHERE """ + interval_sql + dsp + ddoc['dr_plain'] + """
-        GROUP BY status
-      """, interval_params + dpp + ddoc['dr_plain_params'])
-      by_status = {'Pending': 0, 'Processing': 0, 'Completed': 0, 'Released': 0, 'Unclaimed': 0, 'Rejected': 0}
-      for row in (cur.fetchall() or []):
-        s = (row['status'] or '').strip()
-        if s in by_status:
-          by_status[s] = row['cnt']
-
       status_summary = {
         'rejected': by_status.get('Rejected', 0),
         'fulfilled': by_status.get('Completed', 0) + by_status.get('Released', 0) + by_status.get('Unclaimed', 0),
@@ -8013,9 +7604,6 @@ def create_app() -> Flask:
           agg_doc[dt] = agg_doc.get(dt, 0) + cnt
       by_document_type = [{'document_type': k, 'count': v} for k, v in sorted(agg_doc.items(), key=lambda x: -x[1])]
 
-      cur.close()
-      conn.close()
-
       return jsonify({
         'ok': True,
         'data': {
@@ -8033,7 +7621,7 @@ def create_app() -> Flask:
           'preset': preset,
           'ym': ym if preset == 'month' else None,
           'status_filter': (status_raw or 'all').lower(),
-          'document_filter': (ddoc['norm'] or 'all'),
+          'document_filter': (doc_norm or 'all'),
         }
       })
     except Exception as err:
@@ -8095,7 +7683,8 @@ def create_app() -> Flask:
           }), 400
         
         # All clearances are approved - proceed with processing
-        cur.execute("UPDATE document_requests SET status='Processing', updated_at=NOW() WHERE id=%s", (request_id,))
+        with analytics_rollup.tracked(cur, 'document', request_id):
+          cur.execute("UPDATE document_requests SET status='Processing', updated_at=NOW() WHERE id=%s", (request_id,))
         
         # Get student_id for notification
         cur.execute("SELECT student_id FROM document_requests WHERE id=%s", (request_id,))
@@ -8122,7 +7711,8 @@ def create_app() -> Flask:
         })
       else:
         # This is a regular document request (not from clearance) - allow processing
-        cur.execute("UPDATE document_requests SET status='Processing', updated_at=NOW() WHERE id=%s", (request_id,))
+        with analytics_rollup.tracked(cur, 'document', request_id):
+          cur.execute("UPDATE document_requests SET status='Processing', updated_at=NOW() WHERE id=%s", (request_id,))
         
         # Get student_id for notification
         cur.execute("SELECT student_id FROM document_requests WHERE id=%s", (request_id,))
@@ -8207,16 +7797,17 @@ def create_app() -> Flask:
           print(f"[UPLOAD DEBUG] File metadata saved to database")
 
       # Update document_requests status to Completed (not Released) so registrar can choose next state
-      cur.execute("UPDATE document_requests SET status='Completed', completed_at=NOW(), updated_at=NOW() WHERE id=%s", (request_id,))
-      
-      # Also update the corresponding clearance_requests fulfillment_status to Completed
-      # This ensures the consolidation logic in /api/student/requests works correctly
-      cur.execute("""
-        UPDATE clearance_requests cr 
-        JOIN document_requests dr ON dr.clearance_request_id = cr.id 
-        SET cr.fulfillment_status = 'Completed', cr.registrar_status = 'Complete', cr.updated_at = NOW() 
-        WHERE dr.id = %s
-      """, (request_id,))
+      with analytics_rollup.tracked_document(cur, request_id):
+        cur.execute("UPDATE document_requests SET status='Completed', completed_at=NOW(), updated_at=NOW() WHERE id=%s", (request_id,))
+        
+        # Also update the corresponding clearance_requests fulfillment_status to Completed
+        # This ensures the consolidation logic in /api/student/requests works correctly
+        cur.execute("""
+          UPDATE clearance_requests cr 
+          JOIN document_requests dr ON dr.clearance_request_id = cr.id 
+          SET cr.fulfillment_status = 'Completed', cr.registrar_status = 'Complete', cr.updated_at = NOW() 
+          WHERE dr.id = %s
+        """, (request_id,))
       
       # Create notification for student
       cur.execute("SELECT student_id FROM document_requests WHERE id=%s", (request_id,))
@@ -8249,16 +7840,17 @@ def create_app() -> Flask:
       return jsonify({"ok": False, "message": "Missing request_id"}), 400
     try:
       cur, conn = mysql.cursor()
-      cur.execute("UPDATE document_requests SET status='Released', updated_at=NOW() WHERE id=%s", (request_id,))
-      
-      # Also update the corresponding clearance_requests fulfillment_status to Released
-      # This ensures the consolidation logic in /api/student/requests works correctly
-      cur.execute("""
-        UPDATE clearance_requests cr 
-        JOIN document_requests dr ON dr.clearance_request_id = cr.id 
-        SET cr.fulfillment_status = 'Released', cr.registrar_status = 'Complete', cr.updated_at = NOW() 
-        WHERE dr.id = %s
-      """, (request_id,))
+      with analytics_rollup.tracked_document(cur, request_id):
+        cur.execute("UPDATE document_requests SET status='Released', updated_at=NOW() WHERE id=%s", (request_id,))
+        
+        # Also update the corresponding clearance_requests fulfillment_status to Released
+        # This ensures the consolidation logic in /api/student/requests works correctly
+        cur.execute("""
+          UPDATE clearance_requests cr 
+          JOIN document_requests dr ON dr.clearance_request_id = cr.id 
+          SET cr.fulfillment_status = 'Released', cr.registrar_status = 'Complete', cr.updated_at = NOW() 
+          WHERE dr.id = %s
+        """, (request_id,))
       
       # Create notification for student
       cur.execute("SELECT student_id FROM document_requests WHERE id=%s", (request_id,))
@@ -8287,16 +7879,17 @@ def create_app() -> Flask:
       return jsonify({"ok": False, "message": "Missing request_id"}), 400
     try:
       cur, conn = mysql.cursor()
-      cur.execute("UPDATE document_requests SET status='Unclaimed', updated_at=NOW() WHERE id=%s", (request_id,))
-      
-      # Also update the corresponding clearance_requests fulfillment_status to Unclaimed
-      # This ensures the consolidation logic in /api/student/requests works correctly
-      cur.execute("""
-        UPDATE clearance_requests cr 
-        JOIN document_requests dr ON dr.clearance_request_id = cr.id 
-        SET cr.fulfillment_status = 'Unclaimed', cr.registrar_status = 'Complete', cr.updated_at = NOW() 
-        WHERE dr.id = %s
-      """, (request_id,))
+      with analytics_rollup.tracked_document(cur, request_id):
+        cur.execute("UPDATE document_requests SET status='Unclaimed', updated_at=NOW() WHERE id=%s", (request_id,))
+        
+        # Also update the corresponding clearance_requests fulfillment_status to Unclaimed
+        # This ensures the consolidation logic in /api/student/requests works correctly
+        cur.execute("""
+          UPDATE clearance_requests cr 
+          JOIN document_requests dr ON dr.clearance_request_id = cr.id 
+          SET cr.fulfillment_status = 'Unclaimed', cr.registrar_status = 'Complete', cr.updated_at = NOW() 
+          WHERE dr.id = %s
+        """, (request_id,))
       
       # Create notification for student
       cur.execute("SELECT student_id FROM document_requests WHERE id=%s", (request_id,))
@@ -8319,12 +7912,13 @@ def create_app() -> Flask:
 
   @app.route('/api/test-ai-connectivity', methods=['GET'])
   def api_test_ai_connectivity():
-    """Test AI service connectivity"""
+    """AI service status from the Groq circuit breaker (closed / half_open / open)"""
     try:
       is_reachable, message = _test_ai_connectivity()
       return jsonify({
         "ok": is_reachable,
         "message": message,
+        "state": groq.breaker.state if groq is not None else None,
         "timestamp": datetime.now().isoformat()
       })
     except Exception as e:
@@ -8334,12 +7928,73 @@ def create_app() -> Flask:
         "timestamp": datetime.now().isoformat()
       })
 
+  # ---------------- Receipt extraction cache ----------------
+  # Picking a receipt runs the extractor, submitting validates the same image again and
+  # double-clicks repeat both. Results are keyed by a hash of the compressed image; a
+  # successful extraction is reused for RECEIPT_EXTRACT_CACHE_TTL seconds and identical
+  # calls in flight at the same time share one AI request. Failures are not cached.
+  receipt_extractions = cache.namespace('receipt_extractions', ttl=app.config['RECEIPT_EXTRACT_CACHE_TTL'])
+  receipt_flights = SingleFlight()
+
+  def _receipt_bytes(image_b64):
+    """Compressed JPEG bytes for a base64 (or data: URL) receipt image, as stored and sent to the AI"""
+    if image_b64.startswith('data:'):
+      image_b64 = image_b64.split(',', 1)[1]
+    raw = base64.b64decode(image_b64)
+    return _compress_image(io.BytesIO(raw)) if io is not None else raw
+
+  def _extract_receipt(image_data):
+    """_groq_extract() for compressed image bytes, through the content-hash cache"""
+    key = hashlib.sha256(image_data).hexdigest()
+    use_cache = app.config['RECEIPT_EXTRACT_CACHE_TTL'] > 0
+    if use_cache:
+      cached = receipt_extractions.get(key)
+      if cached is not None:
+        return cached
+
+    def run():
+      result = _groq_extract(base64.b64encode(image_data).decode('utf-8'))
+      if use_cache and result.get('ok'):
+        receipt_extractions.set(key, result)
+      return result
+
+    result, _shared = receipt_flights.do(key, run)
+    return dict(result)
+
+  def _extraction_payload(ai_result):
+    """Body of /api/receipt/extract-reference (and finished extract jobs) for an extraction result"""
+    if not ai_result.get('ok'):
+      body = {"ok": False, "message": ai_result.get('message', 'AI extraction failed. Please try again.')}
+      if ai_result.get('ai_unavailable'):
+        body["ai_unavailable"] = True
+        body["busy"] = bool(ai_result.get('busy'))
+      return body
+
+    reference_number = (ai_result.get('reference_number') or '').strip()
+    confidence = float(ai_result.get('confidence') or 0.0)
+
+    if not reference_number:
+      return {
+        "ok": False,
+        "reference_number": "",
+        "confidence": confidence,
+        "message": "No reference number could be detected from the receipt. Please type it manually."
+      }
+
+    return {
+      "ok": True,
+      "reference_number": reference_number,
+      "confidence": confidence,
+      "message": "Reference number detected from receipt."
+    }
+
   @app.route('/api/receipt/extract-reference', methods=['POST'])
   def api_extract_reference_from_receipt():
     """Extract reference number from an uploaded receipt image using Groq AI.
 
     This is used by the student dashboard to auto-fill the reference number field
     after the user selects a receipt image, so they don't need to type it manually.
+    Runs the AI call inside the request; the dashboard uses /api/receipt/jobs instead.
     """
     try:
       if 'payment_receipt' not in request.files:
@@ -8356,32 +8011,9 @@ def create_app() -> Flask:
 
       # Compress image and run through AI extractor (same path used for full validation)
       compressed_data = _compress_image(receipt_file)
-      image_b64 = base64.b64encode(compressed_data).decode('utf-8')
-
-      ai_result = _groq_extract(image_b64)
-      if not ai_result.get('ok'):
-        return jsonify({"ok": False, "message": ai_result.get('message', 'AI extraction failed. Please try again.')})
-
-      reference_number = (ai_result.get('reference_number') or '').strip()
-      confidence = float(ai_result.get('confidence') or 0.0)
-
-      if not reference_number:
-        return jsonify({
-          "ok": False,
-          "reference_number": "",
-          "confidence": confidence,
-          "message": "No reference number could be detected from the receipt. Please type it manually."
-        })
-
-      return jsonify({
-        "ok": True,
-        "reference_number": reference_number,
-        "confidence": confidence,
-        "message": "Reference number detected from receipt."
-      })
+      return jsonify(_extraction_payload(_extract_receipt(compressed_data)))
     except Exception as e:
       return jsonify({"ok": False, "message": f"Error extracting reference number: {str(e)}"}), 500
-
   @app.route('/api/check-reference-duplicate', methods=['POST'])
   def api_check_reference_duplicate():
     """Check if a reference number has already been used."""
@@ -8393,29 +8025,9 @@ def create_app() -> Flask:
         return jsonify({"ok": False, "message": "Reference number is required"})
       
       cur, conn = mysql.cursor()
-      # Global duplicate check across BOTH request sources.
-      # This ensures references already used in document requests are also detected
-      # during AI validation/pre-check flow.
-      cur.execute(
-        """
-        SELECT source, id FROM (
-          SELECT 'clearance' AS source, id
-          FROM clearance_requests
-          WHERE reference_number = %s
-          LIMIT 1
-        ) a
-        UNION ALL
-        SELECT source, id FROM (
-          SELECT 'document' AS source, id
-          FROM document_requests
-          WHERE reference_number = %s
-          LIMIT 1
-        ) b
-        LIMIT 1
-        """,
-        (reference_number, reference_number)
-      )
-      existing_request = cur.fetchone()
+      # Global duplicate check across BOTH request sources: one primary-key lookup in the
+      # payment_references registry (claimed at submit time by clearance and document requests)
+      existing_request = payment_references.owner(cur, reference_number)
       try:
         cur.close()
         conn.close()
@@ -8438,6 +8050,48 @@ def create_app() -> Flask:
     except Exception as e:
       return jsonify({"ok": False, "message": f"Error checking reference number: {str(e)}"})
 
+  def _validation_payload(result, reference_number):
+    """Body of /api/validate-receipt-reference (and finished validate jobs) for an extraction result"""
+    if not result.get('ok'):
+      if result.get('ai_unavailable'):
+        return {"ok": False, "ai_unavailable": True, "busy": bool(result.get('busy')), "message": result.get('message')}
+      return {"ok": False, "message": f"AI processing failed: {result.get('message', 'Unknown error')}"}
+    
+    # Compare extracted reference number(s) with provided one (AI field + raw_text digits;
+    # same rules as receipt_reverify.py)
+    extracted_ref = (result.get('reference_number') or '').strip()
+    provided_ref = (reference_number or '').strip()
+    raw_text = (result.get('raw_text') or '')
+    confidence = float(result.get('confidence') or 0.0)
+    match = receipt_ai.match_reference(result, provided_ref)
+
+    # User-friendly message when no reference number found (wrong image type or unreadable)
+    user_message = None
+    if not match['has_digits']:
+      user_message = (
+        "No reference number found in the image. "
+        "Please upload a clear photo of your payment receipt (e.g. GCash, payment slip) that clearly shows the reference number."
+      )
+    
+    return {
+      "ok": True,
+      "matches": match['matches'],
+      "extracted_reference": extracted_ref if extracted_ref else "Not found",
+      "provided_reference": provided_ref,
+      "extracted_digits": match['extracted_digits'],
+      "provided_digits": match['provided_digits'],
+      "confidence": confidence,
+      "amount": result.get('amount'),
+      "raw_text": raw_text,
+      "ai_success": match['has_digits'],
+      "user_message": user_message,
+      "debug_info": {
+        "ai_processed": True,
+        "extraction_successful": match['has_digits'],
+        "confidence_level": confidence
+      }
+    }
+
   @app.route('/api/validate-receipt-reference', methods=['POST'])
   def api_validate_receipt_reference():
     """Validate if the reference number matches the receipt using Groq AI."""
@@ -8449,91 +8103,114 @@ def create_app() -> Flask:
       if not receipt_image or not reference_number:
         return jsonify({"ok": False, "message": "Missing receipt image or reference number"})
       
-      # Use Groq AI to extract reference number from receipt
-      result = _gemini_extract(receipt_image)
-      
-      if not result.get('ok'):
-        return jsonify({"ok": False, "message": f"AI processing failed: {result.get('message', 'Unknown error')}"})
-      
-      # Compare extracted reference number(s) with provided one.
-      # Use multiple candidates (AI field + raw_text digits) to avoid picking wrong numbers.
-      extracted_ref = (result.get('reference_number') or '').strip()
-      provided_ref = (reference_number or '').strip()
-      
-      import re
-      extracted_digits = re.sub(r'\D', '', extracted_ref)
-      provided_digits = re.sub(r'\D', '', provided_ref)
-      raw_text = (result.get('raw_text') or '')
-      confidence = float(result.get('confidence') or 0.0)
-
-      # Build candidate list (7-16 digit sequences)
-      candidates = []
-      seen = set()
-      def _add(val: str):
-        if not val:
-          return
-        if not re.fullmatch(r'\d{7,16}', val):
-          return
-        if val in seen:
-          return
-        seen.add(val)
-        candidates.append(val)
-
-      _add(extracted_digits)
-      for m in re.findall(r'\b\d{7,16}\b', raw_text):
-        _add(m)
-      raw_digits_stream = re.sub(r'\D', '', raw_text)
-      stream_contains = bool(provided_digits) and (provided_digits in raw_digits_stream)
-
-      # Determine match
-      matches = False
-      if provided_digits and provided_digits in candidates:
-        matches = True
-      elif stream_contains:
-        # Avoid accidental substring match if there are conflicting same-length candidates
-        conflicts = [c for c in candidates if len(c) == len(provided_digits) and c != provided_digits]
-        if not conflicts:
-          matches = True
-      
-      # Enhanced debug logging
-      print(f"DEBUG: Raw extracted: '{extracted_ref}' -> digits: '{extracted_digits}'")
-      print(f"DEBUG: Raw provided: '{provided_ref}' -> digits: '{provided_digits}'")
-      print(f"DEBUG: AI confidence: {confidence}")
-      print(f"DEBUG: Raw text from AI: {raw_text[:200]}...")
-      print(f"DEBUG: Candidates: {candidates[:10]}{'...' if len(candidates) > 10 else ''}")
-      print(f"DEBUG: Stream contains provided? {stream_contains}")
-      print(f"DEBUG: Final match result: {matches}")
-      
-      # User-friendly message when no reference number found (wrong image type or unreadable)
-      user_message = None
-      if not candidates and not raw_digits_stream:
-        user_message = (
-          "No reference number found in the image. "
-          "Please upload a clear photo of your payment receipt (e.g. GCash, payment slip) that clearly shows the reference number."
-        )
-      
-      return jsonify({
-        "ok": True,
-        "matches": matches,
-        "extracted_reference": extracted_ref if extracted_ref else "Not found",
-        "provided_reference": provided_ref,
-        "extracted_digits": extracted_digits,
-        "provided_digits": provided_digits,
-        "confidence": confidence,
-        "amount": result.get('amount'),
-        "raw_text": raw_text,
-        "ai_success": bool(candidates or raw_digits_stream),
-        "user_message": user_message,
-        "debug_info": {
-          "ai_processed": True,
-          "extraction_successful": bool(candidates or raw_digits_stream),
-          "confidence_level": confidence
-        }
-      })
+      # Use Groq AI to extract reference number from receipt (compressed like the upload path,
+      # so the extraction done when the receipt was picked is reused)
+      try:
+        receipt_data = _receipt_bytes(receipt_image)
+      except (ValueError, TypeError):
+        return jsonify({"ok": False, "message": "Invalid receipt image"})
+      result = _extract_receipt(receipt_data)
       
+      return jsonify(_validation_payload(result, reference_number))
     except Exception as e:
       return jsonify({"ok": False, "message": f"Validation error: {str(e)}"})
 
+  # ---------------- Receipt verification jobs ----------------
+  # The dashboard submits receipts here instead of waiting on the AI inside the request:
+  # POST returns a job id at once, worker threads (RECEIPT_JOB_WORKERS per process) run
+  # the extraction by priority (submit-time validation before auto-fill), and the page
+  # polls GET /api/receipt/jobs/<id>. `?wait=N` long-polls up to RECEIPT_JOB_MAX_WAIT
+  # seconds; leave that at 0 with sync gunicorn workers, where a waiting poll holds the worker.
+  def _run_receipt_job(image_data):
+    with app.app_context():
+      return _extract_receipt(image_data)
+
+  receipt_jobs = ReceiptJobQueue(
+    mysql.cursor,
+    _run_receipt_job,
+    workers=app.config['RECEIPT_JOB_WORKERS'],
+    max_pending=app.config['RECEIPT_JOB_MAX_PENDING'],
+  )
+
+  def _receipt_job_owner():
+    return session.get('student_email') or session.get('staff_email') or session.get('dean_email') or ''
+
+  def _receipt_job_payload(job):
+    body = {"ok": True, "job_id": job['id'], "status": job['status'], "purpose": job['purpose']}
+    if job['status'] == 'queued':
+      body["position"] = receipt_jobs.position(job)
+    elif job['status'] == 'done':
+      result = job.get('result') or {}
+      if job['purpose'] == 'validate':
+        body["result"] = _validation_payload(result, job['reference_number'])
+      else:
+        body["result"] = _extraction_payload(result)
+    elif job['status'] == 'failed':
+      body["result"] = {"ok": False, "message": "AI receipt check failed. Please try again or type the reference number manually."}
+    return body
+
+  @app.route('/api/receipt/jobs', methods=['POST'])
+  def api_submit_receipt_job():
+    """Queue AI extraction for a receipt: multipart `payment_receipt` or JSON `receipt_image` (base64).
+    With `reference_number` (purpose "validate") the result says whether it matches the receipt."""
+    try:
+      if request.files.get('payment_receipt'):
+        receipt_file = request.files['payment_receipt']
+        is_valid, validation_message = _validate_image(receipt_file)
+        if not is_valid:
+          return jsonify({"ok": False, "message": f"Invalid receipt image: {validation_message}"}), 400
+        image_data = _compress_image(receipt_file)
+        data = request.form
+      else:
+        data = request.get_json(silent=True) or {}
+        if not data.get('receipt_image'):
+          return jsonify({"ok": False, "message": "Receipt image is required."}), 400
+        try:
+          image_data = _receipt_bytes(data['receipt_image'])
+        except (ValueError, TypeError):
+          return jsonify({"ok": False, "message": "Invalid receipt image"}), 400
+
+      reference_number = (data.get('reference_number') or '').strip()
+      purpose = data.get('purpose') or ('validate' if reference_number else 'extract')
+      if purpose not in ('extract', 'validate'):
+        return jsonify({"ok": False, "message": "purpose must be 'extract' or 'validate'"}), 400
+      if purpose == 'validate' and not reference_number:
+        return jsonify({"ok": False, "message": "Missing receipt image or reference number"}), 400
+
+      if groq.breaker.state == 'open':
+        # Groq is down: don't queue work that would only fail; the page switches to manual entry
+        return jsonify({"ok": False, "ai_unavailable": True, "message": receipt_ai.UNAVAILABLE_MESSAGE}), 503
+      receipt_jobs.start()
+      try:
+        job = receipt_jobs.submit(image_data, purpose, reference_number if purpose == 'validate' else '',
+                                  _receipt_job_owner())
+      except QueueFull:
+        return jsonify({
+          "ok": False,
+          "busy": True,
+          "message": receipt_ai.BUSY_MESSAGE
+        }), 503
+      body = _receipt_job_payload(job)
+      return jsonify(body), (200 if 'result' in body else 202)
+    except Exception as e:
+      return jsonify({"ok": False, "message": f"Error queueing receipt check: {str(e)}"}), 500
+
+  @app.route('/api/receipt/jobs/<int:job_id>')
+  def api_receipt_job_status(job_id: int):
+    """Status of a receipt job; `result` holds the extract/validate response once it has finished"""
+    try:
+      receipt_jobs.start()
+      try:
+        wait = min(float(request.args.get('wait', 0)), app.config['RECEIPT_JOB_MAX_WAIT'])
+      except ValueError:
+        wait = 0
+      job = receipt_jobs.wait(job_id, wait) if wait > 0 else receipt_jobs.get(job_id)
+      if job is None or (job.get('owner') and job['owner'] != _receipt_job_owner()):
+        return jsonify({"ok": False, "message": "Receipt job not found"}), 404
+      return jsonify(_receipt_job_payload(job))
+    except Exception as e:
+      return jsonify({"ok": False, "message": f"Error reading receipt job: {str(e)}"}), 500
+
   @app.route('/api/student/document-files/<int:request_id>')
   def api_student_document_files(request_id: int):
     """List downloadable files for a completed document request."""
@@ -8625,7 +8302,8 @@ def create_app() -> Flask:
     rejection_reason = f"{reason}: {remarks}" if remarks else reason
     try:
       cur, conn = mysql.cursor()
-      cur.execute("UPDATE document_requests SET status='Rejected', rejection_reason=%s, updated_at=NOW() WHERE id=%s", (rejection_reason, request_id))
+      with analytics_rollup.tracked(cur, 'document', request_id):
+        cur.execute("UPDATE document_requests SET status='Rejected', rejection_reason=%s, updated_at=NOW() WHERE id=%s", (rejection_reason, request_id))
       # No need to commit with autocommit=True
       cur.close()
       conn.close()
@@ -8642,8 +8320,7 @@ def create_app() -> Flask:
       
       cur, conn = mysql.cursor()
       # Get student id and name for activity log
-      cur.execute("SELECT id, first_name, middle_name, last_name FROM students WHERE email = %s", (student_email,))
-      stu = cur.fetchone()
+      stu = _get_current_student(cur)
       if not stu:
         cur.close()
         conn.close()
@@ -8687,16 +8364,22 @@ def create_app() -> Flask:
       # Allow same reference number for multiple document types (one receipt for multiple certificates)
       if reference_number:
         # NOTE: We no longer enforce a strict 7-16 digit pattern so real-world reference formats are accepted.
-        # Only reject if same student already used this reference for the SAME document type (true duplicate)
-        cur.execute(
-          "SELECT id FROM document_requests WHERE reference_number = %s AND student_id = %s AND document_type = %s",
-          (reference_number, student_id, document_type)
-        )
-        existing_request = cur.fetchone()
-        if existing_request:
+        # Reject a reference owned by another student or a clearance request, or already used by this
+        # student for the SAME document type (true duplicate)
+        used_by = payment_references.owner(cur, reference_number)
+        if used_by and not payment_references.shareable(used_by, payment_references.SOURCE_DOCUMENT, student_id):
           cur.close()
           conn.close()
-          return jsonify({"ok": False, "message": f"Reference number '{reference_number}' has already been used for this document type. Please use a different reference number."}), 400
+          return jsonify({"ok": False, "message": f"Reference number '{reference_number}' has already been used. Please use a different reference number."}), 400
+        if used_by:
+          cur.execute(
+            "SELECT id FROM document_requests WHERE reference_number = %s AND student_id = %s AND document_type = %s",
+            (reference_number, student_id, document_type)
+          )
+          if cur.fetchone():
+            cur.close()
+            conn.close()
+            return jsonify({"ok": False, "message": f"Reference number '{reference_number}' has already been used for this document type. Please use a different reference number."}), 400
       
       # Handle payment receipt upload (FormData only) - similar to clearance requests
       receipt_data = None
@@ -8741,15 +8424,33 @@ def create_app() -> Flask:
       
       # Create new document request with payment information and receipt
       print(f"🔍 DEBUG: Document request - Storing in database - receipt_data: {'Yes' if receipt_data else 'No'}, receipt_s3_url: {receipt_s3_url}, receipt_s3_key: {receipt_s3_key}")
-      cur.execute(
-        """INSERT INTO document_requests 
-           (student_id, document_type, purpose, status, payment_method, payment_amount, reference_number, payment_receipt, payment_receipt_s3_url, payment_receipt_s3_key) 
-           VALUES (%s, %s, %s, 'Pending', %s, %s, %s, %s, %s, %s)""",
-        (student_id, document_type, purpose, payment_method, payment_amount, reference_number, receipt_data, receipt_s3_url, receipt_s3_key)
-      )
-      document_request_id = cur.lastrowid
-      
-      # No need to commit with autocommit=True
+      # Request row and its payment reference claim commit together
+      mysql.begin(conn)
+      try:
+        cur.execute(
+          """INSERT INTO document_requests 
+             (student_id, document_type, purpose, status, payment_method, payment_amount, reference_number, payment_receipt, payment_receipt_s3_url, payment_receipt_s3_key) 
+             VALUES (%s, %s, %s, 'Pending', %s, %s, %s, %s, %s, %s)""",
+          (student_id, document_type, purpose, payment_method, payment_amount, reference_number, receipt_data, receipt_s3_url, receipt_s3_key)
+        )
+        document_request_id = cur.lastrowid
+        conflict = payment_references.claim(cur, reference_number, payment_references.SOURCE_DOCUMENT,
+                                            document_request_id, student_id, document_type)
+      except Exception as insert_err:
+        mysql.rollback()
+        cur.close()
+        conn.close()
+        if getattr(insert_err, 'args', None) and insert_err.args[0] == payment_references.ER_DUP_ENTRY:
+          # Lost a race with an identical submit (unique reference/student/document type)
+          return jsonify({"ok": False, "message": f"Reference number '{reference_number}' has already been used for this document type. Please use a different reference number."}), 400
+        raise
+      if conflict:
+        mysql.rollback()
+        cur.close()
+        conn.close()
+        return jsonify({"ok": False, "message": f"Reference number '{reference_number}' has already been used. Please use a different reference number."}), 400
+      analytics_rollup.added(cur, 'document', document_request_id)
+      mysql.commit()
       cur.close()
       conn.close()
       
@@ -8890,6 +8591,8 @@ def create_app() -> Flask:
           conn.close()
           return jsonify({"ok": False, "message": "Request not found"}), 404
 
+      # File rows, status updates and the student notification commit together
+      mysql.begin(conn)
       # Save uploaded files: document requests -> document_files; clearance-only -> clearance_files
       saved_files = []
       folder_id = request_id if is_document_request else (clearance_id or request_id)
@@ -8918,27 +8621,31 @@ def create_app() -> Flask:
         saved_files.append({"name": file.filename})
 
       # Update status: clearance_requests and optionally document_requests
-      if clearance_id:
-        cur.execute("""
-            UPDATE clearance_requests 
-            SET fulfillment_status = 'Completed', registrar_status = 'Complete', updated_at = NOW() 
-            WHERE id = %s
-        """, (clearance_id,))
-        cur.execute("SELECT student_id FROM clearance_requests WHERE id = %s", (clearance_id,))
-      if is_document_request:
-        cur.execute("""
-            UPDATE document_requests 
-            SET status = 'Completed', completed_at = NOW(), updated_at = NOW() 
-            WHERE id = %s
-        """, (request_id,))
+      with analytics_rollup.tracked(cur, 'clearance', clearance_id), \
+           analytics_rollup.tracked(cur, 'document', request_id if is_document_request else None):
         if clearance_id:
           cur.execute("""
-              UPDATE clearance_requests cr
-              JOIN document_requests dr ON dr.clearance_request_id = cr.id
-              SET cr.fulfillment_status = 'Completed', cr.registrar_status = 'Complete', cr.updated_at = NOW()
-              WHERE dr.id = %s
+              UPDATE clearance_requests 
+              SET fulfillment_status = 'Completed', registrar_status = 'Complete', updated_at = NOW() 
+              WHERE id = %s
+          """, (clearance_id,))
+        if is_document_request:
+          cur.execute("""
+              UPDATE document_requests 
+              SET status = 'Completed', completed_at = NOW(), updated_at = NOW() 
+              WHERE id = %s
           """, (request_id,))
+          if clearance_id:
+            cur.execute("""
+                UPDATE clearance_requests cr
+                JOIN document_requests dr ON dr.clearance_request_id = cr.id
+                SET cr.fulfillment_status = 'Completed', cr.registrar_status = 'Complete', cr.updated_at = NOW()
+                WHERE dr.id = %s
+            """, (request_id,))
+      if is_document_request:
         cur.execute("SELECT student_id FROM document_requests WHERE id = %s", (request_id,))
+      elif clearance_id:
+        cur.execute("SELECT student_id FROM clearance_requests WHERE id = %s", (clearance_id,))
       result = cur.fetchone()
       if result and result.get('student_id'):
         create_notification(
@@ -8949,6 +8656,7 @@ def create_app() -> Flask:
           'Your document has been processed and is ready for review.'
         )
 
+      mysql.commit()
       cur.close()
       conn.close()
       return jsonify({
@@ -8957,6 +8665,7 @@ def create_app() -> Flask:
           "files": saved_files
       })
     except Exception as err:
+      mysql.rollback()
       return jsonify({"ok": False, "message": f"Error: {err}"}), 500
 
   @app.route('/api/registrar/release-document', methods=['POST'])
@@ -8972,13 +8681,15 @@ def create_app() -> Flask:
       cur, conn = mysql.cursor()
       
       # Update clearance_requests fulfillment_status to Released
-      cur.execute("""
-          UPDATE clearance_requests 
-          SET fulfillment_status = 'Released', registrar_status = 'Complete', updated_at = NOW() 
-          WHERE id = %s AND fulfillment_status = 'Completed'
-      """, (request_id,))
+      with analytics_rollup.tracked(cur, 'clearance', request_id):
+        cur.execute("""
+            UPDATE clearance_requests 
+            SET fulfillment_status = 'Released', registrar_status = 'Complete', updated_at = NOW() 
+            WHERE id = %s AND fulfillment_status = 'Completed'
+        """, (request_id,))
+        released = cur.rowcount
       
-      if cur.rowcount == 0:
+      if released == 0:
         cur.close()
         conn.close()
         return jsonify({"ok": False, "message": "Request not found or not in Completed status"}), 404
@@ -9050,11 +8761,12 @@ def create_app() -> Flask:
             pass  # Keep original value if parsing fails
         
         # Update the document request
-        cur.execute("""
-          UPDATE document_requests 
-          SET document_type = %s, purpose = %s, updated_at = NOW()
-          WHERE id = %s
-        """, (documents, purposes, request['id']))
+        with analytics_rollup.tracked(cur, 'document', request['id']):
+          cur.execute("""
+            UPDATE document_requests 
+            SET document_type = %s, purpose = %s, updated_at = NOW()
+            WHERE id = %s
+          """, (documents, purposes, request['id']))
         
         updated_count += 1
       
@@ -9144,6 +8856,7 @@ def create_app() -> Flask:
           ALTER TABLE clearance_requests 
           ADD COLUMN payment_receipt LONGTEXT NULL
         """)
+        schema_catalog.refresh(cur)
         
         # No need to commit with autocommit=True
         cur.close()
@@ -9162,15 +8875,6 @@ def create_app() -> Flask:
         "status": "error"
       }), 500
 
-  # Initialize database structures at startup
-  with app.app_context():
-    try:
-      init_db()
-      print("✅ Database initialization completed successfully")
-    except Exception as e:
-      print(f"❌ Database initialization failed: {e}")
-      print("⚠️ Application will continue but database operations may fail")
-
   return app
 
 
@@ -0,0 +1,362 @@
+"""
+Application cache
+Namespaced get/set with version-bump invalidation over a pluggable backend:
+an in-process LRU+TTL store (single worker) or any server speaking the Redis
+protocol (shared by every gunicorn worker). Values are JSON encoded with
+datetime/date/Decimal preserved. Backend errors are treated as cache misses
+so a cache outage never fails a request.
+"""
+
+import json
+import socket
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+MISSING = object()
+
+
+def _default(o: Any) -> Any:
+    if isinstance(o, datetime):
+        return {'__dt__': o.isoformat()}
+    if isinstance(o, date):
+        return {'__date__': o.isoformat()}
+    if isinstance(o, Decimal):
+        return {'__dec__': str(o)}
+    if isinstance(o, (set, frozenset, tuple)):
+        return list(o)
+    if isinstance(o, bytes):
+        return o.decode('utf-8', 'replace')
+    raise TypeError(f"Cannot cache value of type {type(o).__name__}")
+
+
+def _object_hook(d: Dict[str, Any]) -> Any:
+    if len(d) == 1:
+        if '__dt__' in d:
+            return datetime.fromisoformat(d['__dt__'])
+        if '__date__' in d:
+            return date.fromisoformat(d['__date__'])
+        if '__dec__' in d:
+            return Decimal(d['__dec__'])
+    return d
+
+
+def encode(value: Any) -> bytes:
+    return json.dumps(value, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+def decode(raw: bytes) -> Any:
+    return json.loads(raw, object_hook=_object_hook)
+
+
+class LocalBackend:
+    """
+    In-process LRU with per-key TTL
+
+    Only correct with a single worker process: invalidations are not seen by
+    other processes.
+    """
+
+    shared = False
+
+    def __init__(self, max_entries: int = 2000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data: 'OrderedDict[str, Tuple[bytes, Optional[float]]]' = OrderedDict()
+        # Counters (namespace versions) live outside the LRU: evicting one would
+        # reset a version and resurrect entries it had invalidated
+        self._counters: Dict[str, int] = {}
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key in self._counters:
+                return str(self._counters[key]).encode()
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'backend': 'local', 'entries': len(self._data), 'max_entries': self.max_entries}
+
+
+class RedisBackend:
+    """
+    Minimal RESP2 client (GET/SET PX/DEL/INCR) for Redis or a compatible server
+
+    One socket per thread; a socket that errors is dropped and reopened on the
+    next call. Repeated failures open a circuit breaker so a dead cache server
+    costs nothing per request.
+
+    Args:
+        url: redis://[:password@]host[:port][/db]
+        timeout: Socket connect/read timeout in seconds
+    """
+
+    shared = True
+
+    def __init__(self, url: str, timeout: float = 0.5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.username = unquote(parsed.username) if parsed.username else None
+        path = (parsed.path or '').lstrip('/')
+        self.db = int(path) if path.isdigit() else 0
+        self.timeout = timeout
+        self.breaker = CircuitBreaker('cache', failure_threshold=3, reset_timeout=10.0)
+        self._local = threading.local()
+
+    def _socket(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        conn = (sock, sock.makefile('rb'))
+        self._local.conn = conn
+        if self.password:
+            auth = ('AUTH', self.username, self.password) if self.username else ('AUTH', self.password)
+            self._roundtrip(conn, auth)
+        if self.db:
+            self._roundtrip(conn, ('SELECT', str(self.db)))
+        return conn
+
+    def _drop(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn[1].close()
+                conn[0].close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _pack(args) -> bytes:
+        out = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(out)
+
+    def _read(self, reader) -> Any:
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Cache server closed the connection")
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+':
+            return body
+        if kind == b'-':
+            raise RuntimeError(body.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(body)
+        if kind == b'$':
+            size = int(body)
+            if size < 0:
+                return None
+            data = reader.read(size + 2)
+            return data[:-2]
+        if kind == b'*':
+            count = int(body)
+            return None if count < 0 else [self._read(reader) for _ in range(count)]
+        raise ConnectionError(f"Unexpected cache reply: {line[:20]!r}")
+
+    def _roundtrip(self, conn, args) -> Any:
+        sock, reader = conn
+        sock.sendall(self._pack(args))
+        return self._read(reader)
+
+    def _command(self, *args) -> Any:
+        self.breaker.before_call()
+        try:
+            result = self._roundtrip(self._socket(), args)
+        except RuntimeError:
+            # Server-side error reply: the connection itself is fine
+            self.breaker.record_success()
+            raise
+        except Exception as e:
+            self._drop()
+            self.breaker.record_failure(e)
+            raise
+        self.breaker.record_success()
+        return result
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._command('GET', key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        if ttl:
+            self._command('SET', key, value, 'PX', int(ttl * 1000))
+        else:
+            self._command('SET', key, value)
+
+    def delete(self, key: str) -> None:
+        self._command('DEL', key)
+
+    def incr(self, key: str) -> int:
+        return int(self._command('INCR', key))
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': 'redis', 'host': self.host, 'port': self.port, 'db': self.db,
+                'circuit': self.breaker.stats()}
+
+
+class Namespace:
+    """
+    Group of cache keys invalidated together
+
+    Keys embed the namespace's current version; invalidate() bumps the version
+    in the backend so every worker stops seeing the old entries at once (they
+    age out through TTL/LRU).
+    """
+
+    def __init__(self, cache: 'Cache', name: str, ttl: Optional[float] = None):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        self._version_key = f"{cache.prefix}:ns:{name}:version"
+
+    def version(self) -> int:
+        raw = self.cache._safe(self.cache.backend.get, self._version_key)
+        try:
+            return int(raw) if raw is not None else 0
+        except (TypeError, ValueError):
+            return 0
+
+    def _key(self, key: Any, version: Optional[int] = None) -> str:
+        if version is None:
+            version = self.version()
+        return f"{self.cache.prefix}:{self.name}:{version}:{key}"
+
+    def get(self, key: Any, default: Any = None, version: Optional[int] = None) -> Any:
+        """Pass the version() read before loading data to set() so a concurrent
+        invalidate() can never be overwritten by a value computed before it"""
+        raw = self.cache._safe(self.cache.backend.get, self._key(key, version))
+        if raw is None:
+            self.cache._count('misses')
+            return default
+        try:
+            value = decode(raw)
+        except Exception:
+            self.cache._count('misses')
+            return default
+        self.cache._count('hits')
+        return value
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None, version: Optional[int] = None) -> None:
+        try:
+            raw = encode(value)
+        except TypeError as e:
+            print(f"⚠️ Not caching {self.name}:{key}: {e}")
+            return
+        ttl = ttl if ttl is not None else (self.ttl if self.ttl is not None else self.cache.default_ttl)
+        self.cache._safe(self.cache.backend.set, self._key(key, version), raw, ttl)
+
+    def delete(self, key: Any) -> None:
+        self.cache._safe(self.cache.backend.delete, self._key(key))
+
+    def get_or_set(self, key: Any, loader: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        version = self.version()
+        value = self.get(key, MISSING, version=version)
+        if value is MISSING:
+            value = loader()
+            self.set(key, value, ttl, version=version)
+        return value
+
+    def invalidate(self) -> None:
+        """Drop every key in the namespace (for all workers sharing the backend)"""
+        self.cache._count('invalidations')
+        self.cache._safe(self.cache.backend.incr, self._version_key)
+
+
+class Cache:
+    """
+    Args:
+        backend: LocalBackend or RedisBackend
+        prefix: Prepended to every key so several apps can share one server
+        default_ttl: Seconds, used when neither the call nor the namespace sets one
+    """
+
+    def __init__(self, backend: Any, prefix: str = 'irequest', default_ttl: float = 60.0):
+        self.backend = backend
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        self._namespaces: Dict[str, Namespace] = {}
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'errors': 0, 'invalidations': 0}
+
+    @classmethod
+    def from_url(cls, url: Optional[str], prefix: str = 'irequest', default_ttl: float = 60.0,
+                 max_entries: int = 2000) -> 'Cache':
+        """Empty or 'local' gives the in-process backend; redis://... the shared one"""
+        url = (url or '').strip()
+        if not url or url == 'local':
+            backend: Any = LocalBackend(max_entries=max_entries)
+        elif url.startswith(('redis://', 'rediss://')):
+            if url.startswith('rediss://'):
+                raise ValueError("TLS (rediss://) is not supported by the built-in cache client")
+            backend = RedisBackend(url)
+        else:
+            raise ValueError(f"Unsupported CACHE_URL: {url}")
+        return cls(backend, prefix=prefix, default_ttl=default_ttl)
+
+    def namespace(self, name: str, ttl: Optional[float] = None) -> Namespace:
+        with self._lock:
+            ns = self._namespaces.get(name)
+            if ns is None:
+                ns = self._namespaces[name] = Namespace(self, name, ttl)
+            return ns
+
+    def invalidate(self, *names: str) -> None:
+        for name in names:
+            self.namespace(name).invalidate()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _safe(self, fn: Callable, *args) -> Any:
+        try:
+            return fn(*args)
+        except CircuitOpenError:
+            return None
+        except Exception as e:
+            self._count('errors')
+            print(f"⚠️ Cache {fn.__name__} failed: {e}")
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            namespaces = sorted(self._namespaces)
+        return {**self.backend.stats(), 'shared': self.backend.shared, 'namespaces': namespaces, **counters}
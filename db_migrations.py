@@ -0,0 +1,737 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations for the iRequest database
+Each step runs once and is recorded in schema_migrations, so normal worker
+startup only needs a single version check.
+Run manually: python db_migrations.py [status]
+"""
+
+import os
+import sys
+from typing import Any, Callable, List, Set, Tuple
+
+# Load environment variables from .env file
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+LOCK_NAME = 'irequest_schema_migrations'
+
+
+# ---------------------------------------------------------------------------
+# Idempotent DDL helpers
+# ---------------------------------------------------------------------------
+
+def _column_exists(cur, table_name: str, column_name: str) -> bool:
+    cur.execute(
+        """
+        SELECT COUNT(*) AS count
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        """,
+        (table_name, column_name)
+    )
+    return (cur.fetchone() or {}).get('count', 0) > 0
+
+
+def _index_exists(cur, table_name: str, index_name: str) -> bool:
+    cur.execute(
+        """
+        SELECT COUNT(*) AS count
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        """,
+        (table_name, index_name)
+    )
+    return (cur.fetchone() or {}).get('count', 0) > 0
+
+
+def _has_unique_index_on(cur, table_name: str, column_name: str) -> bool:
+    cur.execute(
+        """
+        SELECT COUNT(*) AS count
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+          AND NON_UNIQUE = 0 AND SEQ_IN_INDEX = 1
+        """,
+        (table_name, column_name)
+    )
+    return (cur.fetchone() or {}).get('count', 0) > 0
+
+
+def _try_execute(cur, sql: str) -> bool:
+    """Best-effort statement (e.g. MODIFY on legacy deployments); logs instead of failing"""
+    try:
+        cur.execute(sql)
+        return True
+    except Exception as e:
+        print(f"⚠️ Migration statement skipped: {e}")
+        return False
+
+
+def _add_column(cur, table_name: str, column_name: str, column_definition: str) -> None:
+    if not _column_exists(cur, table_name, column_name):
+        cur.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_definition}")
+        print(f"✅ Added {column_name} column to {table_name} table")
+
+
+def _add_index(cur, table_name: str, index_name: str, ddl: str) -> None:
+    if not _index_exists(cur, table_name, index_name):
+        _try_execute(cur, ddl)
+
+
+# ---------------------------------------------------------------------------
+# Migration steps (append only; never renumber or edit an applied step)
+# ---------------------------------------------------------------------------
+
+def _m001_core_tables(cur) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS students (
+          id INT AUTO_INCREMENT PRIMARY KEY,
+          student_no VARCHAR(16) NOT NULL UNIQUE,
+          first_name VARCHAR(100) NOT NULL,
+          middle_name VARCHAR(100) NULL,
+          last_name VARCHAR(100) NOT NULL,
+          suffix VARCHAR(20) NULL,
+          course_code VARCHAR(10) NOT NULL,
+          course_name VARCHAR(150) NOT NULL,
+          year_level INT NOT NULL,
+          year_level_name VARCHAR(50) NOT NULL,
+          email VARCHAR(255) NOT NULL UNIQUE,
+          password_hash VARCHAR(255) NOT NULL,
+          mobile VARCHAR(20) NOT NULL,
+          gender ENUM('Male','Female') NOT NULL,
+          address TEXT NOT NULL,
+          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS staff (
+          id INT AUTO_INCREMENT PRIMARY KEY,
+          department VARCHAR(100) NOT NULL,
+          first_name VARCHAR(100) NOT NULL,
+          middle_name VARCHAR(100) NULL,
+          last_name VARCHAR(100) NOT NULL,
+          suffix VARCHAR(20) NULL,
+          email VARCHAR(255) NOT NULL UNIQUE,
+          password_hash VARCHAR(255) NOT NULL,
+          contact_no VARCHAR(20) NOT NULL,
+          gender ENUM('Male','Female') NOT NULL,
+          address TEXT NOT NULL,
+          status ENUM('Pending','Approved','Rejected') NOT NULL DEFAULT 'Pending',
+          approved_by VARCHAR(255) NULL,
+          rejection_reason TEXT NULL,
+          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS student_registry (
+          id INT AUTO_INCREMENT PRIMARY KEY,
+          student_no VARCHAR(16) NOT NULL UNIQUE,
+          first_name VARCHAR(100) NOT NULL,
+          last_name VARCHAR(100) NOT NULL,
+          middle_name VARCHAR(50) NULL,
+          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS clearance_requests (
+          id INT AUTO_INCREMENT PRIMARY KEY,
+          student_id INT NOT NULL,
+          status ENUM('Pending','Approved','Rejected') NOT NULL DEFAULT 'Pending',
+          document_type VARCHAR(100) NULL,
+          documents TEXT NULL,
+          purposes TEXT NULL,
+          reason TEXT NULL,
+          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+          CONSTRAINT fk_clearance_student FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS clearance_signatories (
+          id INT AUTO_INCREMENT PRIMARY KEY,
+          request_id INT NOT NULL,
+          office VARCHAR(100) NOT NULL,
+          status ENUM('Pending','Approved','Rejected') NOT NULL DEFAULT 'Pending',
+          signed_by VARCHAR(255) NULL,
+          signed_at TIMESTAMP NULL,
+          rejection_reason TEXT NULL,
+          remarks TEXT NULL,
+          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+          CONSTRAINT fk_signatory_request FOREIGN KEY (request_id) REFERENCES clearance_requests(id) ON DELETE CASCADE,
+          INDEX idx_req_office (request_id, office)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS document_requests (
+          id INT AUTO_INCREMENT PRIMARY KEY,
+          student_id INT NOT NULL,
+          document_type VARCHAR(255) NOT NULL,
+          purpose TEXT NULL,
+          status ENUM('Pending','Processing','Completed','Released','Unclaimed','Rejected') NOT NULL DEFAULT 'Pending',
+          rejection_reason TEXT NULL,
+          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+          completed_at TIMESTAMP NULL,
+          auto_transferred_at TIMESTAMP NULL,
+          clearance_request_id INT NULL,
+          payment_method VARCHAR(50) NULL,
+          payment_amount DECIMAL(10,2) NULL,
+          payment_details TEXT NULL,
+          payment_verified BOOLEAN DEFAULT FALSE,
+          CONSTRAINT fk_doc_student FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE,
+          INDEX idx_student_status (student_id, status),
+          INDEX idx_status_created (status, created_at),
+          INDEX idx_auto_transferred_at (auto_transferred_at),
+          INDEX idx_clearance_request_id (clearance_request_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    # Logs automatic clearance -> document request transfers
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS auto_transfer_logs (
+          id INT AUTO_INCREMENT PRIMARY KEY,
+          clearance_request_id INT NOT NULL,
+          document_request_id INT NOT NULL,
+          student_id INT NOT NULL,
+          transferred_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          reason VARCHAR(255) DEFAULT 'All office clearances approved',
+          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          INDEX idx_clearance_request (clearance_request_id),
+          INDEX idx_document_request (document_request_id),
+          INDEX idx_student_id (student_id),
+          INDEX idx_transferred_at (transferred_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    # Files uploaded by registrar for released document requests
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS document_files (
+          id INT AUTO_INCREMENT PRIMARY KEY,
+          document_request_id INT NOT NULL,
+          original_name VARCHAR(255) NOT NULL,
+          file_path VARCHAR(500) NOT NULL,
+          mime_type VARCHAR(100) NULL,
+          file_size INT NULL,
+          uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          INDEX idx_doc_file_request (document_request_id),
+          CONSTRAINT fk_doc_files_request FOREIGN KEY (document_request_id) REFERENCES document_requests(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    # Files uploaded by registrar for clearance requests
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS clearance_files (
+          id INT AUTO_INCREMENT PRIMARY KEY,
+          clearance_request_id INT NOT NULL,
+          original_name VARCHAR(255) NOT NULL,
+          file_path VARCHAR(500) NOT NULL,
+          mime_type VARCHAR(100) NULL,
+          file_size INT NULL,
+          uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          INDEX idx_clearance_file_request (clearance_request_id),
+          CONSTRAINT fk_clearance_files_request FOREIGN KEY (clearance_request_id) REFERENCES clearance_requests(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    # User activity log for admin dashboard monitoring
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_activity_log (
+          id INT AUTO_INCREMENT PRIMARY KEY,
+          user_type VARCHAR(20) NOT NULL,
+          user_identifier VARCHAR(255) NOT NULL,
+          user_display_name VARCHAR(255) NOT NULL,
+          action VARCHAR(500) NOT NULL,
+          details TEXT NULL,
+          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          INDEX idx_created_at (created_at),
+          INDEX idx_user_type (user_type)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+
+
+def _m002_student_staff_columns(cur) -> None:
+    # Tables created with an old schema may be missing any of these
+    _add_column(cur, 'students', 'student_no', 'student_no VARCHAR(16) NULL AFTER id')
+    _add_column(cur, 'students', 'middle_name', 'middle_name VARCHAR(100) NULL AFTER first_name')
+    _add_column(cur, 'students', 'suffix', 'suffix VARCHAR(20) NULL AFTER last_name')
+    _add_column(cur, 'students', 'course_code', 'course_code VARCHAR(10) NULL')
+    _add_column(cur, 'students', 'course_name', 'course_name VARCHAR(150) NULL')
+    _add_column(cur, 'students', 'year_level', 'year_level INT NULL')
+    _add_column(cur, 'students', 'year_level_name', 'year_level_name VARCHAR(50) NULL')
+    _add_column(cur, 'students', 'mobile', 'mobile VARCHAR(20) NULL')
+    _add_column(cur, 'students', 'gender', "gender ENUM('Male','Female') NULL")
+    _add_column(cur, 'students', 'address', 'address TEXT NULL')
+    _add_column(cur, 'students', 'status', "status ENUM('Pending','Approved','Rejected') NOT NULL DEFAULT 'Pending'")
+    _add_column(cur, 'students', 'signature', 'signature TEXT NULL')
+    _add_column(cur, 'students', 'rejection_reason', 'rejection_reason TEXT NULL')
+    _add_column(cur, 'students', 'approved_by', 'approved_by VARCHAR(255) NULL')
+    _add_column(cur, 'students', 'has_clearance_request', 'has_clearance_request TINYINT(1) NOT NULL DEFAULT 0')
+    # OTP columns for student email verification (first login) and password reset
+    _add_column(cur, 'students', 'otp_code', 'otp_code VARCHAR(6) NULL')
+    _add_column(cur, 'students', 'otp_expires_at', 'otp_expires_at DATETIME NULL')
+    _add_column(cur, 'students', 'otp_verified', 'otp_verified TINYINT(1) NOT NULL DEFAULT 0')
+    _add_column(cur, 'students', 'reset_code', 'reset_code VARCHAR(6) NULL')
+    _add_column(cur, 'students', 'reset_expires_at', 'reset_expires_at DATETIME NULL')
+    if not _has_unique_index_on(cur, 'students', 'student_no'):
+        _try_execute(cur, "ALTER TABLE students MODIFY COLUMN student_no VARCHAR(16) NOT NULL UNIQUE")
+    # Legacy compatibility: ensure old 'course' column (if exists) is nullable
+    if _column_exists(cur, 'students', 'course'):
+        _try_execute(cur, "ALTER TABLE students MODIFY COLUMN course VARCHAR(255) NULL")
+
+    _add_column(cur, 'staff', 'middle_name', 'middle_name VARCHAR(100) NULL AFTER first_name')
+    _add_column(cur, 'staff', 'suffix', 'suffix VARCHAR(20) NULL AFTER last_name')
+    _add_column(cur, 'staff', 'contact_no', 'contact_no VARCHAR(20) NULL')
+    _add_column(cur, 'staff', 'gender', "gender ENUM('Male','Female') NULL")
+    _add_column(cur, 'staff', 'address', 'address TEXT NULL')
+    _add_column(cur, 'staff', 'status', "status ENUM('Pending','Approved','Rejected') NOT NULL DEFAULT 'Pending'")
+    _add_column(cur, 'staff', 'approved_by', 'approved_by VARCHAR(255) NULL')
+    _add_column(cur, 'staff', 'rejection_reason', 'rejection_reason TEXT NULL')
+    _add_column(cur, 'staff', 'reset_code', 'reset_code VARCHAR(6) NULL')
+    _add_column(cur, 'staff', 'reset_expires_at', 'reset_expires_at DATETIME NULL')
+    # Deactivated status for resigned staff
+    _try_execute(cur, "ALTER TABLE staff MODIFY COLUMN status ENUM('Pending','Approved','Rejected','Deactivated') NOT NULL DEFAULT 'Pending'")
+    _add_column(cur, 'staff', 'deactivated_by', 'deactivated_by VARCHAR(255) NULL')
+    _add_column(cur, 'staff', 'deactivated_at', 'deactivated_at DATETIME NULL')
+
+
+def _m003_clearance_request_columns(cur) -> None:
+    _add_column(cur, 'clearance_requests', 'fulfillment_status',
+                "fulfillment_status ENUM('Pending','Processing','Released','Rejected') NOT NULL DEFAULT 'Pending'")
+    # fulfillment_status must include 'Completed' and 'Approved' (used by registrar flow)
+    _try_execute(cur, "ALTER TABLE clearance_requests MODIFY COLUMN fulfillment_status ENUM('Pending','Processing','Approved','Completed','Released','Rejected') NOT NULL DEFAULT 'Pending'")
+    _add_column(cur, 'clearance_requests', 'registrar_status',
+                "registrar_status ENUM('Pending','Processing','Complete') NOT NULL DEFAULT 'Pending'")
+    _add_column(cur, 'clearance_requests', 'document_type', 'document_type VARCHAR(100) NULL')
+    _add_column(cur, 'clearance_requests', 'documents', 'documents TEXT NULL')
+    _add_column(cur, 'clearance_requests', 'purposes', 'purposes TEXT NULL')
+    _add_column(cur, 'clearance_requests', 'reason', 'reason TEXT NULL')
+    _add_column(cur, 'clearance_requests', 'payment_method', 'payment_method VARCHAR(20) NULL')
+    _add_column(cur, 'clearance_requests', 'payment_amount', 'payment_amount DECIMAL(10,2) NULL')
+    _add_column(cur, 'clearance_requests', 'payment_verified', 'payment_verified BOOLEAN DEFAULT FALSE')
+    _add_column(cur, 'clearance_requests', 'payment_receipt', 'payment_receipt LONGTEXT NULL')
+    _add_column(cur, 'clearance_requests', 'payment_details', 'payment_details TEXT NULL')
+    # Explicit reference_number column for quick lookup; unique to prevent duplicates
+    _add_column(cur, 'clearance_requests', 'reference_number', 'reference_number VARCHAR(32) NULL')
+    _add_index(cur, 'clearance_requests', 'idx_unique_reference_number',
+               "ALTER TABLE clearance_requests ADD UNIQUE INDEX idx_unique_reference_number (reference_number)")
+    # S3 columns for receipt storage
+    _add_column(cur, 'clearance_requests', 'payment_receipt_s3_url', 'payment_receipt_s3_url VARCHAR(500) NULL')
+    _add_column(cur, 'clearance_requests', 'payment_receipt_s3_key', 'payment_receipt_s3_key VARCHAR(255) NULL')
+    _add_index(cur, 'clearance_requests', 'idx_duplicate_check',
+               "ALTER TABLE clearance_requests ADD INDEX idx_duplicate_check (student_id, document_type, status, created_at)")
+    # Scheduled pickup: DATETIME stores exact registrar/student local time (TIMESTAMP caused ~8h skew vs UI)
+    _add_column(cur, 'clearance_requests', 'pickup_date', 'pickup_date DATETIME NULL')
+    _try_execute(cur, "ALTER TABLE clearance_requests MODIFY COLUMN pickup_date DATETIME NULL")
+
+
+def _m004_clearance_signatory_columns(cur) -> None:
+    _add_column(cur, 'clearance_signatories', 'signed_by', 'signed_by VARCHAR(255) NULL')
+    _add_column(cur, 'clearance_signatories', 'signed_at', 'signed_at TIMESTAMP NULL')
+    _add_column(cur, 'clearance_signatories', 'remarks', 'remarks TEXT NULL')
+
+
+def _m005_document_request_columns(cur) -> None:
+    _add_column(cur, 'document_requests', 'auto_transferred_at', 'auto_transferred_at TIMESTAMP NULL')
+    _add_column(cur, 'document_requests', 'clearance_request_id', 'clearance_request_id INT NULL')
+    _add_column(cur, 'document_requests', 'payment_method', 'payment_method VARCHAR(50) NULL')
+    _add_column(cur, 'document_requests', 'payment_amount', 'payment_amount DECIMAL(10,2) NULL')
+    _add_column(cur, 'document_requests', 'payment_details', 'payment_details TEXT NULL')
+    _add_column(cur, 'document_requests', 'payment_verified', 'payment_verified BOOLEAN DEFAULT FALSE')
+    _add_column(cur, 'document_requests', 'completed_at', 'completed_at TIMESTAMP NULL')
+    _add_column(cur, 'document_requests', 'pickup_date', 'pickup_date DATETIME NULL')
+    _try_execute(cur, "ALTER TABLE document_requests MODIFY COLUMN pickup_date DATETIME NULL")
+    _add_column(cur, 'document_requests', 'reference_number', 'reference_number VARCHAR(32) NULL')
+    # Same reference number may cover several document types per student; unique per (ref, student, document_type)
+    if _index_exists(cur, 'document_requests', 'idx_unique_reference_number'):
+        _try_execute(cur, "ALTER TABLE document_requests DROP INDEX idx_unique_reference_number")
+    _add_index(cur, 'document_requests', 'idx_unique_ref_student_doctype',
+               "ALTER TABLE document_requests ADD UNIQUE INDEX idx_unique_ref_student_doctype (reference_number, student_id, document_type(100))")
+    # Receipt columns (mirrors clearance_requests)
+    _add_column(cur, 'document_requests', 'payment_receipt', 'payment_receipt LONGTEXT NULL')
+    _add_column(cur, 'document_requests', 'payment_receipt_s3_url', 'payment_receipt_s3_url VARCHAR(500) NULL')
+    _add_column(cur, 'document_requests', 'payment_receipt_s3_key', 'payment_receipt_s3_key VARCHAR(255) NULL')
+    # Older deployments lack Released/Unclaimed in the status ENUM
+    _try_execute(cur, "ALTER TABLE document_requests MODIFY status ENUM('Pending','Processing','Completed','Released','Unclaimed','Rejected') NOT NULL DEFAULT 'Pending'")
+    _add_index(cur, 'document_requests', 'idx_auto_transferred_at',
+               "CREATE INDEX idx_auto_transferred_at ON document_requests (auto_transferred_at)")
+    _add_index(cur, 'document_requests', 'idx_clearance_request_id',
+               "CREATE INDEX idx_clearance_request_id ON document_requests (clearance_request_id)")
+
+
+# Enrolled students allowed to sign up (student_no, first_name, last_name, middle_name)
+REGISTRY_STUDENTS = [
+    ('2022-0527', 'Jerico', 'Abrazado', 'S.D.'), ('2022-0465', 'Edjennelle', 'Adriano', 'I.'),
+    ('2022-0362', 'Mark Angel', 'Agravante', 'S.'), ('2022-0181', 'Charles Edison', 'Andres', 'P.'),
+    ('2022-0403', 'Arnel', 'Angeles', 'R.'), ('2022-0152', 'Kevin Dean', 'Arceo', 'S.'),
+    ('2022-0273', 'Jay', 'Aycardo', 'A.'), ('2022-0187', 'Ginessa Mae', 'Borja', 'M.'),
+    ('2022-0165', 'Janalyn', 'Carpio', 'C.'), ('2022-0148', 'Beejay', 'Castillo', None),
+    ('2022-0478', 'Nick Joven', 'Cruz', 'M.'), ('2022-0183', 'Diether', 'De Leon', 'C.'),
+    ('2022-0174', 'Andrew', 'Dela Cruz', 'J.'), ('2022-0540', 'Ram Quelvic', 'Dela Peña', 'N.'),
+    ('2022-0209', 'John Ray', 'Donor', 'D.'), ('2022-0177', 'Johnzel', 'Esteban', None),
+    ('2019-0353', 'Jenny Rose', 'Estella', None), ('2022-0155', 'J.P F', 'Fabian', None),
+    ('2022-0175', 'Jonald', 'Legaspi', 'F.'), ('2022-0145', 'Reylee', 'Guanzon', 'C.'),
+    ('2022-0489', 'Jericho', 'Llanaza', 'A.'), ('2022-0241', 'Ken John Emil', 'Navos', 'L.'),
+    ('2022-0369', 'Mary Joy', 'Oniot', 'R.'), ('2021-0446', 'Jerryson', 'Palmaria', 'C.'),
+    ('2022-0199', 'Jiovanni', 'Pareja', 'M.'), ('2022-0160', 'Clarence', 'Pedoc', None),
+    ('2022-0375', 'Jhon Lenon', 'Perez', 'B.'), ('2022-0389', 'John Lloyd', 'Perez', 'P.'),
+    ('2022-0173', 'Froilan', 'Principe', 'O.'), ('2022-0424', 'John Carlo', 'Ragas', 'O.'),
+    ('2022-0521', 'Jhonalyn Ann', 'Ramos', 'D.'), ('2022-0399', 'Nathaniel Ashley', 'Rodelas', 'P.'),
+    ('2022-0189', 'Maui', 'Roxas', 'V.'), ('2022-0200', 'Marvin', 'Salvador', 'O.'),
+    ('2022-0180', 'Princess Micaella', 'Samson', 'B.'), ('2020-0134', 'Christian', 'San Pedro', 'D.'),
+    ('2022-0522', 'John Marvin', 'San Pedro', 'V.'), ('2022-0193', 'Joash Ephrain', 'Santos', 'B.'),
+    ('2022-0455', 'Edwin', 'Solayao', 'O.'), ('2022-0171', 'John Lorence', 'Tagoctoc', 'V.'),
+    ('2022-0159', 'Nhelvin', 'Talam', 'P.'), ('2021-0241', 'Jomar', 'Templanza', 'R.'),
+    ('2022-0163', 'Earl Joshua', 'Uy', 'L.'), ('2022-0185', 'Jan Kamille', 'Yap', None),
+    ('2022-0178', 'Daryl James', 'Almonte', 'T.'), ('2022-0154', 'Glenn Julius', 'Almonte', None),
+    ('2022-0150', 'Tristan', 'Alvaran', 'B.'), ('2022-0164', 'John Mathew', 'Arcega', 'C.'),
+    ('2022-0386', 'Rex Allen', 'Balonio', 'J.'), ('2022-0196', 'Marc Andrew', 'Barroga', None),
+    ('2022-0161', 'Mary Jane', 'Barrun', 'B.'), ('2021-0443', 'Marcel', 'Bartolome', 'D.'),
+    ('2021-0442', 'Renato Jr', 'Bautista', 'SD'), ('2022-0167', 'Rachel', 'Cadacio', 'Q.'),
+    ('2022-0186', 'Rotcher A. Jr', 'Cadorna', None), ('2022-0286', 'Trisha Mae', 'Castillo', None),
+    ('2022-0151', 'Christian', 'Constantino', 'S.'), ('2022-0168', 'Arlyn', 'Cruz', 'M.'),
+    ('2022-0169', 'John Roed', 'De Guzman', 'E.'), ('2022-0520', 'Joseph', 'Dela Victoria', 'C.'),
+    ('2022-0198', 'Abigail', 'Diao', 'C.'), ('2021-0380', 'Joseph', 'Espiritu', 'E.'),
+    ('2022-0149', 'Marl Allen', 'Fausto', 'D.'), ('2022-0158', 'Cruz Nico', 'Gole', 'C.'),
+    ('2022-0218', 'Orly', 'Gonzales', 'B.'), ('2022-0472', 'Marian', 'Ipo', 'P.'),
+    ('2022-0215', 'Aaron Joseph', 'Jimenez', 'A.'), ('2022-0219', 'Cyrus', 'Labitoria', 'O.'),
+    ('2022-0220', 'Nizaniel Kate', 'Lamadora', 'A.'), ('2022-0206', 'Daniel', 'Mangahas', 'P.'),
+    ('2022-0007', 'Troy Jan', 'Marcial', 'T.'), ('2022-0179', 'Angela Danielle', 'Montefalco', None),
+    ('2022-0157', 'Jomel', 'Mosquera', None), ('2022-0221', 'Jomar', 'Pajares', 'A.'),
+    ('2022-0201', 'Mary Joyce', 'Pineda', 'C.'), ('2022-0205', 'Jennifer', 'Pleno', None),
+    ('2022-0471', 'Mark Jhun', 'Ramirez', 'A.'), ('2019-0234', 'Reese Daniel', 'San Diego', 'M.'),
+    ('2021-0218', 'Jessica', 'San Pedro', 'P.'), ('2022-0526', 'Mark Joseph', 'San Pedro', None),
+    ('2022-0176', 'Matthew John', 'Santos', 'R.'), ('2022-0516', 'Jeniebeth', 'Sopeña', 'S.'),
+    # Newly added students
+    ('2025-0345', 'John Lloyd', 'San Pedro', 'V.'),
+    ('2023-0251', 'Rochelle', 'Salvador', 'Soriben'),
+    ('2023-0309', 'Mark Ronald', 'Cruz', 'P.'),
+    ('2022-0226', 'Kaye Edrryl', 'San Pedro', 'S.'),
+    ('2022-0242', 'Danica', 'Sanico', 'S.'),
+    ('2023-0388', 'Shien Youmi', 'Arcega', 'G.'),
+]
+
+
+def _m006_seed_student_registry(cur) -> None:
+    cur.executemany(
+        "INSERT IGNORE INTO student_registry (student_no, first_name, last_name, middle_name) VALUES (%s, %s, %s, %s)",
+        REGISTRY_STUDENTS
+    )
+
+
+def _m007_analytics_monthly_counts(cur) -> None:
+    import analytics_rollup
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS analytics_monthly_counts (
+          month DATE NOT NULL,
+          source VARCHAR(20) NOT NULL,
+          document VARCHAR(255) NOT NULL DEFAULT '',
+          status VARCHAR(20) NOT NULL DEFAULT '',
+          course_name VARCHAR(150) NOT NULL DEFAULT '',
+          course_code VARCHAR(50) NOT NULL DEFAULT '',
+          count INT NOT NULL DEFAULT 0,
+          updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+          PRIMARY KEY (month, source, document, status, course_name, course_code)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    # Partial edge months of an analytics range are counted from the raw rows
+    _add_index(cur, 'document_requests', 'idx_created_at',
+               "ALTER TABLE document_requests ADD INDEX idx_created_at (created_at)")
+    _add_index(cur, 'clearance_requests', 'idx_created_at',
+               "ALTER TABLE clearance_requests ADD INDEX idx_created_at (created_at)")
+    rows = analytics_rollup.rebuild(cur)
+    print(f"✅ Backfilled analytics_monthly_counts ({rows} rows)")
+
+
+def _m008_activity_log_hourly_rollups(cur) -> None:
+    import activity_rollup
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS activity_log_hourly_roles (
+          bucket DATETIME NOT NULL,
+          user_type VARCHAR(20) NOT NULL,
+          count INT NOT NULL DEFAULT 0,
+          PRIMARY KEY (bucket, user_type)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS activity_log_hourly_actions (
+          bucket DATETIME NOT NULL,
+          action_hash CHAR(32) NOT NULL,
+          action VARCHAR(500) NOT NULL,
+          count INT NOT NULL DEFAULT 0,
+          PRIMARY KEY (bucket, action_hash)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS activity_log_hourly_users (
+          bucket DATETIME NOT NULL,
+          user_hash CHAR(32) NOT NULL,
+          user_identifier VARCHAR(255) NOT NULL,
+          user_display_name VARCHAR(255) NOT NULL,
+          count INT NOT NULL DEFAULT 0,
+          PRIMARY KEY (bucket, user_hash)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    # rolled_until NULL until the backfill below folds everything from the oldest log entry
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS activity_log_rollup_state (
+          id TINYINT PRIMARY KEY,
+          rolled_until DATETIME NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    cur.execute("INSERT IGNORE INTO activity_log_rollup_state (id, rolled_until) VALUES (1, NULL)")
+    # Backfill here, not in the first user request that happens to call catch_up
+    conn = cur.connection
+    conn.begin()
+    try:
+        hours = activity_rollup.catch_up(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    print(f"✅ Backfilled activity log hourly rollups ({hours} hours)")
+
+
+def _m009_student_registry_updated_at(cur) -> None:
+    # Lets the in-memory registry index notice edits, not just inserts/deletes
+    _add_column(cur, 'student_registry', 'updated_at',
+                "updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP")
+    _add_index(cur, 'student_registry', 'idx_updated_at',
+               "ALTER TABLE student_registry ADD INDEX idx_updated_at (updated_at)")
+
+
+def _m010_payment_references(cur) -> None:
+    import payment_references
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payment_references (
+          reference_key VARCHAR(32) NOT NULL PRIMARY KEY,
+          reference_number VARCHAR(64) NOT NULL,
+          source ENUM('clearance','document') NOT NULL,
+          request_id INT NOT NULL,
+          student_id INT NULL,
+          document_type VARCHAR(255) NULL,
+          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          INDEX idx_student_id (student_id),
+          INDEX idx_source_request (source, request_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    result = payment_references.backfill(cur)
+    print(f"✅ Backfilled payment_references ({result['registered']} of {result['scanned']} references)")
+    for d in result['duplicates']:
+        print(f"⚠️ {d['source']} request {d['request_id']} reuses '{d['reference_number']}' "
+              f"(owned by {d['owner_source']} request {d['owner_request_id']})")
+
+
+def _m011_receipt_jobs(cur) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS receipt_jobs (
+          id BIGINT AUTO_INCREMENT PRIMARY KEY,
+          purpose ENUM('extract','validate') NOT NULL,
+          priority TINYINT NOT NULL DEFAULT 0,
+          status ENUM('queued','running','done','failed') NOT NULL DEFAULT 'queued',
+          image_hash CHAR(64) NOT NULL,
+          image MEDIUMBLOB NULL,
+          reference_number VARCHAR(64) NOT NULL DEFAULT '',
+          owner VARCHAR(255) NOT NULL DEFAULT '',
+          result MEDIUMTEXT NULL,
+          reusable TINYINT(1) NOT NULL DEFAULT 0,
+          error VARCHAR(500) NULL,
+          attempts TINYINT NOT NULL DEFAULT 0,
+          claim_token CHAR(32) NULL,
+          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          started_at TIMESTAMP NULL,
+          finished_at TIMESTAMP NULL,
+          INDEX idx_queue (status, priority, id),
+          INDEX idx_dedupe (image_hash, purpose),
+          INDEX idx_claim_token (claim_token),
+          INDEX idx_finished_at (finished_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+
+
+def _m012_rate_limit_buckets(cur) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+          name VARCHAR(100) PRIMARY KEY,
+          tokens DOUBLE NOT NULL,
+          updated_at DOUBLE NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Any], None]]] = [
+    (1, 'core tables', _m001_core_tables),
+    (2, 'students/staff legacy columns', _m002_student_staff_columns),
+    (3, 'clearance_requests columns and indexes', _m003_clearance_request_columns),
+    (4, 'clearance_signatories columns', _m004_clearance_signatory_columns),
+    (5, 'document_requests columns and indexes', _m005_document_request_columns),
+    (6, 'seed student_registry', _m006_seed_student_registry),
+    (7, 'analytics_monthly_counts rollup', _m007_analytics_monthly_counts),
+    (8, 'activity log hourly rollups', _m008_activity_log_hourly_rollups),
+    (9, 'student_registry updated_at', _m009_student_registry_updated_at),
+    (10, 'payment_references registry', _m010_payment_references),
+    (11, 'receipt_jobs queue', _m011_receipt_jobs),
+    (12, 'rate_limit_buckets for shared API limits', _m012_rate_limit_buckets),
+]
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def latest_version() -> int:
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def schema_version(cur) -> int:
+    """Highest applied migration version (0 if schema_migrations does not exist yet)"""
+    try:
+        cur.execute("SELECT COALESCE(MAX(version), 0) AS v FROM schema_migrations")
+    except Exception as e:
+        # 1146: table doesn't exist
+        if getattr(e, 'args', None) and e.args[0] == 1146:
+            return 0
+        raise
+    return int((cur.fetchone() or {}).get('v') or 0)
+
+
+def _applied_versions(cur) -> Set[int]:
+    cur.execute("SELECT version FROM schema_migrations")
+    return {int(r['version']) for r in cur.fetchall() or []}
+
+
+def migrate(conn, lock_timeout: int = 60) -> List[int]:
+    """
+    Apply pending migrations in order
+
+    Holds a MySQL named lock so concurrent workers (or the CLI) never run
+    the same step twice. Returns the versions applied by this call.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT GET_LOCK(%s, %s) AS got", (LOCK_NAME, lock_timeout))
+        if not (cur.fetchone() or {}).get('got'):
+            raise RuntimeError(f"Timed out waiting for migration lock '{LOCK_NAME}'")
+        try:
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                  version INT PRIMARY KEY,
+                  description VARCHAR(255) NOT NULL,
+                  applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+                """
+            )
+            done = _applied_versions(cur)
+            applied = []
+            for version, description, step in MIGRATIONS:
+                if version in done:
+                    continue
+                print(f"🔧 Applying migration {version:03d}: {description}")
+                step(cur)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                applied.append(version)
+            return applied
+        finally:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cur.fetchall()
+    finally:
+        cur.close()
+
+
+def get_db_config():
+    """Get database configuration from environment"""
+    import pymysql
+
+    use_local = os.getenv('USE_LOCAL_DB', '').lower() == 'true'
+    return {
+        'host': 'localhost' if use_local else os.getenv('MYSQL_HOST'),
+        'user': os.getenv('MYSQL_USER', 'root' if use_local else 'admin'),
+        'password': os.getenv('MYSQL_PASSWORD', ''),
+        'database': os.getenv('MYSQL_DB', 'irequest'),
+        'charset': 'utf8mb4',
+        'cursorclass': pymysql.cursors.DictCursor,
+        'autocommit': True,
+        # Same session time zone as the app, so rollup buckets line up with TIMESTAMP values it reads
+        'init_command': "SET time_zone='+08:00'",
+    }
+
+
+def main(argv: List[str]) -> int:
+    import pymysql
+
+    config = get_db_config()
+    print(f"   Host: {config['host']}")
+    print(f"   Database: {config['database']}")
+
+    if argv[:1] != ['status']:
+        # Server-level connection so a brand-new deployment gets its database
+        server_config = {k: v for k, v in config.items() if k not in ('database', 'cursorclass')}
+        server_cnx = pymysql.connect(**server_config)
+        with server_cnx.cursor() as server_cur:
+            server_cur.execute(
+                f"CREATE DATABASE IF NOT EXISTS `{config['database']}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci"
+            )
+        server_cnx.close()
+
+    connection = pymysql.connect(**config)
+    try:
+        if argv[:1] == ['status']:
+            with connection.cursor() as cur:
+                current = schema_version(cur)
+            print(f"📋 Schema version {current} (latest {latest_version()})")
+            return 0 if current >= latest_version() else 1
+        applied = migrate(connection)
+        if applied:
+            print(f"✅ Applied migrations: {', '.join(str(v) for v in applied)}")
+        else:
+            print("✅ Schema already up to date")
+        return 0
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
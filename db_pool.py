@@ -0,0 +1,421 @@
+"""
+Bounded MySQL connection pool
+Keeps warm PyMySQL connections for DirectMySQL instead of connecting per cursor() call
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+# Server status bit set by MySQL while a transaction is open
+SERVER_STATUS_IN_TRANS = 1
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the pool timeout"""
+    pass
+
+
+class _PoolEntry:
+    """Raw connection plus the bookkeeping the pool needs to validate it"""
+
+    __slots__ = ('raw', 'created_at', 'last_used')
+
+    def __init__(self, raw: Any):
+        now = time.monotonic()
+        self.raw = raw
+        self.created_at = now
+        self.last_used = now
+
+
+class PooledConnection:
+    """
+    Connection handed out by the pool
+
+    Behaves like the underlying PyMySQL connection, except close() gives it
+    back to the pool. Closing twice is harmless, and a connection that is
+    garbage collected without close() is returned as well.
+    """
+
+    def __init__(self, pool: 'ConnectionPool', entry: _PoolEntry, verified: bool = False):
+        self._pool = pool
+        self._entry: Optional[_PoolEntry] = entry
+        # True when this checkout reached the server (new connection or pre-ping)
+        self.verified = verified
+
+    @property
+    def pool(self) -> 'ConnectionPool':
+        return self._pool
+
+    @property
+    def raw(self) -> Any:
+        if self._entry is None:
+            raise RuntimeError("Connection already returned to the pool")
+        return self._entry.raw
+
+    def cursor(self, *args, **kwargs):
+        return self.raw.cursor(*args, **kwargs)
+
+    def close(self) -> None:
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool._release(entry)
+
+    def invalidate(self) -> None:
+        """Close the underlying socket instead of returning it to the pool"""
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool._release(entry, discard=True)
+
+    @property
+    def closed(self) -> bool:
+        return self._entry is None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class SharedConnection:
+    """
+    Handle on a connection owned by an open Transaction
+
+    close() and commit() are no-ops so code written for one connection per
+    statement can run unchanged inside the transaction; the owner commits or
+    rolls back once at the end.
+    """
+
+    def __init__(self, connection: Any):
+        self._connection = connection
+
+    def cursor(self, *args, **kwargs):
+        return self._connection.cursor(*args, **kwargs)
+
+    def close(self) -> None:
+        pass
+
+    def commit(self) -> None:
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._connection, name)
+
+
+class Transaction:
+    """
+    Explicit transaction on one pooled connection (the pool runs autocommit)
+
+    Nested begin()s only bump a depth counter; the outermost commit() issues
+    the COMMIT. A rollback() at any depth rolls back the whole unit. `owned`
+    marks a connection the caller should release once the unit has ended.
+    """
+
+    def __init__(self, connection: Any, owned: bool = False):
+        self.connection = connection
+        self.owned = owned
+        self.depth = 1
+        self.active = True
+        connection.begin()
+
+    def share(self) -> SharedConnection:
+        return SharedConnection(self.connection)
+
+    def commit(self) -> bool:
+        """Returns True once the outermost level has committed"""
+        if not self.active:
+            return True
+        self.depth -= 1
+        if self.depth > 0:
+            return False
+        self.active = False
+        self.connection.commit()
+        return True
+
+    def rollback(self) -> None:
+        if not self.active:
+            return
+        self.active = False
+        self.depth = 0
+        try:
+            self.connection.rollback()
+        except Exception:
+            # A dead socket rolls back server-side anyway; never reuse it
+            invalidate = getattr(self.connection, 'invalidate', None)
+            if invalidate is not None:
+                invalidate()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of database connections
+
+    Args:
+        connect: Zero-argument callable that opens a new raw connection
+        min_size: Connections opened by warm() and kept when idle
+        max_size: Upper bound on open connections (idle + checked out)
+        timeout: Seconds to wait for a free connection before PoolTimeout
+        recycle: Close connections older than this many seconds (0 disables)
+        pre_ping: Ping connections idle longer than this many seconds before
+            handing them out (0 pings every checkout, negative disables)
+    """
+
+    def __init__(self, connect: Callable[[], Any], min_size: int = 1, max_size: int = 10,
+                 timeout: float = 10.0, recycle: float = 1800.0, pre_ping: float = 30.0):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self._connect = connect
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self._reset_state()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _reset_state(self) -> None:
+        self._pid = os.getpid()
+        self._cond = threading.Condition(threading.Lock())
+        self._idle: Deque[_PoolEntry] = deque()
+        self._size = 0
+        self._counters = {
+            'checkouts': 0,
+            'created': 0,
+            'recycled': 0,
+            'discarded': 0,
+            'waits': 0,
+            'timeouts': 0,
+        }
+
+    def _after_fork(self) -> None:
+        # Sockets inherited from the parent must not be used (or QUIT) by a
+        # worker; drop the references and start with an empty pool.
+        self._reset_state()
+
+    def _check_pid(self) -> None:
+        if self._pid != os.getpid():
+            self._after_fork()
+
+    def _open(self) -> _PoolEntry:
+        try:
+            raw = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._counters['created'] += 1
+        return _PoolEntry(raw)
+
+    @staticmethod
+    def _close_raw(raw: Any) -> None:
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _needs_ping(self, entry: _PoolEntry) -> bool:
+        return self.pre_ping >= 0 and time.monotonic() - entry.last_used >= self.pre_ping
+
+    def _is_usable(self, entry: _PoolEntry) -> bool:
+        now = time.monotonic()
+        if self.recycle > 0 and now - entry.created_at > self.recycle:
+            with self._cond:
+                self._counters['recycled'] += 1
+            return False
+        if self._needs_ping(entry):
+            try:
+                entry.raw.ping(reconnect=False)
+            except Exception:
+                with self._cond:
+                    self._counters['discarded'] += 1
+                return False
+        return True
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledConnection:
+        """Check out a connection, opening a new one while below max_size"""
+        self._check_pid()
+        wait = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + wait
+        while True:
+            entry = None
+            with self._cond:
+                waited = False
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        raise PoolTimeout(
+                            f"No database connection available within {wait:.1f}s "
+                            f"(pool max_size={self.max_size})"
+                        )
+                    if not waited:
+                        self._counters['waits'] += 1
+                        waited = True
+                    self._cond.wait(remaining)
+                if self._idle:
+                    entry = self._idle.pop()
+                else:
+                    self._size += 1
+            if entry is None:
+                entry = self._open()
+                verified = True
+            else:
+                verified = self._needs_ping(entry)
+                if not self._is_usable(entry):
+                    self._close_raw(entry.raw)
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    continue
+            with self._cond:
+                self._counters['checkouts'] += 1
+            entry.last_used = time.monotonic()
+            return PooledConnection(self, entry, verified)
+
+    def _release(self, entry: _PoolEntry, discard: bool = False) -> None:
+        if self._pid != os.getpid():
+            return
+        raw = entry.raw
+        if not discard:
+            try:
+                if not getattr(raw, 'open', True):
+                    discard = True
+                elif getattr(raw, 'server_status', 0) & SERVER_STATUS_IN_TRANS:
+                    # Never hand an open transaction to the next borrower
+                    raw.rollback()
+            except Exception:
+                discard = True
+        if discard:
+            self._close_raw(raw)
+            with self._cond:
+                self._size -= 1
+                self._counters['discarded'] += 1
+                self._cond.notify()
+            return
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    def warm(self) -> int:
+        """Open connections up to min_size; returns how many were opened"""
+        self._check_pid()
+        opened = 0
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    break
+                self._size += 1
+            entry = self._open()
+            with self._cond:
+                self._idle.append(entry)
+                self._cond.notify()
+            opened += 1
+        return opened
+
+    def dispose(self) -> None:
+        """Close every idle connection; checked-out ones close when released"""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for entry in idle:
+            self._close_raw(entry.raw)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                'pid': self._pid,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': idle,
+                'in_use': self._size - idle,
+                **self._counters,
+            }
+
+
+class ReplicaLagMonitor:
+    """
+    Cached replication-lag check for a read-replica pool
+
+    Args:
+        pool: Pool of replica connections used for the check
+        max_lag: Replica is considered unhealthy above this many seconds behind
+        interval: Seconds between checks; callers in between reuse the last result
+    """
+
+    def __init__(self, pool: ConnectionPool, max_lag: float = 5.0, interval: float = 5.0):
+        self.pool = pool
+        self.max_lag = max_lag
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._lag: Optional[float] = None
+        self._error: Optional[str] = None
+
+    def _measure(self) -> Optional[float]:
+        conn = self.pool.acquire(timeout=1.0)
+        try:
+            cur = conn.cursor()
+            try:
+                try:
+                    cur.execute("SHOW REPLICA STATUS")
+                except Exception:
+                    # MySQL < 8.0.22
+                    cur.execute("SHOW SLAVE STATUS")
+                row = cur.fetchone()
+            finally:
+                cur.close()
+        finally:
+            conn.close()
+        if not row:
+            # Not a classic replica (e.g. Aurora reader); nothing to measure
+            return 0.0
+        lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+        # NULL means the replication threads are stopped
+        return None if lag is None else float(lag)
+
+    def healthy(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at >= self.interval and self._lock.acquire(blocking=False):
+            try:
+                try:
+                    self._lag = self._measure()
+                    self._error = None
+                except Exception as e:
+                    self._lag = None
+                    self._error = str(e)[:200]
+                self._checked_at = time.monotonic()
+            finally:
+                self._lock.release()
+        return self._lag is not None and self._lag <= self.max_lag
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'lag_seconds': self._lag,
+            'max_lag_seconds': self.max_lag,
+            'healthy': self._lag is not None and self._lag <= self.max_lag,
+            'error': self._error,
+        }
@@ -0,0 +1,299 @@
+"""
+Groq API client
+One client per process keeps a requests.Session, so AI calls reuse pooled
+keep-alive HTTPS connections instead of paying for DNS, TCP and TLS on every
+receipt. Each call has separate connect and read timeouts and a retry
+budget: at most `max_attempts` tries within `deadline` seconds, spaced by
+full-jitter exponential backoff, with retries across the process capped at
+a fraction of recent calls so an outage is not multiplied by retrying.
+Connection errors, timeouts and 5xx responses count against a circuit
+breaker; while it is open calls raise GroqUnavailable without touching the
+network. With a rate limiter every attempt first takes one request and the
+estimated tokens from the shared requests/tokens-per-minute buckets; a call
+that cannot be admitted in time raises GroqUnavailable (rate_limited).
+"""
+
+import random
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import OPEN, HALF_OPEN, CircuitBreaker, CircuitOpenError
+
+API_URL = 'https://api.groq.com/openai/v1/chat/completions'
+
+# Worth another attempt: rate limited, or Groq is struggling
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+REASON_CIRCUIT_OPEN = 'circuit_open'
+REASON_CONNECTION = 'connection'
+REASON_TIMEOUT = 'timeout'
+REASON_RATE_LIMITED = 'rate_limited'
+
+# Rate limiter buckets (see rate_limiter.py)
+BUCKET_REQUESTS = 'groq_requests'
+BUCKET_TOKENS = 'groq_tokens'
+
+
+class GroqError(Exception):
+    """A call that did not return a completion; `status` is the HTTP status when Groq answered"""
+
+    def __init__(self, message: str, status: Optional[int] = None, detail: str = '',
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class GroqUnavailable(GroqError):
+    """Groq could not be reached (`reason` connection/timeout), its breaker is open (circuit_open) or the
+    rate limiter refused the call (rate_limited)"""
+
+    def __init__(self, message: str, reason: str, retry_after: Optional[float] = None):
+        super().__init__(message, retry_after=retry_after)
+        self.reason = reason
+
+
+class RetryBudget:
+    """
+    Process-wide allowance for retries
+    Every call deposits `ratio` of a retry and every retry withdraws one, so
+    retries stay near `ratio` of traffic however many calls are failing;
+    `min_per_second` keeps a few retries available when traffic is light.
+
+    Args:
+        ratio: Retries allowed per call
+        min_per_second: Retries credited per second regardless of traffic
+        cap: Most retries that can be saved up
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 0.5, cap: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.cap = cap
+        self._lock = threading.Lock()
+        self._tokens = cap
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.cap, self._tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.cap, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def available(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+def _retry_after(resp: requests.Response) -> Optional[float]:
+    try:
+        return max(0.0, float(resp.headers.get('Retry-After', '')))
+    except ValueError:
+        return None
+
+
+class GroqClient:
+    """
+    Args:
+        api_key: Groq API key; calls raise GroqError while it is empty
+        url: Chat completions endpoint
+        connect_timeout: Seconds to establish the connection (DNS, TCP, TLS)
+        read_timeout: Seconds to wait for the response once the request is sent
+        max_attempts: Tries per call, the first one included
+        deadline: Seconds one call may spend across all attempts and backoff sleeps
+        backoff: First backoff ceiling in seconds; doubles per retry, the sleep is uniform below it
+        max_backoff: Longest sleep between attempts (a longer Retry-After ends the call instead)
+        pool_size: Keep-alive connections kept open to Groq (at least the threads calling at once)
+        breaker: Circuit breaker for Groq outages
+        retry_budget: Retry allowance shared by every call through this client
+        limiter: rate_limiter.RateLimiter with groq_requests / groq_tokens buckets (None = no client-side limit)
+        rate_limit_wait: Seconds an attempt may wait for the limiter before the call is refused
+        tokens_per_call: First estimate of tokens per call; then a running average of reported usage
+    """
+
+    def __init__(self, api_key: Optional[str], url: str = API_URL, connect_timeout: float = 5.0,
+                 read_timeout: float = 30.0, max_attempts: int = 3, deadline: float = 45.0,
+                 backoff: float = 1.0, max_backoff: float = 8.0, pool_size: int = 10,
+                 breaker: Optional[CircuitBreaker] = None, retry_budget: Optional[RetryBudget] = None,
+                 limiter: Any = None, rate_limit_wait: float = 5.0, tokens_per_call: float = 2000.0):
+        self.api_key = (api_key or '').strip()
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_attempts = max(1, max_attempts)
+        self.deadline = deadline
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker('groq', failure_threshold=5, reset_timeout=30.0)
+        self.retry_budget = retry_budget or RetryBudget()
+        self.limiter = limiter
+        self.rate_limit_wait = rate_limit_wait
+        self.tokens_estimate = tokens_per_call
+        self.session = requests.Session()
+        # Retries are ours (budgeted, breaker-aware); urllib3 must not add its own
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0))
+        self.session.headers.update({
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json',
+        })
+        self._lock = threading.Lock()
+        self._counters = {'calls': 0, 'succeeded': 0, 'failed': 0, 'retries': 0, 'budget_exhausted': 0,
+                          'rejected': 0, 'throttled': 0}
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _attempt(self, payload: Dict[str, Any], give_up_at: float) -> Dict[str, Any]:
+        """One request; raises GroqError (or GroqUnavailable) for anything but a 200 with a JSON body"""
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError as e:
+            self._count('rejected')
+            raise GroqUnavailable(str(e), REASON_CIRCUIT_OPEN, retry_after=e.retry_after)
+        estimate = self.tokens_estimate
+        if self.limiter is not None:
+            admitted, wait = self.limiter.acquire({BUCKET_REQUESTS: 1, BUCKET_TOKENS: estimate},
+                                                  max(0.0, min(self.rate_limit_wait, give_up_at - time.monotonic())))
+            if not admitted:
+                self.breaker.release()
+                self._count('throttled')
+                raise GroqUnavailable(f'AI rate limit reached (next slot in {wait:.0f}s)', REASON_RATE_LIMITED,
+                                      retry_after=wait)
+        read_timeout = max(1.0, min(self.read_timeout, give_up_at - time.monotonic()))
+        try:
+            resp = self.session.post(self.url, json=payload, timeout=(self.connect_timeout, read_timeout))
+        except requests.exceptions.ConnectionError as e:
+            # Includes ConnectTimeout: Groq could not be reached at all
+            self.breaker.record_failure(e)
+            raise GroqUnavailable(f'AI service connection failed: {e}', REASON_CONNECTION)
+        except requests.exceptions.Timeout as e:
+            self.breaker.record_failure(e)
+            raise GroqUnavailable(f'AI service request timed out: {e}', REASON_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            self.breaker.release()
+            raise GroqError(f'AI service request failed: {e}')
+
+        if resp.status_code >= 500:
+            self.breaker.record_failure(f'HTTP {resp.status_code}')
+        elif resp.status_code == 429:
+            # Groq is up but we are over quota; says nothing about an outage
+            self.breaker.release()
+        else:
+            self.breaker.record_success()
+        if resp.status_code != 200:
+            retry_after = _retry_after(resp)
+            if self.limiter is not None:
+                # Nothing was generated: give the estimated tokens back
+                self.limiter.adjust({BUCKET_TOKENS: -estimate})
+                if resp.status_code == 429:
+                    # Another client (or a limit change) got there first: hold every worker off
+                    self.limiter.pause(retry_after if retry_after is not None else 1.0)
+            raise GroqError(f'AI service error ({resp.status_code})', status=resp.status_code,
+                            detail=resp.text[:500], retry_after=retry_after)
+        try:
+            result = resp.json()
+        except ValueError:
+            raise GroqError('AI service returned invalid JSON', status=resp.status_code, detail=resp.text[:500])
+        self._settle(result, estimate)
+        return result
+
+    def _settle(self, result: Dict[str, Any], estimate: float) -> None:
+        """Charge the limiter the tokens Groq reports instead of the estimate, and refine the estimate"""
+        try:
+            used = float((result.get('usage') or {}).get('total_tokens') or 0)
+        except (AttributeError, TypeError, ValueError):
+            used = 0.0
+        if used <= 0:
+            return
+        with self._lock:
+            self.tokens_estimate = 0.8 * self.tokens_estimate + 0.2 * used
+        if self.limiter is not None and used != estimate:
+            self.limiter.adjust({BUCKET_TOKENS: used - estimate})
+
+    def chat(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST a chat completion request and return the response JSON"""
+        if not self.api_key:
+            raise GroqError('GROQ_API_KEY not configured')
+        self._count('calls')
+        self.retry_budget.deposit()
+        give_up_at = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = self._attempt(payload, give_up_at)
+                self._count('succeeded')
+                return result
+            except GroqUnavailable as e:
+                error: GroqError = e
+                if e.reason in (REASON_CIRCUIT_OPEN, REASON_RATE_LIMITED):
+                    self._count('failed')
+                    raise
+            except GroqError as e:
+                error = e
+                if e.status not in RETRY_STATUSES:
+                    self._count('failed')
+                    raise
+
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+            if error.retry_after is not None:
+                delay = max(delay, error.retry_after)
+            if (attempt >= self.max_attempts or delay > self.max_backoff
+                    or time.monotonic() + delay >= give_up_at or self.breaker.state == OPEN):
+                self._count('failed')
+                raise error
+            if not self.retry_budget.withdraw():
+                self._count('budget_exhausted')
+                self._count('failed')
+                raise error
+            self._count('retries')
+            time.sleep(delay)
+
+    def health(self) -> Tuple[bool, str]:
+        """(usable, message) from the breaker state; no network I/O"""
+        if not self.api_key:
+            return False, 'GROQ_API_KEY not configured'
+        state = self.breaker.stats()
+        if state['state'] == OPEN:
+            return False, (f"AI service unavailable after repeated failures ({state['last_error']}); "
+                           f"retrying in {state['retry_after']:.0f}s")
+        if state['state'] == HALF_OPEN:
+            return True, 'AI service is recovering; the next request checks it'
+        return True, 'AI service is available'
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+            'max_attempts': self.max_attempts,
+            'deadline': self.deadline,
+            'pool_size': self.pool_size,
+            'retry_budget': round(self.retry_budget.available, 2),
+            'tokens_estimate': round(self.tokens_estimate),
+            'breaker': self.breaker.stats(),
+            'rate_limiter': self.limiter.stats() if self.limiter is not None else None,
+            **counters,
+        }
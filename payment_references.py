@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Payment reference registry
+payment_references holds one row per receipt reference, keyed by its
+normalized digits, naming the request (and student) that first used it.
+Submit paths claim the reference in the same transaction as the request
+row, so a duplicate check is a single primary-key lookup that cannot race.
+One student may reuse a receipt for several document requests (one payment
+covering several certificates); any other reuse is a duplicate.
+Run manually: python payment_references.py backfill
+"""
+
+import re
+import sys
+from typing import Any, Dict, List, Optional
+
+SOURCE_CLEARANCE = 'clearance'
+SOURCE_DOCUMENT = 'document'
+
+# MySQL: duplicate entry for a unique key
+ER_DUP_ENTRY = 1062
+
+
+def normalize(reference: Any) -> Optional[str]:
+    """Digits of the reference (GCash '1234 567 890' == '1234567890'); letters only when it has no digits"""
+    text = str(reference or '').strip()
+    key = re.sub(r'\D', '', text) or re.sub(r'[^0-9a-z]', '', text.lower())
+    return key[:32] or None
+
+
+def owner(cur, reference: Any) -> Optional[Dict[str, Any]]:
+    """The registry row for this reference, if it has been used"""
+    key = normalize(reference)
+    if key is None:
+        return None
+    cur.execute(
+        """
+        SELECT reference_key, reference_number, source, request_id, student_id, document_type
+        FROM payment_references WHERE reference_key = %s
+        """,
+        (key,)
+    )
+    return cur.fetchone()
+
+
+def shareable(existing: Dict[str, Any], source: str, student_id: Any) -> bool:
+    """Whether a new request may reuse a reference that already has an owner"""
+    return (
+        source == SOURCE_DOCUMENT
+        and existing.get('source') == SOURCE_DOCUMENT
+        and existing.get('student_id') is not None
+        and str(existing.get('student_id')) == str(student_id)
+    )
+
+
+def claim(cur, reference: Any, source: str, request_id: int, student_id: Any,
+          document_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Record the reference for a request just inserted on this connection
+
+    Returns None when the reference is now (or already, shareably) owned by
+    the caller, or the conflicting owner row. Run it in the request's
+    transaction and roll back on a conflict.
+    """
+    key = normalize(reference)
+    if key is None:
+        return None
+    try:
+        cur.execute(
+            """
+            INSERT INTO payment_references
+              (reference_key, reference_number, source, request_id, student_id, document_type)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            """,
+            (key, str(reference).strip()[:64], source, request_id, student_id, (document_type or '')[:255] or None)
+        )
+        return None
+    except Exception as e:
+        if not (getattr(e, 'args', None) and e.args[0] == ER_DUP_ENTRY):
+            raise
+    existing = owner(cur, reference) or {'reference_key': key}
+    return None if shareable(existing, source, student_id) else existing
+
+
+def release_student(cur, student_id: Any) -> None:
+    """Forget references owned by a student whose requests are being deleted"""
+    cur.execute("DELETE FROM payment_references WHERE student_id = %s", (student_id,))
+
+
+def backfill(cur) -> Dict[str, Any]:
+    """
+    Register references of existing requests, oldest request first
+
+    Already registered references are left alone. Returns counts and the
+    historic duplicates (a later request reusing a reference it could not
+    have claimed today).
+    """
+    rows: List[Dict[str, Any]] = []
+    for source, table in ((SOURCE_CLEARANCE, 'clearance_requests'), (SOURCE_DOCUMENT, 'document_requests')):
+        cur.execute(
+            f"""
+            SELECT %s AS source, id, student_id, document_type, reference_number, created_at
+            FROM {table}
+            WHERE reference_number IS NOT NULL AND reference_number != ''
+            """,
+            (source,)
+        )
+        rows.extend(cur.fetchall() or [])
+    rows.sort(key=lambda r: (str(r.get('created_at') or ''), r['source'], r['id']))
+
+    registered = 0
+    duplicates = []
+    for r in rows:
+        conflict = claim(cur, r['reference_number'], r['source'], r['id'], r.get('student_id'), r.get('document_type'))
+        if conflict is None:
+            registered += 1
+        elif not (conflict.get('source') == r['source'] and conflict.get('request_id') == r['id']):
+            duplicates.append({
+                'reference_number': r['reference_number'],
+                'source': r['source'],
+                'request_id': r['id'],
+                'owner_source': conflict.get('source'),
+                'owner_request_id': conflict.get('request_id'),
+            })
+    return {'scanned': len(rows), 'registered': registered, 'duplicates': duplicates}
+
+
+def main(argv: List[str]) -> int:
+    import pymysql
+    from db_migrations import get_db_config
+
+    if argv[:1] not in ([], ['backfill']):
+        print("Usage: python payment_references.py backfill")
+        return 2
+    connection = pymysql.connect(**get_db_config())
+    try:
+        with connection.cursor() as cur:
+            result = backfill(cur)
+        print(f"✅ Scanned {result['scanned']} references, registered {result['registered']}")
+        for d in result['duplicates']:
+            print(f"⚠️ {d['source']} request {d['request_id']} reuses '{d['reference_number']}' "
+                  f"(owned by {d['owner_source']} request {d['owner_request_id']})")
+        return 0
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,271 @@
+"""
+Per-request database query accounting
+Counts statements, DB time, rows fetched and connections per Flask request,
+flags requests over their query budget and repeated statements (N+1), and
+aggregates the numbers per route. Requests can also carry a DB time budget:
+statement time is summed and each SELECT gets MAX_EXECUTION_TIME for what is
+left, so time spent outside the database does not count against it.
+"""
+
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+_WS_RE = re.compile(r'\s+')
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SELECT_RE = re.compile(r'^(\s*)select\b', re.IGNORECASE)
+
+# MySQL: "Query execution was interrupted, maximum statement execution time exceeded"
+ER_QUERY_TIMEOUT = 3024
+
+# Client errors meaning the server could not be reached: can't connect, gone away, lost connection
+_CONNECTION_ERRORS = frozenset({2003, 2006, 2013, 2055})
+
+
+def is_connection_error(e: BaseException) -> bool:
+    """True when a statement failed because of the connection, not the SQL"""
+    if type(e).__name__ == 'InterfaceError':
+        return True
+    args = getattr(e, 'args', None)
+    return bool(args) and args[0] in _CONNECTION_ERRORS
+
+
+class QueryDeadlineExceeded(Exception):
+    """Raised when a request's database time budget runs out"""
+
+    def __init__(self, route: Optional[str], budget_ms: Optional[float]):
+        super().__init__(f"Database time budget of {budget_ms:.0f} ms exceeded for {route}"
+                         if budget_ms is not None else f"Database deadline exceeded for {route}")
+        self.route = route
+        self.budget_ms = budget_ms
+
+
+def fingerprint(sql: str) -> str:
+    """Normalize a statement so repeated executions with different values compare equal"""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    text = _STRING_RE.sub('?', sql or '')
+    text = text.replace('%s', '?')
+    text = _NUMBER_RE.sub('?', text)
+    text = _IN_LIST_RE.sub('(?+)', text)
+    return _WS_RE.sub(' ', text).strip()
+
+
+class QueryRecorder:
+    """Query counters for a single request"""
+
+    def __init__(self, route: Optional[str] = None, budget_ms: Optional[float] = None):
+        self.route = route
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.connections = 0
+        self.fingerprints: Counter = Counter()
+        # Milliseconds of statement time (db_time) the request may spend; uploads, AI calls etc. do not count
+        self.budget_ms = budget_ms or None
+        self.timed_out = False
+
+    def remaining_ms(self) -> Optional[int]:
+        """Milliseconds of the DB time budget left; raises once it is spent"""
+        if self.budget_ms is None:
+            return None
+        remaining = int(self.budget_ms - self.db_time * 1000)
+        if remaining <= 0:
+            self.timed_out = True
+            raise QueryDeadlineExceeded(self.route, self.budget_ms)
+        return remaining
+
+    def record(self, sql: str, duration: float) -> None:
+        self.statements += 1
+        self.db_time += duration
+        self.fingerprints[fingerprint(sql)] += 1
+
+    def repeated(self, threshold: int) -> List[Dict[str, Any]]:
+        """Statements executed at least `threshold` times (likely N+1 loops)"""
+        return [
+            {'sql': sql[:300], 'count': n}
+            for sql, n in self.fingerprints.most_common()
+            if n >= threshold
+        ]
+
+
+class InstrumentedCursor:
+    """
+    Cursor wrapper that reports timing and fetched rows to a QueryRecorder
+
+    Statements the optional slow_log considers slow are handed to it as well,
+    and the optional circuit breaker learns whether each statement reached
+    the server.
+    """
+
+    def __init__(self, cursor: Any, recorder: QueryRecorder, slow_log: Any = None, breaker: Any = None):
+        self._cursor = cursor
+        self._recorder = recorder
+        self._slow_log = slow_log
+        self._breaker = breaker
+
+    def _timed(self, run, query, args):
+        sql = query
+        remaining = self._recorder.remaining_ms()
+        if remaining is not None and isinstance(query, str) and 'MAX_EXECUTION_TIME' not in query:
+            # Server-side cap for reads; MySQL ignores the hint on anything else
+            sql = _SELECT_RE.sub(lambda m: f"{m.group(1)}SELECT /*+ MAX_EXECUTION_TIME({remaining}) */",
+                                 query, count=1)
+        start = time.perf_counter()
+        try:
+            result = run(sql, args)
+            if self._breaker is not None:
+                self._breaker.record_success()
+            return result
+        except Exception as e:
+            if self._breaker is not None and is_connection_error(e):
+                self._breaker.record_failure(e)
+            if getattr(e, 'args', None) and e.args[0] == ER_QUERY_TIMEOUT:
+                self._recorder.timed_out = True
+                raise QueryDeadlineExceeded(self._recorder.route, self._recorder.budget_ms) from e
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            self._recorder.record(query, duration)
+            if self._slow_log is not None and self._slow_log.is_slow(duration):
+                self._slow_log.capture(self._cursor, query, args, duration, self._recorder.route)
+
+    def execute(self, query, args=None):
+        return self._timed(self._cursor.execute, query, args)
+
+    def executemany(self, query, args):
+        return self._timed(self._cursor.executemany, query, args)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._recorder.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+        self._recorder.rows += len(rows or ())
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._recorder.rows += len(rows or ())
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._cursor.close()
+
+
+class QueryStats:
+    """
+    Aggregated per-route query statistics
+
+    Args:
+        default_budget: Statements allowed per request before it is flagged
+        repeat_threshold: Executions of one statement fingerprint that count as N+1
+        route_budgets: Per-route overrides, keyed by 'METHOD /rule'
+    """
+
+    def __init__(self, default_budget: int = 15, repeat_threshold: int = 5,
+                 route_budgets: Optional[Dict[str, int]] = None):
+        self.default_budget = default_budget
+        self.repeat_threshold = repeat_threshold
+        self.route_budgets = dict(route_budgets or {})
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Dict[str, Any]] = {}
+
+    def start(self, route: Optional[str] = None, budget_ms: Optional[float] = None) -> QueryRecorder:
+        return QueryRecorder(route, budget_ms)
+
+    def budget_for(self, route: str) -> int:
+        return self.route_budgets.get(route, self.default_budget)
+
+    def finish(self, route: str, recorder: QueryRecorder) -> Dict[str, Any]:
+        """Fold one request into the route totals; returns its summary and any flags"""
+        budget = self.budget_for(route)
+        repeated = recorder.repeated(self.repeat_threshold)
+        summary = {
+            'route': route,
+            'statements': recorder.statements,
+            'db_time_ms': round(recorder.db_time * 1000, 2),
+            'rows': recorder.rows,
+            'connections': recorder.connections,
+            'budget': budget,
+            'over_budget': recorder.statements > budget,
+            'repeated': repeated,
+            'timed_out': recorder.timed_out,
+        }
+        with self._lock:
+            agg = self._routes.get(route)
+            if agg is None:
+                agg = self._routes[route] = {
+                    'requests': 0,
+                    'statements': 0,
+                    'max_statements': 0,
+                    'db_time_ms': 0.0,
+                    'max_db_time_ms': 0.0,
+                    'rows': 0,
+                    'connections': 0,
+                    'over_budget': 0,
+                    'timeouts': 0,
+                    'n_plus_one': Counter(),
+                }
+            agg['requests'] += 1
+            agg['statements'] += recorder.statements
+            agg['max_statements'] = max(agg['max_statements'], recorder.statements)
+            agg['db_time_ms'] += summary['db_time_ms']
+            agg['max_db_time_ms'] = max(agg['max_db_time_ms'], summary['db_time_ms'])
+            agg['rows'] += recorder.rows
+            agg['connections'] += recorder.connections
+            if summary['over_budget']:
+                agg['over_budget'] += 1
+            if recorder.timed_out:
+                agg['timeouts'] += 1
+            for item in repeated:
+                agg['n_plus_one'][item['sql']] += 1
+        return summary
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Per-route totals and averages, chattiest routes first"""
+        with self._lock:
+            out = []
+            for route, agg in self._routes.items():
+                n = agg['requests'] or 1
+                out.append({
+                    'route': route,
+                    'budget': self.budget_for(route),
+                    'requests': agg['requests'],
+                    'avg_statements': round(agg['statements'] / n, 2),
+                    'max_statements': agg['max_statements'],
+                    'avg_db_time_ms': round(agg['db_time_ms'] / n, 2),
+                    'max_db_time_ms': agg['max_db_time_ms'],
+                    'avg_rows': round(agg['rows'] / n, 2),
+                    'avg_connections': round(agg['connections'] / n, 2),
+                    'over_budget': agg['over_budget'],
+                    'timeouts': agg['timeouts'],
+                    'n_plus_one': [
+                        {'sql': sql, 'requests': count}
+                        for sql, count in agg['n_plus_one'].most_common(5)
+                    ],
+                })
+        out.sort(key=lambda r: (r['avg_statements'], r['avg_db_time_ms']), reverse=True)
+        return out
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes.clear()
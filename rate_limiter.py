@@ -0,0 +1,274 @@
+"""
+Cross-worker token buckets
+Admits calls to a rate-limited API (Groq's requests and tokens per minute)
+against buckets shared by every worker, so the quota is spent by the whole
+deployment at the rate the API allows instead of each worker finding out
+from 429s. Buckets live in a small file in shared memory guarded by flock
+(all workers on one host) or in one MySQL row each (several hosts). A call
+takes its cost from every bucket or from none; when one is short the caller
+waits up to `max_wait` seconds for it to refill and is then refused, so it
+can degrade instead of queueing indefinitely. A store outage admits calls.
+"""
+
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no flock, buckets are per process
+    fcntl = None
+
+# name -> [tokens, updated_at (epoch seconds)]
+State = Dict[str, List[float]]
+
+
+def _refill(state: State, specs: Dict[str, Tuple[float, float]], names, now: float) -> None:
+    for name in names:
+        capacity, rate = specs[name]
+        tokens, updated = state.get(name) or (capacity, now)
+        state[name] = [min(capacity, tokens + max(0.0, now - updated) * rate), now]
+
+
+def _take(state: State, specs: Dict[str, Tuple[float, float]], costs: Dict[str, float], now: float) -> float:
+    """Deduct `costs` when every bucket can pay and return 0, else the seconds until they can"""
+    _refill(state, specs, costs, now)
+    wait = 0.0
+    for name, cost in costs.items():
+        capacity, rate = specs[name]
+        # A call costing more than the bucket holds waits for a full bucket and drives it negative
+        need = min(cost, capacity)
+        if state[name][0] < need:
+            wait = max(wait, (need - state[name][0]) / rate)
+    if wait == 0.0:
+        for name, cost in costs.items():
+            state[name][0] -= cost
+    return wait
+
+
+def _adjust(state: State, specs: Dict[str, Tuple[float, float]], costs: Dict[str, float], now: float) -> None:
+    """Charge (positive) or refund (negative) without waiting"""
+    _refill(state, specs, costs, now)
+    for name, cost in costs.items():
+        state[name][0] = min(specs[name][0], state[name][0] - cost)
+
+
+class LocalBackend:
+    """
+    Buckets in a JSON file in shared memory (/dev/shm when present), locked with flock
+
+    Args:
+        path: File shared by the workers of this host
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        shm = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        self.path = path or os.path.join(shm, 'irequest-rate-limits.json')
+        self._lock = threading.Lock()
+        self._state: State = {}
+
+    def update(self, fn: Callable[[State, float], Any]) -> Any:
+        """Run fn(state, now) with every other caller (thread or process) locked out and save its changes"""
+        with self._lock:
+            if fcntl is None:
+                return fn(self._state, time.time())
+            with open(self.path, 'a+', encoding='utf-8') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        state = json.loads(f.read() or '{}')
+                    except ValueError:
+                        state = {}
+                    result = fn(state, time.time())
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                    return result
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': 'local' if fcntl is not None else 'process', 'path': self.path}
+
+
+class DatabaseBackend:
+    """
+    Buckets as rows of rate_limit_buckets, updated under SELECT ... FOR UPDATE
+
+    Args:
+        cursor: () -> (cursor, connection) on an autocommit connection (mysql.cursor)
+    """
+
+    def __init__(self, cursor: Callable[[], Tuple[Any, Any]]):
+        self.cursor = cursor
+        self._created: set = set()
+
+    def update(self, fn: Callable[[State, float], Any], names: List[str]) -> Any:
+        cur, conn = self.cursor()
+        try:
+            missing = [n for n in names if n not in self._created]
+            if missing:
+                # Rows must exist before they can be locked; new buckets start empty and refill
+                cur.executemany("INSERT IGNORE INTO rate_limit_buckets (name, tokens, updated_at) "
+                                "VALUES (%s, 0, UNIX_TIMESTAMP(NOW(6)))", [(n,) for n in missing])
+                self._created.update(missing)
+            conn.begin()
+            try:
+                cur.execute(
+                    "SELECT name, tokens, updated_at, UNIX_TIMESTAMP(NOW(6)) AS now FROM rate_limit_buckets "
+                    f"WHERE name IN ({', '.join(['%s'] * len(names))}) FOR UPDATE",
+                    tuple(names)
+                )
+                rows = cur.fetchall() or []
+                now = float(rows[0]['now']) if rows else time.time()
+                state = {r['name']: [float(r['tokens']), float(r['updated_at'])] for r in rows}
+                result = fn(state, now)
+                cur.executemany("UPDATE rate_limit_buckets SET tokens = %s, updated_at = %s WHERE name = %s",
+                                [(tokens, updated, name) for name, (tokens, updated) in state.items()])
+                conn.commit()
+                return result
+            except Exception:
+                conn.rollback()
+                raise
+        finally:
+            cur.close()
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': 'database'}
+
+
+class RateLimiter:
+    """
+    Args:
+        backend: LocalBackend or DatabaseBackend holding the buckets
+        limits: Bucket name -> allowance per minute (0 or missing = unlimited)
+        prefix: Prepended to bucket names in the store
+        burst: Seconds of allowance a bucket can save up (a quiet minute does not allow a burst of a whole minute)
+        max_wait: Default seconds acquire() waits for tokens before refusing
+    """
+
+    def __init__(self, backend: Any, limits: Dict[str, float], prefix: str = 'irequest',
+                 burst: float = 10.0, max_wait: float = 5.0):
+        self.backend = backend
+        self.prefix = prefix
+        self.max_wait = max_wait
+        self.limits = {name: per_minute for name, per_minute in limits.items() if per_minute and per_minute > 0}
+        # store name -> (capacity, refill per second)
+        self._specs = {
+            self._key(name): (max(1.0, per_minute * burst / 60.0), per_minute / 60.0)
+            for name, per_minute in self.limits.items()
+        }
+        self._lock = threading.Lock()
+        self._counters = {'admitted': 0, 'waited': 0, 'refused': 0, 'paused': 0, 'store_errors': 0}
+
+    @classmethod
+    def from_store(cls, store: Optional[str], limits: Dict[str, float], cursor: Optional[Callable] = None,
+                   **kwargs) -> 'RateLimiter':
+        """Empty or 'local' shares buckets between the workers of this host; 'database' between hosts"""
+        store = (store or '').strip().lower()
+        if not store or store == 'local':
+            backend: Any = LocalBackend()
+        elif store == 'database':
+            if cursor is None:
+                raise ValueError("The database rate-limit store needs a cursor factory")
+            backend = DatabaseBackend(cursor)
+        else:
+            raise ValueError(f"Unsupported rate-limit store: {store}")
+        return cls(backend, limits, **kwargs)
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}:{name}"
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _update(self, fn: Callable[[State, float], Any]) -> Any:
+        if isinstance(self.backend, DatabaseBackend):
+            return self.backend.update(fn, sorted(self._specs))
+        return self.backend.update(fn)
+
+    def _costs(self, costs: Dict[str, float]) -> Dict[str, float]:
+        return {self._key(name): float(cost) for name, cost in costs.items() if name in self.limits and cost}
+
+    def acquire(self, costs: Dict[str, float], max_wait: Optional[float] = None) -> Tuple[bool, float]:
+        """
+        Take `costs` (bucket name -> amount) from the buckets, waiting up to
+        `max_wait` seconds for them to refill. Returns (admitted, seconds
+        until they could have been admitted when refused).
+        """
+        keyed = self._costs(costs)
+        if not keyed:
+            return True, 0.0
+        remaining = self.max_wait if max_wait is None else max_wait
+        waited = False
+        while True:
+            try:
+                wait = self._update(lambda state, now: _take(state, self._specs, keyed, now))
+            except Exception as e:
+                self._count('store_errors')
+                print(f"⚠️ Rate-limit store unavailable, admitting call: {e}")
+                return True, 0.0
+            if wait == 0.0:
+                self._count('admitted')
+                if waited:
+                    self._count('waited')
+                return True, 0.0
+            if wait > remaining:
+                self._count('refused')
+                return False, wait
+            # Jitter so waiting workers do not all retry at the same instant
+            pause = min(remaining, wait * random.uniform(1.0, 1.2))
+            time.sleep(pause)
+            remaining -= pause
+            waited = True
+
+    def adjust(self, costs: Dict[str, float]) -> None:
+        """Charge more (positive) or refund (negative) once a call's real cost is known"""
+        keyed = self._costs(costs)
+        if not keyed:
+            return
+        try:
+            self._update(lambda state, now: _adjust(state, self._specs, keyed, now))
+        except Exception as e:
+            self._count('store_errors')
+            print(f"⚠️ Rate-limit store unavailable: {e}")
+
+    def pause(self, seconds: float) -> None:
+        """Empty every bucket for `seconds` (the API said we are over its limit), for all workers"""
+        if not self._specs or seconds <= 0:
+            return
+
+        def drain(state: State, now: float) -> None:
+            _refill(state, self._specs, self._specs, now)
+            for name, (capacity, rate) in self._specs.items():
+                state[name][0] = min(state[name][0], -rate * seconds)
+
+        try:
+            self._update(drain)
+            self._count('paused')
+        except Exception as e:
+            self._count('store_errors')
+            print(f"⚠️ Rate-limit store unavailable: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        tokens = None
+        if self._specs:
+            def snapshot(state: State, now: float) -> Dict[str, float]:
+                _refill(state, self._specs, self._specs, now)
+                return {name.split(':', 1)[1]: round(state[name][0], 1) for name in self._specs}
+            try:
+                tokens = self._update(snapshot)
+            except Exception:
+                tokens = None
+        return {**self.backend.stats(), 'limits_per_minute': self.limits, 'available': tokens, **counters}
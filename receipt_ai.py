@@ -0,0 +1,304 @@
+"""
+Receipt AI extraction
+Prompt, response parsing and reference matching for payment receipts, shared
+by the web app (_groq_extract and the receipt endpoints) and offline tools
+such as receipt_reverify.py. Results are plain dicts: {'ok': True, 'amount',
+'reference_number', 'confidence', 'raw_text'} or {'ok': False, 'message'},
+plus 'ai_unavailable' while the Groq circuit breaker is open or the shared
+rate limit is used up ('busy').
+"""
+
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from groq_client import REASON_CIRCUIT_OPEN, REASON_RATE_LIMITED, REASON_TIMEOUT, GroqError, GroqUnavailable
+
+VISION_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+# Short id from older Groq examples; tried when the full id is not found
+VISION_MODEL_FALLBACK = "llama-4-scout-17b-16e-instruct"
+
+# Shown while the Groq circuit breaker is open (see groq_client.py)
+UNAVAILABLE_MESSAGE = 'AI receipt checking is temporarily unavailable. Please type the reference number manually.'
+# Shown when the shared Groq rate limit is used up (see rate_limiter.py)
+BUSY_MESSAGE = 'AI receipt checking is busy right now. Please type the reference number manually or try again shortly.'
+
+PROMPT = (
+    "You are an expert at analyzing Philippine payment receipts, especially GCash and government receipts. Return ONLY valid JSON with these fields:\n"
+    "{\n"
+    "  \"amount\": \"number only, e.g. 50.00\",\n"
+    "  \"reference_number\": \"digits only, prefer 13-digit; else 7-16 digits\",\n"
+    "  \"raw_text\": \"all text you can read\",\n"
+    "  \"confidence_score\": \"0.0 to 1.0\"\n"
+    "}\n"
+    "CRITICAL: For reference_number, focus on these specific locations in Philippine receipts:\n"
+    "1. BELOW 'ORIGINAL' text - This is the MOST COMMON location for reference numbers in Philippine receipts\n"
+    "2. Look for numbers that appear directly under or near 'ORIGINAL' text\n"
+    "3. Check for numbers in red ink or highlighted areas\n"
+    "4. Look for transaction numbers, receipt numbers, or confirmation numbers\n"
+    "5. Numbers that look like: 6219902, 1234567890123, etc.\n"
+    "\n"
+    "Rules:\n"
+    "- Strip all currency symbols and commas from amount.\n"
+    "- For reference_number: DIGITS ONLY. Accept 7-16 digit sequences.\n"
+    "- PRIORITIZE numbers found below 'ORIGINAL' text\n"
+    "- Look for numbers that appear to be receipt/reference/transaction IDs\n"
+    "- If multiple numbers found, prefer the one below 'ORIGINAL' or the longest sequence\n"
+    "- If none found, return null.\n"
+    "- Be very thorough in scanning the entire receipt, especially the bottom section\n"
+    "- ONLY extract reference numbers that are clearly visible and readable\n"
+    "- DO NOT guess or make up reference numbers\n"
+    "- If the image is blurry or unclear, set confidence_score to 0.0\n"
+    "Respond with JSON only."
+)
+
+# Reference numbers are 7-16 digits
+_REF_RE = re.compile(r'\d{7,16}')
+
+# Raw-text patterns tried when the model's reference_number field is unusable, strongest first
+_REF_PATTERNS = [
+    r'(?:ORIGINAL)[\s\S]*?(\d{7,16})',  # After ORIGINAL text
+    r'(?:REF|REFERENCE|NO\.|NUMBER)[\s#:]*(\d{7,16})',  # After REF/REFERENCE labels
+    r'(?:RECEIPT|TXN|TRANSACTION)[\s#:]*(\d{7,16})',  # After receipt/transaction labels
+    r'\b(\d{7,16})\b',  # Any 7-16 digit number as fallback
+]
+
+
+def payload(image_b64: str, model: str = VISION_MODEL) -> Dict[str, Any]:
+    """Chat completion request for one JPEG receipt"""
+    return {
+        "model": model,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": PROMPT},
+                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}},
+                ],
+            }
+        ],
+        "temperature": 0.1,
+        "max_tokens": 512,
+    }
+
+
+def _manual_extract(text: str) -> Optional[Dict[str, Any]]:
+    """Fields pulled out of malformed JSON with regexes"""
+    try:
+        amount = None
+        amount_match = re.search(r'"amount":\s*"?([^",}]+)"?', text)
+        if amount_match:
+            amt_str = re.sub(r'[^\d\.]', '', amount_match.group(1))
+            try:
+                amount = float(amt_str) if amt_str else None
+            except ValueError:
+                amount = None
+
+        ref = ''
+        ref_match = re.search(r'"reference_number":\s*"?([^",}]+)"?', text)
+        if ref_match:
+            ref = re.sub(r'\D', '', ref_match.group(1))
+
+        raw_text = ''
+        raw_match = re.search(r'"raw_text":\s*"([^"]*)', text)
+        if raw_match:
+            raw_text = raw_match.group(1)
+
+        confidence = 0.0
+        conf_match = re.search(r'"confidence_score":\s*"?([^",}]+)"?', text)
+        if conf_match:
+            try:
+                confidence = float(conf_match.group(1))
+            except ValueError:
+                confidence = 0.0
+
+        return {'amount': amount, 'reference_number': ref, 'confidence': confidence, 'raw_text': raw_text}
+    except Exception:
+        return None
+
+
+def _load_json(text: str) -> Any:
+    """The model's JSON, closing a truncated object; raises ValueError with the cleaned text as args[1]"""
+    text = text.strip()
+    if text.startswith('```json'):
+        text = text[7:]
+    if text.endswith('```'):
+        text = text[:-3]
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    # Truncated response: close the last string / object
+    if not text.endswith('"') and not text.endswith('}') and not text.endswith(']'):
+        if '"raw_text":' in text:
+            last_quote_pos = text.rfind('"')
+            if last_quote_pos > 0 and not text[last_quote_pos + 1:].strip().endswith('}'):
+                text = text[:last_quote_pos + 1] + '"}'
+        elif text.count('{') > text.count('}'):
+            text += '}'
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        raise ValueError('unparseable JSON', text)
+
+
+def _valid_ref(s: str) -> bool:
+    return bool(s) and bool(_REF_RE.fullmatch(s))
+
+
+def _pick_best_ref(candidates: List[Any], raw_text: str) -> str:
+    """Most likely reference number: 13 digits first, then longer, then present under ORIGINAL"""
+    seen = set()
+    uniq = []
+    for c in candidates:
+        c = re.sub(r'\D', '', str(c or ''))
+        if _valid_ref(c) and c not in seen:
+            seen.add(c)
+            uniq.append(c)
+    if not uniq:
+        return ''
+    raw_digits = re.sub(r'\D', '', raw_text)
+    original_present = 'ORIGINAL' in (raw_text or '').upper()
+    scored = []
+    for c in uniq:
+        score = len(c)
+        if len(c) == 13:
+            score += 30
+        if original_present and c in raw_digits:
+            score += 10
+        scored.append((score, c))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return scored[0][1]
+
+
+def parse_ai_text(json_text: str) -> Optional[Dict[str, Any]]:
+    """amount / reference_number / confidence / raw_text from the model's answer, or None if unreadable"""
+    try:
+        try:
+            data = _load_json(json_text)
+        except ValueError as e:
+            return _manual_extract(e.args[1])
+        if not isinstance(data, dict):
+            return None
+
+        amount = None
+        if data.get('amount') is not None:
+            try:
+                amount = float(re.sub(r'[^\d\.]', '', str(data['amount'])))
+            except ValueError:
+                amount = None
+
+        raw_text = str(data.get('raw_text') or '')
+        digits_only = re.sub(r'\D', '', str(data.get('reference_number') or ''))
+        if _valid_ref(digits_only):
+            # Trust the model's field when it is a plausible reference number
+            ref = digits_only
+        else:
+            candidates = []
+            for pattern in _REF_PATTERNS:
+                found = re.findall(pattern, raw_text, re.IGNORECASE)
+                if found:
+                    candidates.extend(found)
+                    # stop early on strong patterns
+                    if pattern.startswith('(?:ORIGINAL)') or pattern.startswith('(?:REF'):
+                        break
+            ref = _pick_best_ref(candidates, raw_text)
+        return {
+            'amount': amount,
+            'reference_number': ref,
+            'confidence': float(data.get('confidence_score') or 0.0),
+            'raw_text': raw_text,
+        }
+    except Exception:
+        return None
+
+
+def extract(client: Any, image_b64: str, model: Optional[str] = None) -> Dict[str, Any]:
+    """Run one receipt through the vision model; never raises"""
+    if client is None or not client.api_key:
+        return {'ok': False, 'message': 'GROQ_API_KEY not configured. Add GROQ_API_KEY to your .env file (get a key from https://console.groq.com).'}
+    model = model or VISION_MODEL
+    try:
+        try:
+            response = client.chat(payload(image_b64, model))
+        except GroqUnavailable as e:
+            if e.reason == REASON_CIRCUIT_OPEN:
+                return {'ok': False, 'ai_unavailable': True, 'retry_after': round(e.retry_after or 0),
+                        'message': UNAVAILABLE_MESSAGE}
+            if e.reason == REASON_RATE_LIMITED:
+                return {'ok': False, 'ai_unavailable': True, 'busy': True, 'retry_after': round(e.retry_after or 0),
+                        'message': BUSY_MESSAGE}
+            if e.reason == REASON_TIMEOUT:
+                return {'ok': False, 'message': 'AI service request timed out. Please try again.'}
+            error_msg = str(e).lower()
+            if 'name resolution' in error_msg or 'getaddrinfo failed' in error_msg:
+                return {'ok': False, 'message': 'AI service connection failed: Cannot resolve domain name. Please check your internet connection and DNS settings.'}
+            if 'timeout' in error_msg or 'timed out' in error_msg:
+                return {'ok': False, 'message': 'AI service connection failed: Request timeout. Please check your internet connection speed.'}
+            return {'ok': False, 'message': 'AI service connection failed. Please check your internet connection and try again.'}
+        except GroqError as e:
+            if e.status is None:
+                return {'ok': False, 'message': f'{e}. Please check your internet connection.'}
+            if e.status == 404:
+                if model == VISION_MODEL:
+                    return extract(client, image_b64, VISION_MODEL_FALLBACK)
+                return {'ok': False, 'message': f'AI model not found (404). Tried model: {model}. Error: {e.detail[:300]}. Please check Groq console for available vision models.'}
+            if e.status == 503:
+                return {'ok': False, 'message': 'AI service is temporarily overloaded. Please try again in a few minutes.'}
+            if e.status == 429:
+                return {'ok': False, 'message': 'Too many requests. Please wait a moment and try again.'}
+            if e.status == 400:
+                return {'ok': False, 'message': f'Invalid request. Error: {e.detail[:200]}'}
+            if e.status == 401:
+                return {'ok': False, 'message': 'Invalid API key. Please check your Groq API key.'}
+            return {'ok': False, 'message': f'AI service error ({e.status}): {e.detail[:200]}'}
+
+        try:
+            ai_text = response['choices'][0]['message']['content']
+        except Exception as e:
+            return {'ok': False, 'message': f'No response content in AI response: {str(e)}'}
+
+        parsed = parse_ai_text(ai_text)
+        if not parsed:
+            print(f"⚠️ Groq returned unparseable receipt JSON: {ai_text[:200]}")
+            return {'ok': False, 'message': f'AI processing failed: Invalid JSON from Groq. Raw response: ```json {ai_text[:200]}```\n\nPlease try again in a few minutes. The AI service may be experiencing high traffic.'}
+        return {'ok': True, **parsed}
+    except Exception as e:
+        return {'ok': False, 'message': str(e)}
+
+
+def match_reference(result: Dict[str, Any], provided: Any) -> Dict[str, Any]:
+    """
+    Whether a typed reference number appears on the receipt
+
+    Candidates are the model's reference_number plus every 7-16 digit run in
+    the raw text. A reference that is not a candidate still matches when its
+    digits occur in the raw text's digit stream and no other candidate of the
+    same length contradicts it.
+    """
+    extracted_digits = re.sub(r'\D', '', (result.get('reference_number') or '').strip())
+    provided_digits = re.sub(r'\D', '', str(provided or '').strip())
+    raw_text = result.get('raw_text') or ''
+
+    candidates: List[str] = []
+    for value in [extracted_digits] + re.findall(r'\b\d{7,16}\b', raw_text):
+        if _valid_ref(value) and value not in candidates:
+            candidates.append(value)
+    raw_digits_stream = re.sub(r'\D', '', raw_text)
+    stream_contains = bool(provided_digits) and provided_digits in raw_digits_stream
+
+    matches = False
+    if provided_digits and provided_digits in candidates:
+        matches = True
+    elif stream_contains:
+        conflicts = [c for c in candidates if len(c) == len(provided_digits) and c != provided_digits]
+        matches = not conflicts
+    return {
+        'matches': matches,
+        'extracted_digits': extracted_digits,
+        'provided_digits': provided_digits,
+        'candidates': candidates,
+        'has_digits': bool(candidates or raw_digits_stream),
+    }
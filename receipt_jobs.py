@@ -0,0 +1,282 @@
+"""
+Background receipt-verification jobs
+The receipt endpoints queue the AI extraction instead of running it inside
+the request: submit() stores the image in receipt_jobs and returns at once,
+a small pool of worker threads (in every app process) claims queued jobs by
+priority, and clients poll the job until it is done. An identical job that
+is still queued, running or recently succeeded is returned instead of adding
+a new one. Jobs whose worker died are requeued after `stuck_after` seconds.
+"""
+
+import hashlib
+import json
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional, Tuple
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+FINISHED = (STATUS_DONE, STATUS_FAILED)
+
+PURPOSE_EXTRACT = 'extract'
+PURPOSE_VALIDATE = 'validate'
+
+# Validation runs while the student waits on "Submit"; extraction only pre-fills a field
+PRIORITIES = {PURPOSE_VALIDATE: 10, PURPOSE_EXTRACT: 0}
+
+_COLUMNS = ("id, purpose, priority, status, image_hash, reference_number, owner, result, error, "
+            "attempts, created_at, started_at, finished_at")
+
+
+class QueueFull(Exception):
+    """Too many jobs are waiting; the caller should fall back to manual entry"""
+
+
+def image_hash(image: bytes) -> str:
+    return hashlib.sha256(image).hexdigest()
+
+
+class ReceiptJobQueue:
+    """
+    Args:
+        cursor: () -> (cursor, connection) on an autocommit connection (mysql.cursor)
+        handler: image bytes -> JSON-serializable result; runs in a worker thread
+        workers: Worker threads in this process
+        max_pending: Queued + running jobs (all processes) before submit() raises QueueFull
+        max_attempts: Runs of a job whose handler raised before it is marked failed
+        stuck_after: Seconds a running job may take before it is assumed lost and requeued
+        reuse_for: Seconds a successful job ({'ok': True, ...} result) answers identical submissions
+        retention: Seconds finished jobs are kept
+        poll_interval: Seconds idle workers wait between checks for jobs queued by other processes
+    """
+
+    def __init__(self, cursor: Callable[[], Tuple[Any, Any]], handler: Callable[[bytes], Any],
+                 workers: int = 2, max_pending: int = 200, max_attempts: int = 2,
+                 stuck_after: float = 180.0, reuse_for: float = 600.0, retention: float = 86400.0,
+                 poll_interval: float = 2.0):
+        self.cursor = cursor
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.stuck_after = stuck_after
+        self.reuse_for = reuse_for
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self._wake = threading.Condition()
+        self._finished = threading.Condition()
+        self._threads = []
+        self._stopping = False
+        self._next_maintenance = 0.0
+        self._lock = threading.Lock()
+        self._counters = {'submitted': 0, 'deduplicated': 0, 'completed': 0, 'failed': 0, 'retried': 0,
+                          'requeued': 0, 'rejected': 0}
+
+    def _count(self, counter: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] += n
+
+    def _run(self, sql: str, args: Tuple = (), fetch: Optional[str] = None) -> Any:
+        cur, conn = self.cursor()
+        try:
+            cur.execute(sql, args)
+            if fetch == 'one':
+                return cur.fetchone()
+            if fetch == 'all':
+                return cur.fetchall()
+            return cur.rowcount
+        finally:
+            cur.close()
+            conn.close()
+
+    # ---- client side ----
+
+    def submit(self, image: bytes, purpose: str = PURPOSE_EXTRACT, reference_number: str = '',
+               owner: str = '') -> Dict[str, Any]:
+        """Queue an extraction (or return the matching live job); the job row without its image"""
+        digest = image_hash(image)
+        priority = PRIORITIES.get(purpose, 0)
+        reference_number = (reference_number or '').strip()[:64]
+        owner = (owner or '')[:255]
+        existing = self._run(
+            f"""
+            SELECT {_COLUMNS} FROM receipt_jobs
+            WHERE image_hash = %s AND purpose = %s AND reference_number = %s AND owner = %s
+              AND (status IN (%s, %s) OR (status = %s AND reusable = 1 AND finished_at >= NOW() - INTERVAL %s SECOND))
+            ORDER BY id DESC LIMIT 1
+            """,
+            (digest, purpose, reference_number, owner, STATUS_QUEUED, STATUS_RUNNING, STATUS_DONE,
+             int(self.reuse_for)),
+            fetch='one'
+        )
+        if existing:
+            self._count('deduplicated')
+            return existing
+
+        row = self._run("SELECT COUNT(*) AS n FROM receipt_jobs WHERE status IN (%s, %s)",
+                        (STATUS_QUEUED, STATUS_RUNNING), fetch='one') or {}
+        if int(row.get('n') or 0) >= self.max_pending:
+            self._count('rejected')
+            raise QueueFull(f"{row.get('n')} receipt jobs pending")
+
+        cur, conn = self.cursor()
+        try:
+            cur.execute(
+                """
+                INSERT INTO receipt_jobs (purpose, priority, status, image_hash, image, reference_number, owner)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """,
+                (purpose, priority, STATUS_QUEUED, digest, image, reference_number, owner)
+            )
+            job_id = cur.lastrowid
+        finally:
+            cur.close()
+            conn.close()
+        self._count('submitted')
+        with self._wake:
+            self._wake.notify()
+        return self.get(job_id) or {'id': job_id, 'status': STATUS_QUEUED, 'purpose': purpose}
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        row = self._run(f"SELECT {_COLUMNS} FROM receipt_jobs WHERE id = %s", (job_id,), fetch='one')
+        if row and row.get('result') is not None:
+            try:
+                row['result'] = json.loads(row['result'])
+            except (TypeError, ValueError):
+                row['result'] = None
+        return row
+
+    def position(self, job: Dict[str, Any]) -> int:
+        """Jobs that will be claimed before this queued job"""
+        row = self._run(
+            "SELECT COUNT(*) AS n FROM receipt_jobs WHERE status = %s AND (priority > %s OR (priority = %s AND id < %s))",
+            (STATUS_QUEUED, job['priority'], job['priority'], job['id']),
+            fetch='one'
+        ) or {}
+        return int(row.get('n') or 0)
+
+    def wait(self, job_id: int, timeout: float) -> Optional[Dict[str, Any]]:
+        """The job once finished, or as it stands after `timeout` seconds"""
+        deadline = time.monotonic() + max(0.0, timeout)
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] in FINISHED or remaining <= 0:
+                return job
+            # Woken by this process's workers; the timeout catches jobs run by other processes
+            with self._finished:
+                self._finished.wait(min(remaining, self.poll_interval))
+
+    # ---- worker side ----
+
+    def start(self) -> None:
+        """Start the worker threads (idempotent)"""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"receipt-job-{i}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def stop(self) -> None:
+        self._stopping = True
+        with self._wake:
+            self._wake.notify_all()
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        token = uuid.uuid4().hex
+        claimed = self._run(
+            """
+            UPDATE receipt_jobs
+            SET status = %s, claim_token = %s, started_at = NOW(), attempts = attempts + 1
+            WHERE status = %s
+            ORDER BY priority DESC, id
+            LIMIT 1
+            """,
+            (STATUS_RUNNING, token, STATUS_QUEUED)
+        )
+        if not claimed:
+            return None
+        return self._run("SELECT id, image, attempts, claim_token FROM receipt_jobs WHERE claim_token = %s",
+                         (token,), fetch='one')
+
+    def _finish(self, job: Dict[str, Any], status: str, result: Any = None, error: Optional[str] = None) -> None:
+        self._run(
+            """
+            UPDATE receipt_jobs
+            SET status = %s, result = %s, reusable = %s, error = %s, image = NULL, finished_at = NOW(),
+                claim_token = NULL
+            WHERE id = %s AND claim_token = %s
+            """,
+            (status, json.dumps(result, default=str) if result is not None else None,
+             1 if isinstance(result, dict) and result.get('ok') else 0,
+             (error or '')[:500] or None, job['id'], job['claim_token'])
+        )
+        with self._finished:
+            self._finished.notify_all()
+
+    def _process(self, job: Dict[str, Any]) -> None:
+        try:
+            result = self.handler(bytes(job['image'] or b''))
+        except Exception as e:
+            if job['attempts'] < self.max_attempts:
+                self._count('retried')
+                self._run("UPDATE receipt_jobs SET status = %s, claim_token = NULL WHERE id = %s AND claim_token = %s",
+                          (STATUS_QUEUED, job['id'], job['claim_token']))
+            else:
+                self._count('failed')
+                self._finish(job, STATUS_FAILED, error=str(e))
+            print(f"⚠️ Receipt job {job['id']} failed (attempt {job['attempts']}): {e}")
+            return
+        self._count('completed')
+        self._finish(job, STATUS_DONE, result=result)
+
+    def _maintain(self) -> None:
+        now = time.monotonic()
+        if now < self._next_maintenance:
+            return
+        self._next_maintenance = now + 60.0
+        self._run(
+            "UPDATE receipt_jobs SET status = %s, error = %s, image = NULL, finished_at = NOW(), claim_token = NULL "
+            "WHERE status = %s AND started_at < NOW() - INTERVAL %s SECOND AND attempts >= %s",
+            (STATUS_FAILED, 'Worker stopped while processing', STATUS_RUNNING, int(self.stuck_after), self.max_attempts)
+        )
+        requeued = self._run(
+            "UPDATE receipt_jobs SET status = %s, claim_token = NULL "
+            "WHERE status = %s AND started_at < NOW() - INTERVAL %s SECOND",
+            (STATUS_QUEUED, STATUS_RUNNING, int(self.stuck_after))
+        )
+        if requeued:
+            self._count('requeued', requeued)
+            print(f"⚠️ Requeued {requeued} receipt job(s) left running by a stopped worker")
+        self._run("DELETE FROM receipt_jobs WHERE status IN (%s, %s) AND finished_at < NOW() - INTERVAL %s SECOND",
+                  (STATUS_DONE, STATUS_FAILED, int(self.retention)))
+
+    def _work(self) -> None:
+        while not self._stopping:
+            try:
+                self._maintain()
+                job = self._claim()
+            except Exception as e:
+                print(f"⚠️ Receipt job queue unavailable: {e}")
+                job = None
+                time.sleep(self.poll_interval)
+            if job is None:
+                with self._wake:
+                    self._wake.wait(self.poll_interval)
+                continue
+            try:
+                self._process(job)
+            except Exception as e:
+                # Result not stored (database down): the job stays running and _maintain requeues it
+                print(f"⚠️ Receipt job {job['id']} could not be recorded: {e}")
+                time.sleep(self.poll_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        return {'workers': len(self._threads), 'max_pending': self.max_pending, **counters}
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Bulk receipt re-verification
+Re-runs the AI extraction over stored payment receipts (clearance_requests
+and document_requests) and reports requests whose reference number the
+receipt does not confirm, e.g. after changing the vision model or the
+receipt_ai heuristics. Rows are read in primary-key (keyset) order, one
+batch at a time; a thread pool extracts each batch at no more than --rpm
+calls per minute, and once a batch is done its rows go to the report and
+its last id to the checkpoint file, so an interrupted run resumes after the
+last finished batch. AI calls also go through the app's shared Groq rate
+limiter (GROQ_RPM/GROQ_TPM, same store), so a bulk run waits for quota the
+live site is not using. A run stops (resumable) while Groq is unavailable.
+Run manually: python receipt_reverify.py run [options] | status
+"""
+
+import argparse
+import base64
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Load environment variables from .env file
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+import receipt_ai
+from circuit_breaker import CircuitBreaker
+from groq_client import BUCKET_REQUESTS, BUCKET_TOKENS, GroqClient
+from rate_limiter import RateLimiter
+
+SOURCES = {'clearance': 'clearance_requests', 'document': 'document_requests'}
+
+OUTCOME_MATCH = 'match'
+OUTCOME_MISMATCH = 'mismatch'
+OUTCOME_UNREADABLE = 'unreadable'
+OUTCOME_ERROR = 'error'
+OUTCOME_UNAVAILABLE = 'unavailable'
+# Outcomes written to the report (matches are only counted)
+REPORTED = (OUTCOME_MISMATCH, OUTCOME_UNREADABLE, OUTCOME_ERROR)
+
+REPORT_FIELDS = ['source', 'request_id', 'student_id', 'created_at', 'stored_reference', 'extracted_reference',
+                 'confidence', 'amount', 'outcome', 'message']
+
+_LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+
+# Inline base64 is only selected when there is no S3 copy, so S3-backed rows stay small
+_QUERY = """
+    SELECT id, student_id, reference_number, created_at, payment_receipt_s3_key,
+           CASE WHEN payment_receipt_s3_key IS NULL OR payment_receipt_s3_key = ''
+                THEN payment_receipt END AS payment_receipt
+    FROM {table}
+    WHERE id > %s
+      AND reference_number IS NOT NULL AND reference_number != ''
+      AND ((payment_receipt_s3_key IS NOT NULL AND payment_receipt_s3_key != '') OR payment_receipt IS NOT NULL)
+      {since}
+    ORDER BY id
+    LIMIT %s
+"""
+
+
+class Pacer:
+    """Spaces calls evenly so at most `per_minute` start in any minute (0 = unlimited)"""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class ReceiptImages:
+    """Receipt JPEGs as base64, from S3 (payment_receipt_s3_key) or the payment_receipt column"""
+
+    def __init__(self, bucket: str, region: str):
+        self.bucket = bucket
+        self.region = region
+        self._s3 = None
+        self._lock = threading.Lock()
+
+    def _client(self):
+        with self._lock:
+            if self._s3 is None:
+                import boto3
+                self._s3 = boto3.client(
+                    's3',
+                    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                    region_name=self.region,
+                )
+            return self._s3
+
+    def image_b64(self, row: Dict[str, Any]) -> str:
+        key = (row.get('payment_receipt_s3_key') or '').strip()
+        if key:
+            body = self._client().get_object(Bucket=self.bucket, Key=key)['Body'].read()
+            return base64.b64encode(body).decode('ascii')
+        data = row.get('payment_receipt') or ''
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode('ascii', errors='ignore')
+        if data.startswith('data:'):
+            data = data.split(',', 1)[1]
+        return data
+
+
+def batches(cur, source: str, after_id: int, since: Optional[str], size: int) -> Iterator[List[Dict[str, Any]]]:
+    """Candidate rows of one table with id > after_id, `size` at a time"""
+    sql = _QUERY.format(table=SOURCES[source], since='AND created_at >= %s' if since else '')
+    while True:
+        args = (after_id, since, size) if since else (after_id, size)
+        cur.execute(sql, args)
+        rows = cur.fetchall() or []
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1]['id']
+        if len(rows) < size:
+            return
+
+
+def verify(source: str, row: Dict[str, Any], client: GroqClient, images: ReceiptImages,
+           pacer: Pacer, model: Optional[str]) -> Dict[str, Any]:
+    """Report record for one request"""
+    record = {
+        'source': source,
+        'request_id': row['id'],
+        'student_id': row.get('student_id'),
+        'created_at': str(row.get('created_at') or ''),
+        'stored_reference': row.get('reference_number') or '',
+        'extracted_reference': '',
+        'confidence': '',
+        'amount': '',
+        'outcome': OUTCOME_ERROR,
+        'message': '',
+    }
+    try:
+        image_b64 = images.image_b64(row)
+    except Exception as e:
+        record['message'] = f"Receipt image not readable: {e}"
+        return record
+    if not image_b64:
+        record['message'] = 'Receipt image is empty'
+        return record
+
+    pacer.wait()
+    result = receipt_ai.extract(client, image_b64, model)
+    while result.get('busy'):
+        # Shared quota used up (live traffic first): wait for it rather than stopping the run
+        time.sleep(max(1.0, result.get('retry_after') or 0))
+        result = receipt_ai.extract(client, image_b64, model)
+    if not result.get('ok'):
+        record['outcome'] = OUTCOME_UNAVAILABLE if result.get('ai_unavailable') else OUTCOME_ERROR
+        record['message'] = (result.get('message') or '')[:300]
+        return record
+
+    match = receipt_ai.match_reference(result, record['stored_reference'])
+    record.update({
+        'extracted_reference': result.get('reference_number') or '',
+        'confidence': result.get('confidence'),
+        'amount': result.get('amount'),
+    })
+    if match['matches']:
+        record['outcome'] = OUTCOME_MATCH
+    elif not match['has_digits']:
+        record['outcome'] = OUTCOME_UNREADABLE
+        record['message'] = 'No reference number found on the receipt'
+    else:
+        record['outcome'] = OUTCOME_MISMATCH
+        record['message'] = f"Receipt numbers: {', '.join(match['candidates'][:5]) or 'none'}"
+    return record
+
+
+def load_checkpoint(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]) -> None:
+    """Write via a temp file so a crash never leaves half a checkpoint"""
+    checkpoint['updated_at'] = datetime.now().isoformat(timespec='seconds')
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp, path)
+
+
+def append_report(path: str, records: List[Dict[str, Any]]) -> None:
+    new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        if new_file:
+            writer.writeheader()
+        writer.writerows(records)
+
+
+def _connect() -> Tuple[Any, Any]:
+    import pymysql
+    from db_migrations import get_db_config
+
+    connection = pymysql.connect(**get_db_config())
+    return connection.cursor(), connection
+
+
+def _groq_client(pool_size: int) -> GroqClient:
+    """Same GROQ_* settings and shared rate limits as the app, with a connection per worker thread"""
+    limiter = RateLimiter.from_store(
+        os.getenv('GROQ_RATE_LIMIT_STORE'),
+        {BUCKET_REQUESTS: float(os.getenv('GROQ_RPM', '30')), BUCKET_TOKENS: float(os.getenv('GROQ_TPM', '30000'))},
+        cursor=_connect,
+        prefix=os.getenv('CACHE_PREFIX', 'irequest'),
+    )
+    return GroqClient(
+        os.getenv('GROQ_API_KEY'),
+        connect_timeout=float(os.getenv('GROQ_CONNECT_TIMEOUT', '5')),
+        read_timeout=float(os.getenv('GROQ_READ_TIMEOUT', '30')),
+        max_attempts=int(os.getenv('GROQ_MAX_ATTEMPTS', '3')),
+        deadline=float(os.getenv('GROQ_DEADLINE_SECONDS', '45')),
+        pool_size=pool_size,
+        breaker=CircuitBreaker(
+            'groq',
+            failure_threshold=int(os.getenv('GROQ_BREAKER_FAILURES', '5')),
+            reset_timeout=float(os.getenv('GROQ_BREAKER_RESET_SECONDS', '30')),
+        ),
+        limiter=limiter,
+        rate_limit_wait=30.0,
+        tokens_per_call=float(os.getenv('GROQ_TOKENS_PER_CALL', '2000')),
+    )
+
+
+def run(args: argparse.Namespace) -> int:
+    import pymysql
+    from db_migrations import get_db_config
+
+    sources = list(SOURCES) if args.source == 'all' else [args.source]
+    options = {'sources': sources, 'since': args.since, 'model': args.model or receipt_ai.VISION_MODEL}
+    checkpoint = None if args.restart else load_checkpoint(args.checkpoint)
+    if checkpoint is None:
+        checkpoint = {'options': options, 'last_id': {s: 0 for s in sources},
+                      'counts': {o: 0 for o in (OUTCOME_MATCH,) + REPORTED}, 'done': []}
+        if os.path.exists(args.report):
+            os.remove(args.report)
+    elif checkpoint.get('options') != options:
+        print(f"⚠️ {args.checkpoint} belongs to a run with {checkpoint.get('options')}; "
+              f"pass the same options to resume, or --restart")
+        return 2
+
+    client = _groq_client(args.concurrency)
+    if not client.api_key:
+        print("❌ GROQ_API_KEY is not set")
+        return 2
+    images = ReceiptImages(os.getenv('AWS_S3_BUCKET', 'irequest-receipts'), os.getenv('AWS_REGION', 'ap-southeast-2'))
+    pacer = Pacer(args.rpm)
+    counts = checkpoint['counts']
+    processed = 0
+
+    connection = pymysql.connect(**get_db_config())
+    try:
+        with connection.cursor() as cur, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for source in sources:
+                if source in checkpoint['done']:
+                    continue
+                for rows in batches(cur, source, checkpoint['last_id'][source], args.since, args.batch_size):
+                    records = list(pool.map(
+                        lambda row: verify(source, row, client, images, pacer, args.model), rows
+                    ))
+                    unavailable = [r for r in records if r['outcome'] == OUTCOME_UNAVAILABLE]
+                    if unavailable:
+                        # Nothing from this batch is recorded; resuming redoes it
+                        print(f"⚠️ Groq unavailable ({unavailable[0]['message']}); stopped before {source} "
+                              f"request {rows[0]['id']}. Run again to resume.")
+                        return 1
+                    append_report(args.report, [r for r in records if r['outcome'] in REPORTED])
+                    for r in records:
+                        counts[r['outcome']] += 1
+                    checkpoint['last_id'][source] = rows[-1]['id']
+                    save_checkpoint(args.checkpoint, checkpoint)
+                    processed += len(records)
+                    print(f"   {source} up to id {rows[-1]['id']}: {counts[OUTCOME_MATCH]} match, "
+                          f"{counts[OUTCOME_MISMATCH]} mismatch, {counts[OUTCOME_UNREADABLE]} unreadable, "
+                          f"{counts[OUTCOME_ERROR]} error")
+                    if args.limit and processed >= args.limit:
+                        print(f"⏸️ Stopped after {processed} receipts (--limit). Run again to resume.")
+                        return 0
+                checkpoint['done'].append(source)
+                save_checkpoint(args.checkpoint, checkpoint)
+    finally:
+        connection.close()
+
+    print(f"✅ Re-verified {sum(counts.values())} receipts: {counts[OUTCOME_MISMATCH]} mismatch, "
+          f"{counts[OUTCOME_UNREADABLE]} unreadable, {counts[OUTCOME_ERROR]} error. Report: {args.report}")
+    return 0
+
+
+def status(args: argparse.Namespace) -> int:
+    checkpoint = load_checkpoint(args.checkpoint)
+    if checkpoint is None:
+        print(f"📋 No checkpoint at {args.checkpoint}")
+        return 0
+    print(f"📋 {args.checkpoint} (updated {checkpoint.get('updated_at')})")
+    print(f"   Options: {checkpoint.get('options')}")
+    for source, last_id in checkpoint.get('last_id', {}).items():
+        state = 'done' if source in checkpoint.get('done', []) else f"after id {last_id}"
+        print(f"   {source}: {state}")
+    print(f"   Counts: {checkpoint.get('counts')}")
+    return 0
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog='receipt_reverify.py', description='Re-run AI verification over stored receipts')
+    parser.add_argument('command', choices=['run', 'status'])
+    parser.add_argument('--source', choices=['all'] + list(SOURCES), default='all')
+    parser.add_argument('--since', help='only requests created on or after this date (YYYY-MM-DD)')
+    parser.add_argument('--model', help=f'vision model (default {receipt_ai.VISION_MODEL})')
+    parser.add_argument('--concurrency', type=int, default=4, help='receipts extracted at once (default 4)')
+    parser.add_argument('--rpm', type=float, default=30, help='most AI calls per minute, 0 = no cap (default 30)')
+    parser.add_argument('--batch-size', type=int, default=0, help='rows per batch/checkpoint (default 8 x concurrency)')
+    parser.add_argument('--limit', type=int, default=0, help='stop after about this many receipts (resumable)')
+    parser.add_argument('--checkpoint', default=os.path.join(_LOG_DIR, 'receipt_reverify.checkpoint.json'))
+    parser.add_argument('--report', default=os.path.join(_LOG_DIR, 'receipt_reverify_report.csv'))
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start a new report')
+    args = parser.parse_args(argv)
+    if args.since:
+        datetime.strptime(args.since, '%Y-%m-%d')
+    args.concurrency = max(1, args.concurrency)
+    args.batch_size = args.batch_size or 8 * args.concurrency
+    for path in (args.checkpoint, args.report):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return run(args) if args.command == 'run' else status(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
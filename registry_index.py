@@ -0,0 +1,162 @@
+"""
+In-memory student_registry index
+Sorted student numbers (bisect for prefix autocomplete, dict for exact
+lookup) plus a trigram index over names. Each load builds a new immutable
+snapshot and swaps it in, so readers never take a lock; the owner decides
+when to reload (see the version check in app.py).
+"""
+
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+
+def normalize(text: Any) -> str:
+    """Lowercase, accents stripped (Peña -> pena), single spaces"""
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().split())
+
+
+def trigrams(token: str) -> Set[str]:
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+class _Snapshot:
+    """One immutable build of the index"""
+
+    def __init__(self, rows: Iterable[Dict[str, Any]], version: Any):
+        self.version = version
+        records = []
+        for r in rows:
+            student_no = str(r.get('student_no') or '').strip()
+            if not student_no:
+                continue
+            records.append({
+                'student_no': student_no,
+                'first_name': r.get('first_name') or '',
+                'last_name': r.get('last_name') or '',
+                'middle_name': r.get('middle_name') or '',
+            })
+        records.sort(key=lambda rec: rec['student_no'].lower())
+        self.records = records
+        self.keys = [rec['student_no'].lower() for rec in records]
+        self.by_number = {k: i for i, k in enumerate(self.keys)}
+        self.names = [normalize(f"{rec['first_name']} {rec['middle_name']} {rec['last_name']}") for rec in records]
+        self.grams: Dict[str, Set[int]] = {}
+        for i, name in enumerate(self.names):
+            for token in name.split():
+                for gram in trigrams(token):
+                    self.grams.setdefault(gram, set()).add(i)
+
+
+class RegistryIndex:
+    """
+    Args:
+        refresh_interval: Seconds between version checks against the database
+    """
+
+    def __init__(self, refresh_interval: float = 60.0):
+        self.refresh_interval = refresh_interval
+        self._snapshot: Optional[_Snapshot] = None
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._refreshing = False
+        self._loaded_at: Optional[float] = None
+        self._counters = {'loads': 0, 'checks': 0, 'errors': 0}
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    @property
+    def version(self) -> Any:
+        snap = self._snapshot
+        return snap.version if snap is not None else None
+
+    def replace(self, rows: Iterable[Dict[str, Any]], version: Any) -> None:
+        snap = _Snapshot(rows, version)
+        with self._lock:
+            self._snapshot = snap
+            self._loaded_at = time.time()
+            self._counters['loads'] += 1
+
+    def due(self) -> bool:
+        return time.monotonic() - self._checked_at >= self.refresh_interval
+
+    def claim_refresh(self) -> bool:
+        """Claim the next version check; False if one is already running"""
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+            return True
+
+    def end_refresh(self, ok: bool = True) -> None:
+        with self._lock:
+            self._refreshing = False
+            self._checked_at = time.monotonic()
+            self._counters['checks'] += 1
+            if not ok:
+                self._counters['errors'] += 1
+
+    def lookup(self, student_no: str) -> Optional[Dict[str, Any]]:
+        snap = self._snapshot
+        if snap is None:
+            return None
+        i = snap.by_number.get((student_no or '').strip().lower())
+        return dict(snap.records[i]) if i is not None else None
+
+    def prefix(self, q: str, limit: int = 15) -> List[Dict[str, Any]]:
+        """Student numbers starting with q, in student_no order"""
+        snap = self._snapshot
+        if snap is None:
+            return []
+        q = (q or '').strip().lower()
+        out = []
+        i = bisect_left(snap.keys, q)
+        while i < len(snap.keys) and len(out) < limit and snap.keys[i].startswith(q):
+            out.append(dict(snap.records[i]))
+            i += 1
+        return out
+
+    def search_names(self, q: str, limit: int = 15) -> List[Dict[str, Any]]:
+        """Names containing every word of q (any order); word-start matches first, then last name"""
+        snap = self._snapshot
+        if snap is None:
+            return []
+        tokens = normalize(q).split()
+        if not tokens:
+            return []
+        candidates: Optional[Set[int]] = None
+        for token in tokens:
+            for gram in trigrams(token):
+                posting = snap.grams.get(gram, set())
+                candidates = set(posting) if candidates is None else candidates & posting
+                if not candidates:
+                    return []
+        pool = candidates if candidates is not None else range(len(snap.records))
+        matches = []
+        for i in pool:
+            name = snap.names[i]
+            if all(t in name for t in tokens):
+                words = name.split()
+                starts = sum(1 for t in tokens if any(w.startswith(t) for w in words))
+                rec = snap.records[i]
+                matches.append((-starts, normalize(rec['last_name']), normalize(rec['first_name']), i))
+        matches.sort()
+        return [dict(snap.records[m[-1]]) for m in matches[:limit]]
+
+    def stats(self) -> Dict[str, Any]:
+        snap = self._snapshot
+        return {
+            'ready': snap is not None,
+            'students': len(snap.records) if snap is not None else 0,
+            'trigrams': len(snap.grams) if snap is not None else 0,
+            'version': str(snap.version) if snap is not None else None,
+            'loaded_at': self._loaded_at,
+            'refresh_interval': self.refresh_interval,
+            **self._counters,
+        }
@@ -0,0 +1,75 @@
+"""
+Cached schema catalog
+Loads table columns once from information_schema so request handlers can
+check optional columns and reuse prebuilt SELECTs instead of running
+SHOW COLUMNS on every call.
+"""
+
+import threading
+from typing import Callable, Dict, FrozenSet, Hashable, Iterable, List, Optional
+
+
+class SchemaCatalog:
+    """
+    Column names per table for the current database
+
+    Args:
+        tables: Tables to track (None tracks every table in the schema)
+    """
+
+    def __init__(self, tables: Optional[Iterable[str]] = None):
+        self.tables = tuple(tables) if tables else None
+        self._lock = threading.Lock()
+        self._columns: Dict[str, FrozenSet[str]] = {}
+        self._compiled: Dict[Hashable, str] = {}
+        self.loaded = False
+        self.version = 0
+
+    def load(self, cur) -> None:
+        """(Re)load column names with a single information_schema query"""
+        sql = (
+            "SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name "
+            "FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE()"
+        )
+        params: tuple = ()
+        if self.tables:
+            sql += " AND TABLE_NAME IN (" + ", ".join(["%s"] * len(self.tables)) + ")"
+            params = self.tables
+        cur.execute(sql, params)
+        found: Dict[str, set] = {}
+        for row in cur.fetchall() or []:
+            found.setdefault(row['table_name'], set()).add(row['column_name'])
+        with self._lock:
+            self._columns = {t: frozenset(c) for t, c in found.items()}
+            self._compiled = {}
+            self.loaded = True
+            self.version += 1
+
+    def refresh(self, cur) -> None:
+        """Reload after migrations; drops every prebuilt SELECT"""
+        self.load(cur)
+
+    def ensure_loaded(self, cur) -> None:
+        """Load on first use when startup could not reach the database"""
+        if not self.loaded:
+            self.load(cur)
+
+    def columns(self, table: str) -> FrozenSet[str]:
+        return self._columns.get(table, frozenset())
+
+    def has_column(self, table: str, column: str) -> bool:
+        return column in self.columns(table)
+
+    def present(self, table: str, candidates: Iterable[str]) -> List[str]:
+        """Subset of candidate columns that exist, in the given order"""
+        cols = self.columns(table)
+        return [c for c in candidates if c in cols]
+
+    def compiled(self, key: Hashable, build: Callable[['SchemaCatalog'], str]) -> str:
+        """SQL built from the current catalog, memoized until the next load()"""
+        sql = self._compiled.get(key)
+        if sql is None:
+            sql = build(self)
+            with self._lock:
+                self._compiled[key] = sql
+        return sql
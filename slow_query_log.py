@@ -0,0 +1,167 @@
+"""
+Slow-query recorder
+Statements slower than a threshold are written to a rotating JSONL file with
+their fingerprint, parameter shape, duration, calling route and (for reads)
+an EXPLAIN FORMAT=JSON plan. File writes and EXPLAINs run on a background
+thread so the slow request is not made slower.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Any, Callable, Dict, Optional
+
+from query_stats import fingerprint
+
+_EXPLAINABLE = ('select', 'with')
+
+
+def params_shape(args: Any) -> Any:
+    """Describe query parameters by type (and string length) without logging values"""
+    def one(v):
+        if v is None:
+            return 'null'
+        if isinstance(v, (str, bytes)):
+            return f"{type(v).__name__}({len(v)})"
+        return type(v).__name__
+    if args is None:
+        return None
+    if isinstance(args, dict):
+        return {k: one(v) for k, v in args.items()}
+    if isinstance(args, (list, tuple)):
+        return [one(v) for v in args]
+    return one(args)
+
+
+class SlowQueryLog:
+    """
+    Args:
+        path: JSONL file to append to (rotated by size)
+        threshold_ms: Statements at or above this duration are recorded
+        explain_connection: Callable returning (cursor, connection) used for EXPLAIN;
+            None disables plan capture
+        explain_interval: Seconds before the same fingerprint is EXPLAINed again
+        max_bytes / backups: Rotation settings for the JSONL file
+    """
+
+    def __init__(self, path: str, threshold_ms: float = 500.0,
+                 explain_connection: Optional[Callable[[], Any]] = None,
+                 explain_interval: float = 300.0, max_bytes: int = 5 * 1024 * 1024,
+                 backups: int = 5, queue_size: int = 1000):
+        self.path = path
+        self.threshold = threshold_ms / 1000.0
+        self.explain_connection = explain_connection
+        self.explain_interval = explain_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._logger = logging.getLogger(f"irequest.slow_query.{os.path.abspath(path)}")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        if not self._logger.handlers:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._logger.addHandler(handler)
+        self._queue: 'queue.Queue[Dict[str, Any]]' = queue.Queue(maxsize=queue_size)
+        self._explained: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_pid = 0
+        self.recorded = 0
+        self.dropped = 0
+
+    def is_slow(self, duration: float) -> bool:
+        return duration >= self.threshold
+
+    def capture(self, cursor: Any, query: Any, args: Any, duration: float,
+                route: Optional[str] = None) -> None:
+        """Queue a record for a slow statement; never raises into the caller"""
+        try:
+            if isinstance(query, bytes):
+                query = query.decode('utf-8', 'replace')
+            fp = fingerprint(query)
+            entry: Dict[str, Any] = {
+                'ts': datetime.now().isoformat(timespec='seconds'),
+                'route': route,
+                'duration_ms': round(duration * 1000, 2),
+                'fingerprint': fp[:2000],
+                'params_shape': params_shape(args),
+                'rowcount': getattr(cursor, 'rowcount', None),
+            }
+            if self._should_explain(query, fp):
+                try:
+                    # Literal SQL is only used for EXPLAIN and is never written out
+                    entry['_explain_sql'] = cursor.mogrify(query, args)
+                except Exception:
+                    pass
+            self._ensure_worker()
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+        except Exception as e:
+            print(f"⚠️ Slow query capture failed: {e}")
+
+    def _should_explain(self, query: str, fp: str) -> bool:
+        if self.explain_connection is None:
+            return False
+        if query.lstrip().split(None, 1)[0].lower() not in _EXPLAINABLE:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            last = self._explained.get(fp)
+            if last is not None and now - last < self.explain_interval:
+                return False
+            self._explained[fp] = now
+        return True
+
+    def _ensure_worker(self) -> None:
+        # The worker thread does not survive fork; start one per process
+        if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+                return
+            self._worker_pid = os.getpid()
+            self._worker = threading.Thread(target=self._run, name='slow-query-log', daemon=True)
+            self._worker.start()
+
+    def _explain(self, sql: str) -> Dict[str, Any]:
+        cur, conn = self.explain_connection()  # type: ignore[misc]
+        try:
+            cur.execute("EXPLAIN FORMAT=JSON " + sql)
+            row = cur.fetchone() or {}
+            raw = row.get('EXPLAIN') if isinstance(row, dict) else (row[0] if row else None)
+            return {'plan': json.loads(raw) if raw else None}
+        except Exception as e:
+            # Class and code only: MySQL's message quotes the literal SQL near a parse error
+            code = e.args[0] if getattr(e, 'args', None) and isinstance(e.args[0], int) else None
+            return {'explain_error': type(e).__name__, 'explain_error_code': code}
+        finally:
+            cur.close()
+            conn.close()
+
+    def _run(self) -> None:
+        while True:
+            entry = self._queue.get()
+            try:
+                sql = entry.pop('_explain_sql', None)
+                if sql:
+                    entry.update(self._explain(sql))
+                self._logger.info(json.dumps(entry, default=str))
+                self.recorded += 1
+            except Exception as e:
+                print(f"⚠️ Slow query log write failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'path': self.path,
+            'threshold_ms': round(self.threshold * 1000, 2),
+            'recorded': self.recorded,
+            'queued': self._queue.qsize(),
+            'dropped': self.dropped,
+        }
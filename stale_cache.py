@@ -0,0 +1,79 @@
+"""
+Last-known-good response store
+Keeps the most recent successful JSON payload per (route, principal, params)
+so list endpoints can answer with a marked-stale copy while the database is
+slow or unreachable, and tracks which keys are being refreshed so only one
+background refresh runs per key.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class StaleCache:
+    """
+    Args:
+        max_entries: Least recently stored keys are evicted beyond this
+        max_stale: Seconds a payload may still be served after it was stored
+    """
+
+    def __init__(self, max_entries: int = 500, max_stale: float = 600.0):
+        self.max_entries = max_entries
+        self.max_stale = max_stale
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Hashable, Tuple[Any, float]]' = OrderedDict()
+        self._refreshing: set = set()
+        self._counters = {'stored': 0, 'served_stale': 0, 'refreshes': 0}
+
+    def put(self, key: Hashable, payload: Any) -> None:
+        with self._lock:
+            self._entries[key] = (payload, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._counters['stored'] += 1
+
+    def get(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """(payload, age in seconds) if a servable copy exists"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            payload, stored_at = item
+            age = time.time() - stored_at
+            if age > self.max_stale:
+                del self._entries[key]
+                return None
+            return payload, age
+
+    def has(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def mark_served(self) -> None:
+        with self._lock:
+            self._counters['served_stale'] += 1
+
+    def begin_refresh(self, key: Hashable) -> bool:
+        """Claim the background refresh for key; False if one is already running"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            self._counters['refreshes'] += 1
+            return True
+
+    def end_refresh(self, key: Hashable) -> None:
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'max_stale': self.max_stale,
+                'refreshing': len(self._refreshing),
+                **self._counters,
+            }
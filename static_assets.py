@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Fingerprinted, precompressed dashboard assets
+The build moves each dashboard's inline <style>/<script> blocks and its local
+/static/assets CSS/JS into files named after their content hash, so identical
+code shared by several dashboards is one download, cached "immutable" by the
+browser. Every output (pages included) gets .gz and, with the brotli package
+installed, .br siblings so the app can send the smallest encoding without
+compressing per request. manifest.json maps each template to its built page.
+Run manually: python static_assets.py build
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(ROOT, 'app', 'templates')
+STATIC_DIR = os.path.join(ROOT, 'app', 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+DIST_URL = '/static/dist'
+MANIFEST = 'manifest.json'
+
+DASHBOARDS = (
+    'student_dashboard.html',
+    'Registrar_Dashboard.html',
+    'Dean_Dashboard.html',
+    'Dean_CoEd_Dashboard.html',
+    'Dean_CS_Dashboard.html',
+    'Dean_HM_Dashboard.html',
+    'ComputerLaboratory_Dashboard.html',
+    'GuidanceOffice_Dashboard.html',
+    'StudentAffairs_dashboard.html',
+    'Library_Dashboard.html',
+    'Accounting_Dashboard.html',
+    'PropertyCustodian_Dashboard.html',
+)
+
+# Inline blocks smaller than this stay inline: not worth a request
+MIN_EXTERNAL_BYTES = 1024
+# Outputs smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 512
+
+# Left to right, so a "<style>" or "<link>" inside a script body is consumed with the script
+_BLOCKS = re.compile(
+    r'<!--.*?-->'
+    r'|<script\b(?P<script_attrs>[^>]*)>(?P<script_body>.*?)</script\s*>'
+    r'|<style\b(?P<style_attrs>[^>]*)>(?P<style_body>.*?)</style\s*>'
+    r'|<link\b(?P<link_attrs>[^>]*)>',
+    re.S | re.I,
+)
+_ATTR = r'''\b{name}\s*=\s*(["'])(.*?)\1'''
+_CSS_URL = re.compile(r'''url\(\s*(["']?)([^"')]+)\1\s*\)''')
+
+
+def _attr(attrs: str, name: str) -> Optional[str]:
+    m = re.search(_ATTR.format(name=name), attrs, re.S | re.I)
+    return m.group(2) if m else None
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def _is_classic_script(attrs: str) -> bool:
+    """Inline script that runs the same from a src= file (defer/async would change when it runs)"""
+    kind = (_attr(attrs, 'type') or '').strip().lower()
+    if kind not in ('', 'text/javascript', 'application/javascript'):
+        return False
+    return not re.search(r'\b(defer|async|nomodule)\b', attrs, re.I)
+
+
+class _Builder:
+    def __init__(self, templates_dir: str, static_dir: str, out_dir: str):
+        self.templates_dir = templates_dir
+        self.static_dir = static_dir
+        self.out_dir = out_dir
+        self.assets: Dict[str, Dict[str, Any]] = {}
+        self._by_hash: Dict[Tuple[str, str], str] = {}
+        self._local: Dict[str, Optional[str]] = {}
+
+    def emit(self, data: bytes, stem: str, ext: str, subdir: str = '') -> str:
+        """
+        Write data as <stem>.<hash><ext> (plus compressed variants); returns the path relative to out_dir
+
+        Content already written under another stem (the same block in another
+        dashboard) returns the existing file.
+        """
+        digest = content_hash(data)
+        rel = self._by_hash.get((digest, ext))
+        if rel is None:
+            rel = self._by_hash[(digest, ext)] = '/'.join(p for p in (subdir, f"{stem}.{digest}{ext}") if p)
+            path = os.path.join(self.out_dir, *rel.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+            self.assets[rel] = {'hash': digest, 'size': len(data), 'encodings': _compress(path, data)}
+        return rel
+
+    def local_asset(self, url: str, ext: str) -> Optional[str]:
+        """Fingerprinted copy of a /static/assets file referenced by a page (None if not local)"""
+        path = url.split('?', 1)[0].split('#', 1)[0]
+        if not path.startswith('/static/assets/') or not path.endswith(ext):
+            return None
+        if path in self._local:
+            return self._local[path]
+        source = os.path.join(self.static_dir, *path[len('/static/'):].split('/'))
+        if not os.path.isfile(source):
+            self._local[path] = None
+            return None
+        with open(source, 'rb') as f:
+            data = f.read()
+        if ext == '.css':
+            data = _absolute_css_urls(data, os.path.dirname(path) + '/')
+        stem = os.path.splitext(os.path.basename(path))[0]
+        self._local[path] = f"{DIST_URL}/{self.emit(data, stem, ext)}"
+        return self._local[path]
+
+    def page(self, name: str) -> Dict[str, Any]:
+        source = os.path.join(self.templates_dir, name)
+        with open(source, 'rb') as f:
+            raw = f.read()
+        html = raw.decode('utf-8')
+        if '{{' in html or '{%' in html:
+            raise ValueError(f"{name} uses Jinja syntax; only static templates can be prebuilt")
+        stem = os.path.splitext(name)[0].lower()
+        counter = {'css': 0, 'js': 0}
+
+        def replace(m: 're.Match[str]') -> str:
+            if m.group('script_attrs') is not None:
+                attrs, body = m.group('script_attrs'), m.group('script_body')
+                src = _attr(attrs, 'src')
+                if src is not None:
+                    url = self.local_asset(src, '.js')
+                    return m.group(0).replace(src, url, 1) if url else m.group(0)
+                if not _is_classic_script(attrs) or len(body.encode('utf-8')) < MIN_EXTERNAL_BYTES:
+                    return m.group(0)
+                counter['js'] += 1
+                rel = self.emit(body.strip().encode('utf-8') + b'\n', f"{stem}-{counter['js']}", '.js')
+                return f'<script src="{DIST_URL}/{rel}"{attrs}></script>'
+            if m.group('style_attrs') is not None:
+                attrs, body = m.group('style_attrs'), m.group('style_body')
+                if len(body.encode('utf-8')) < MIN_EXTERNAL_BYTES:
+                    return m.group(0)
+                counter['css'] += 1
+                rel = self.emit(body.strip().encode('utf-8') + b'\n', f"{stem}-{counter['css']}", '.css')
+                return f'<link rel="stylesheet" href="{DIST_URL}/{rel}"{attrs}>'
+            if m.group('link_attrs') is not None:
+                attrs = m.group('link_attrs')
+                href = _attr(attrs, 'href')
+                if href is not None and 'stylesheet' in (_attr(attrs, 'rel') or '').lower():
+                    url = self.local_asset(href, '.css')
+                    return m.group(0).replace(href, url, 1) if url else m.group(0)
+            return m.group(0)
+
+        built = _BLOCKS.sub(replace, html).encode('utf-8')
+        rel = self.emit(built, os.path.splitext(name)[0], '.html', 'pages')
+        return {
+            'file': rel,
+            'etag': self.assets[rel]['hash'],
+            'source_hash': content_hash(raw),
+            'source_size': len(raw),
+            'size': len(built),
+        }
+
+
+def _absolute_css_urls(data: bytes, base_url: str) -> bytes:
+    """Rewrite relative url(...) references against the stylesheet's original location"""
+    def fix(m: 're.Match[str]') -> str:
+        quote, target = m.group(1), m.group(2).strip()
+        if re.match(r'^([a-z][a-z0-9+.-]*:|/|#)', target, re.I):
+            return m.group(0)
+        return f"url({quote}{os.path.normpath(base_url + target).replace(os.sep, '/')}{quote})"
+    return _CSS_URL.sub(fix, data.decode('utf-8')).encode('utf-8')
+
+
+def _compress(path: str, data: bytes) -> List[str]:
+    """Write .gz/.br next to path; returns the encodings written"""
+    if len(data) < MIN_COMPRESS_BYTES:
+        return []
+    written = []
+    packed = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(packed) < len(data):
+        with open(path + '.gz', 'wb') as f:
+            f.write(packed)
+        written.append('gzip')
+    if brotli is not None:
+        packed = brotli.compress(data, quality=11)
+        if len(packed) < len(data):
+            with open(path + '.br', 'wb') as f:
+                f.write(packed)
+            written.append('br')
+    return written
+
+
+def build(pages: Iterable[str] = DASHBOARDS, templates_dir: str = TEMPLATES_DIR,
+          static_dir: str = STATIC_DIR, out_dir: str = DIST_DIR) -> Dict[str, Any]:
+    """Rebuild out_dir from scratch and return the manifest"""
+    staging = out_dir + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    builder = _Builder(templates_dir, static_dir, staging)
+    manifest = {'pages': {name: builder.page(name) for name in pages}, 'assets': builder.assets}
+    with open(os.path.join(staging, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    # Swap in whole so a running app never sees a half-written build
+    previous = out_dir + '.old'
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.isdir(out_dir):
+        os.rename(out_dir, previous)
+    os.rename(staging, out_dir)
+    shutil.rmtree(previous, ignore_errors=True)
+    return manifest
+
+
+class BuiltAssets:
+    """
+    Read side of the build: which built page to serve and in which encoding
+
+    A page whose template changed after the build is reported missing, so an
+    edited template is rendered directly until the next build.
+
+    Args:
+        out_dir: Build output directory (holds manifest.json)
+        templates_dir: Template sources the pages were built from
+    """
+
+    def __init__(self, out_dir: str = DIST_DIR, templates_dir: str = TEMPLATES_DIR):
+        self.out_dir = out_dir
+        self.templates_dir = templates_dir
+        self._lock = threading.Lock()
+        self._manifest: Dict[str, Any] = {}
+        self._manifest_mtime: Optional[int] = None
+        self._fresh: Dict[Tuple[str, int, int], bool] = {}
+
+    def _load(self) -> Dict[str, Any]:
+        path = os.path.join(self.out_dir, MANIFEST)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._manifest_mtime:
+            with self._lock:
+                manifest: Dict[str, Any] = {}
+                if mtime is not None:
+                    try:
+                        with open(path, encoding='utf-8') as f:
+                            manifest = json.load(f)
+                    except (OSError, ValueError) as e:
+                        print(f"⚠️ Ignoring unreadable asset manifest {path}: {e}")
+                self._manifest, self._manifest_mtime = manifest, mtime
+                self._fresh.clear()
+        return self._manifest
+
+    def _source_unchanged(self, name: str, entry: Dict[str, Any]) -> bool:
+        try:
+            st = os.stat(os.path.join(self.templates_dir, name))
+        except OSError:
+            return False
+        key = (name, st.st_mtime_ns, st.st_size)
+        fresh = self._fresh.get(key)
+        if fresh is None:
+            fresh = False
+            if st.st_size == entry.get('source_size'):
+                with open(os.path.join(self.templates_dir, name), 'rb') as f:
+                    fresh = content_hash(f.read()) == entry.get('source_hash')
+            if not fresh:
+                print(f"⚠️ {name} changed since the last asset build; serving the template (run: python static_assets.py build)")
+            self._fresh[key] = fresh
+        return fresh
+
+    def page(self, name: str) -> Optional[Dict[str, Any]]:
+        """Manifest entry of the built page for a template, if it is current"""
+        entry = self._load().get('pages', {}).get(name)
+        if entry is None or not self._source_unchanged(name, entry):
+            return None
+        return entry
+
+    def asset(self, rel: str) -> Optional[Dict[str, Any]]:
+        return self._load().get('assets', {}).get(rel)
+
+    def variant(self, rel: str, accepted: Iterable[str]) -> Tuple[str, Optional[str]]:
+        """(file path, Content-Encoding or None) for the best encoding the client accepts"""
+        entry = self.asset(rel) or {}
+        path = os.path.join(self.out_dir, *rel.split('/'))
+        accepted = set(accepted)
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if encoding in accepted and encoding in entry.get('encodings', ()):
+                return path + suffix, encoding
+        return path, None
+
+    def stats(self) -> Dict[str, Any]:
+        manifest = self._load()
+        return {
+            'built': bool(manifest),
+            'pages': len(manifest.get('pages', {})),
+            'assets': len(manifest.get('assets', {})),
+        }
+
+
+def main(argv: List[str]) -> int:
+    if argv[:1] not in ([], ['build']):
+        print("Usage: python static_assets.py build")
+        return 2
+    manifest = build()
+    if brotli is None:
+        print("⚠️ brotli not installed: only gzip variants written (pip install Brotli)")
+    for name, entry in sorted(manifest['pages'].items()):
+        print(f"✅ {name}: {entry['source_size'] // 1024} KB -> {entry['size'] // 1024} KB page ({entry['file']})")
+    total = sum(a['size'] for a in manifest['assets'].values())
+    print(f"✅ {len(manifest['assets'])} files, {total // 1024} KB before compression, in {DIST_DIR}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
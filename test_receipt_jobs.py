@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Test script to verify receipt job workers survive a failed database write
+"""
+import threading
+import time
+
+from receipt_jobs import STATUS_DONE, ReceiptJobQueue
+
+
+def test_worker_survives_finish_error():
+    """A _finish that raises once must not stop the worker from processing the next job"""
+    jobs = [{'id': 1, 'image': b'a', 'attempts': 1, 'claim_token': 't1'},
+            {'id': 2, 'image': b'b', 'attempts': 1, 'claim_token': 't2'}]
+    finished = []
+    done = threading.Event()
+
+    def no_database():
+        raise AssertionError('the database is not used in this test')
+
+    queue = ReceiptJobQueue(cursor=no_database, handler=lambda image: {'ok': True}, workers=1,
+                            poll_interval=0.01)
+    queue._maintain = lambda: None
+    queue._claim = lambda: jobs.pop(0) if jobs else None
+
+    def finish(job, status, result=None, error=None):
+        if job['id'] == 1:
+            raise RuntimeError('database unavailable')
+        finished.append((job['id'], status))
+        done.set()
+
+    queue._finish = finish
+    queue.start()
+    try:
+        assert done.wait(5), 'second job was never processed'
+        assert queue._threads[0].is_alive(), 'worker thread died'
+    finally:
+        queue.stop()
+    assert finished == [(2, STATUS_DONE)]
+
+
+if __name__ == "__main__":
+    print("Testing receipt job worker recovery...")
+    print("=" * 50)
+
+    try:
+        test_worker_survives_finish_error()
+        success = True
+    except AssertionError as e:
+        print(f"Error: {e}")
+        success = False
+
+    print("\n" + "=" * 50)
+    print(f"Test Result: {'PASS' if success else 'FAIL'}")